@@ -0,0 +1,444 @@
+"""Reduced ordered binary decision diagrams and equivalence checking.
+
+Comparing two circuits vector by vector takes 2**inputs evaluations.  A BDD
+instead represents each Output as a canonical graph of its Boolean function:
+with a fixed variable order, two functions are equal exactly when their
+reduced diagrams are the same node.  check_equivalence() builds the Outputs
+of two netlists in one shared BDD manager, so proving them equal is a
+comparison of node numbers, and a difference yields a counterexample by
+walking any path to 1 in the XOR of the two.
+
+The manager keeps a unique table per variable (so every function has one
+node), a computed table caching the results of apply() and negate(), and
+reference counts, so that variables can be reordered by sifting (Rudell's
+algorithm) once the diagrams grow: the size of a BDD depends heavily on the
+order, and the initial order only comes from a depth-first walk of the
+circuit.
+"""
+
+from netlist import EvaluationCancelled, format_value, sized_type
+
+FALSE, TRUE = 0, 1
+NODE_LIMIT = 1000000  # Live nodes before check_equivalence gives up
+REORDER_THRESHOLD = 20000  # Live nodes at which the first reordering happens
+REORDER_LIMIT = 250000  # Beyond this sifting takes longer than it saves
+MAX_GROWTH = 1.2  # Sifting stops moving a variable once the BDD grows this much
+CACHE_LIMIT = 1 << 20  # Entries of the computed table before it is cleared
+MAX_INPUTS = 512  # Recursion depth grows with the number of variables
+
+
+class BDD:
+    """A manager of reduced ordered BDDs over numbered variables.
+
+    A function is a node number: FALSE and TRUE are the terminals, and node
+    n > 1 tests variable var[n], continuing with low[n] when it is 0 and
+    high[n] when it is 1.  order lists the variables from the top level
+    down.  Callers ref() the functions they keep across a reorder(); all
+    other nodes are dropped by it.
+    """
+
+    def __init__(self, variables=0):
+        self.var = [None, None]
+        self.low = [FALSE, TRUE]
+        self.high = [FALSE, TRUE]
+        self.refs = [1, 1]  # Terminals are never dropped
+        self.order = []  # Level -> variable
+        self.level = []  # Variable -> level
+        self.unique = []  # Variable -> {(low, high): node}
+        self.cache = {}
+        self.live = 0  # Nodes in the unique tables
+        for _ in range(variables):
+            self.add_variable()
+
+    def add_variable(self):
+        """Add a variable below all the others and return its number"""
+        variable = len(self.level)
+        self.level.append(len(self.order))
+        self.order.append(variable)
+        self.unique.append({})
+        return variable
+
+    def variable(self, variable):
+        """The function that is true when the variable is"""
+        return self._make(variable, FALSE, TRUE)
+
+    def _make(self, variable, low, high):
+        if low == high:
+            return low  # The test would make no difference
+        table = self.unique[variable]
+        node = table.get((low, high))
+        if node is None:
+            node = len(self.var)
+            self.var.append(variable)
+            self.low.append(low)
+            self.high.append(high)
+            self.refs.append(0)
+            self.refs[low] += 1
+            self.refs[high] += 1
+            table[(low, high)] = node
+            self.live += 1
+        return node
+
+    def _cache(self, key, result):
+        if len(self.cache) >= CACHE_LIMIT:
+            self.cache.clear()
+        self.cache[key] = result
+        return result
+
+    def apply(self, op, f, g):
+        """Combine two functions with "and", "or" or "xor" """
+        if f > g:
+            f, g = g, f  # All three are symmetric, so one cache entry serves both orders
+        if f == FALSE:
+            return FALSE if op == "and" else g
+        if f == TRUE:
+            return g if op == "and" else TRUE if op == "or" else self.negate(g)
+        if f == g:
+            return FALSE if op == "xor" else f
+        key = (op, f, g)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        level = self.level
+        f_level, g_level = level[self.var[f]], level[self.var[g]]
+        top = self.var[f] if f_level <= g_level else self.var[g]
+        f0, f1 = (self.low[f], self.high[f]) if f_level <= g_level else (f, f)
+        g0, g1 = (self.low[g], self.high[g]) if g_level <= f_level else (g, g)
+        return self._cache(key, self._make(top, self.apply(op, f0, g0), self.apply(op, f1, g1)))
+
+    def negate(self, f):
+        if f <= TRUE:
+            return TRUE - f
+        key = ("not", f)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        return self._cache(key, self._make(self.var[f], self.negate(self.low[f]), self.negate(self.high[f])))
+
+    def ref(self, f):
+        self.refs[f] += 1
+
+    def deref(self, f):
+        """Release a reference.
+
+        A node nothing refers to stays in the unique table, where the
+        computed table may still find it, until the next collect().
+        """
+        if f > TRUE:
+            self.refs[f] -= 1
+
+    def _free(self, stack):
+        """Release references at once, dropping the nodes left without any"""
+        while stack:
+            node = stack.pop()
+            if node <= TRUE:
+                continue
+            self.refs[node] -= 1
+            if self.refs[node] == 0:
+                self._drop(node, stack)
+
+    def _drop(self, node, stack):
+        del self.unique[self.var[node]][(self.low[node], self.high[node])]
+        self.live -= 1
+        stack.append(self.low[node])
+        stack.append(self.high[node])
+
+    def collect(self):
+        """Drop every node that is neither ref()'d nor used by one that is"""
+        self.cache.clear()  # Could name dropped nodes
+        for table in self.unique:
+            stack = []
+            for node in [node for node in table.values() if self.refs[node] == 0]:
+                self._drop(node, stack)
+            self._free(stack)
+
+    def satisfy(self, f):
+        """One assignment {variable: 0/1} making f true, or None if f is FALSE"""
+        if f == FALSE:
+            return None
+        assignment = {}
+        while f > TRUE:
+            # A reduced node other than FALSE always has a path to TRUE
+            if self.high[f] != FALSE:
+                assignment[self.var[f]] = 1
+                f = self.high[f]
+            else:
+                assignment[self.var[f]] = 0
+                f = self.low[f]
+        return assignment
+
+    def _swap(self, level):
+        """Exchange the variables at level and level + 1 in place.
+
+        Node numbers keep their functions: a node of the upper variable that
+        depends on the lower one is rewritten to test the lower variable
+        first, and the nodes of the lower variable that only it used are
+        dropped.
+        """
+        x, y = self.order[level], self.order[level + 1]
+        var, low, high = self.var, self.low, self.high
+        upper = self.unique[x]
+        for node in list(upper.values()):
+            f0, f1 = low[node], high[node]
+            if var[f0] != y and var[f1] != y:
+                continue  # Does not involve y; stays a test of x, now further down
+            del upper[(f0, f1)]
+            f00, f01 = (low[f0], high[f0]) if var[f0] == y else (f0, f0)
+            f10, f11 = (low[f1], high[f1]) if var[f1] == y else (f1, f1)
+            g0 = self._make(x, f00, f10)
+            g1 = self._make(x, f01, f11)
+            self.refs[g0] += 1
+            self.refs[g1] += 1
+            var[node], low[node], high[node] = y, g0, g1
+            self.unique[y][(g0, g1)] = node
+            self._free([f0, f1])
+        self.order[level], self.order[level + 1] = y, x
+        self.level[x], self.level[y] = level + 1, level
+
+    def reorder(self):
+        """Sift every variable to the level where the BDD is smallest"""
+        self.collect()
+        count = len(self.order)
+        for variable in sorted(range(count), key=lambda v: -len(self.unique[v])):
+            start = level = self.level[variable]
+            best_size, best_level = self.live, level
+            limit = self.live * MAX_GROWTH
+            while level < count - 1:
+                self._swap(level)
+                level += 1
+                if self.live < best_size:
+                    best_size, best_level = self.live, level
+                if self.live > limit:
+                    break
+            while level > 0:
+                self._swap(level - 1)
+                level -= 1
+                if self.live < best_size:
+                    best_size, best_level = self.live, level
+                if level < start and self.live > limit:
+                    break
+            while level < best_level:
+                self._swap(level)
+                level += 1
+            while level > best_level:
+                self._swap(level - 1)
+                level -= 1
+        self.cache.clear()
+
+
+def _signal_nodes(signal):
+    """The BDD nodes of a signal: a list of bits, a tuple of signals or None"""
+    if signal is None:
+        return []
+    if isinstance(signal, tuple):
+        return [node for part in signal for node in _signal_nodes(part)]
+    return signal
+
+
+class _Builder:
+    """Builds the signals of netlists in one BDD, reordering as it grows"""
+
+    def __init__(self, bdd, cancel=None):
+        self.bdd = bdd
+        self.cancel = cancel
+        self.next_reorder = REORDER_THRESHOLD
+
+    def keep(self, signal):
+        for node in _signal_nodes(signal):
+            self.bdd.ref(node)
+
+    def release(self, signal):
+        for node in _signal_nodes(signal):
+            self.bdd.deref(node)
+
+    def check_size(self):
+        bdd = self.bdd
+        if self.next_reorder < bdd.live <= REORDER_LIMIT:
+            bdd.reorder()
+            self.next_reorder = max(REORDER_THRESHOLD, 2 * bdd.live)
+        if bdd.live > NODE_LIMIT:
+            bdd.collect()
+        if bdd.live > NODE_LIMIT:
+            raise ValueError(f"The BDDs grew past {NODE_LIMIT} nodes; the circuits are too complex to compare")
+
+    def outputs(self, netlist, inputs):
+        """The signals of netlist's Outputs, given the signal of every Input.
+
+        Every node's signal is kept (ref()'d) until its last reader has been
+        built, so the BDD can be reordered between any two nodes.  The
+        returned signals are kept; release() them when done.
+        """
+        signals = [None] * len(netlist)
+        readers = [0] * len(netlist)
+        for drivers in netlist.fanin:
+            for driver in drivers:
+                if driver is not None:
+                    readers[driver] += 1
+        outputs = set(netlist.outputs)
+        for node, signal in zip(netlist.inputs, inputs):
+            signals[node] = signal
+            self.keep(signal)
+        for count, node in enumerate(netlist.order):
+            if self.cancel is not None and count % 256 == 0 and self.cancel.is_set():
+                raise EvaluationCancelled()
+            if netlist.ops[node] is not None:
+                signals[node] = self.node(netlist, node, [None if d is None else signals[d]
+                                                          for d in netlist.fanin[node]])
+                self.keep(signals[node])
+                for driver in netlist.fanin[node]:
+                    if driver is not None:
+                        readers[driver] -= 1
+                        if readers[driver] == 0 and driver not in outputs:
+                            self.release(signals[driver])
+                self.check_size()
+        for node in netlist.inputs:
+            if readers[node]:
+                self.release(signals[node])  # Read by a node that is never evaluated
+        return [signals[node] for node in netlist.outputs]
+
+    def node(self, netlist, node, operands):
+        """The signal of one node from the signals of its drivers"""
+        node_type = netlist.types[node]
+        if any(operand is None for operand in operands):
+            return None  # As in simulation, undefined in means undefined out
+        base, size = sized_type(node_type)
+        bdd = self.bdd
+        if node_type in ("Output", "Write Output"):
+            return operands[0]
+        if node_type in ("Constant 0", "Constant 1"):
+            return [TRUE if node_type == "Constant 1" else FALSE]
+        if node_type.startswith("Port "):
+            return operands[0][int(node_type[5:])]
+        if base == "Merge":
+            return [operand[0] for operand in operands]
+        if base == "Split":
+            bits = operands[0]
+            return tuple([bits[i] if i < len(bits) else FALSE] for i in range(size))
+        if node_type in netlist.modules:
+            body = netlist.modules[node_type].netlist
+            _check_combinational(body, f"Subcircuit {node_type}")
+            outputs = self.outputs(body, operands)
+            result = tuple(outputs)
+            self.release(result)  # Kept again by the caller
+            return result
+        if base == "NOT":
+            return [bdd.negate(bit) for bit in operands[0]]
+        op = {"AND": "and", "NAND": "and", "OR": "or", "NOR": "or", "XOR": "xor", "XNOR": "xor"}.get(base)
+        if op is None:
+            raise ValueError(f"Cannot compare circuits containing {node_type} nodes")
+        bits = []
+        for i in range(netlist.widths[node]):
+            # Narrower operands are zero-extended, as in simulation
+            result = None
+            for operand in operands:
+                bit = operand[i] if i < len(operand) else FALSE
+                result = bit if result is None else bdd.apply(op, result, bit)
+            bits.append(bdd.negate(result) if base in ("NAND", "NOR", "XNOR") else result)
+        return bits
+
+
+def _check_combinational(netlist, name):
+    if netlist.clocks or netlist.state:
+        raise ValueError(f"{name} has Clocks or flip-flops; only combinational circuits can be compared")
+    if netlist.cyclic:
+        raise ValueError(f"{name} has a combinational loop")
+
+
+def _input_order(netlists):
+    """Input positions in the order a depth-first walk from the Outputs meets them.
+
+    Inputs that feed the same gates end up next to each other, which keeps
+    the BDDs of most circuits small before any reordering.
+    """
+    order = []
+    seen = set()
+    for netlist in netlists:
+        position = {node: i for i, node in enumerate(netlist.inputs)}
+        visited = set()
+        for output in netlist.outputs:
+            stack = [output]
+            while stack:
+                node = stack.pop()
+                if node in visited:
+                    continue
+                visited.add(node)
+                if node in position and position[node] not in seen:
+                    seen.add(position[node])
+                    order.append(position[node])
+                stack.extend(d for d in reversed(netlist.fanin[node]) if d is not None)
+    order.extend(i for i in range(max(len(n.inputs) for n in netlists)) if i not in seen)
+    return order
+
+
+class Counterexample:
+    """An input vector on which two circuits differ"""
+
+    def __init__(self, inputs, output, first_value, second_value, width=1):
+        self.inputs = inputs  # 0/1 per Input, in netlist.inputs order
+        self.output = output  # Position of an Output that differs
+        self.first_value = first_value
+        self.second_value = second_value
+        self.width = width
+
+    def __str__(self):
+        first = format_value(self.first_value, self.width) or "undefined"
+        second = format_value(self.second_value, self.width) or "undefined"
+        return (f"Inputs {''.join(map(str, self.inputs))}: Output {self.output + 1} "
+                f"is {first} in the first circuit and {second} in the second")
+
+
+def check_equivalence(first, second, cancel=None):
+    """Prove two combinational netlists equivalent, or find where they differ.
+
+    Inputs and Outputs are matched by position in netlist.inputs and
+    netlist.outputs (top-to-bottom, then left-to-right in the editor).
+    Returns None when every Output computes the same function, or else a
+    Counterexample whose values were checked by simulating both netlists.
+    Raises ValueError for circuits that cannot be compared, and
+    EvaluationCancelled if the threading.Event cancel gets set.
+    """
+    for netlist, name in ((first, "The first circuit"), (second, "The second circuit")):
+        _check_combinational(netlist, name)
+    if len(first.inputs) != len(second.inputs) or len(first.outputs) != len(second.outputs):
+        raise ValueError(f"The circuits differ in shape: {len(first.inputs)} Inputs and {len(first.outputs)} "
+                         f"Outputs against {len(second.inputs)} and {len(second.outputs)}")
+    if len(first.inputs) > MAX_INPUTS:
+        raise ValueError(f"Circuits of more than {MAX_INPUTS} Inputs are too large to compare")
+
+    bdd = BDD()
+    variables = [None] * len(first.inputs)
+    for position in _input_order([first, second]):
+        variables[position] = bdd.add_variable()
+    inputs = [[bdd.variable(variable)] for variable in variables]
+    builder = _Builder(bdd, cancel)
+    for signal in inputs:
+        builder.keep(signal)  # Both netlists read them
+    first_outputs = builder.outputs(first, inputs)
+    second_outputs = builder.outputs(second, inputs)
+
+    for position, (a, b) in enumerate(zip(first_outputs, second_outputs)):
+        if a is None or b is None:
+            if a is None and b is None:
+                continue
+            assignment = {}  # Defined in one circuit only, so for any vector
+        else:
+            assignment = None
+            for i in range(max(len(a), len(b))):
+                difference = bdd.apply("xor", a[i] if i < len(a) else FALSE, b[i] if i < len(b) else FALSE)
+                assignment = bdd.satisfy(difference)
+                if assignment is not None:
+                    break
+            if assignment is None:
+                continue
+        vector = [assignment.get(variable, 0) for variable in variables]
+        return _counterexample(first, second, vector, position)
+    return None
+
+
+def _counterexample(first, second, vector, position):
+    values = []
+    for netlist in (first, second):
+        evaluated = netlist.snapshot().evaluate(dict(zip(netlist.inputs, vector)))
+        values.append(evaluated[netlist.outputs[position]])
+    width = max(first.widths[first.outputs[position]], second.widths[second.outputs[position]])
+    return Counterexample(vector, position, values[0], values[1], width)
@@ -0,0 +1,285 @@
+"""Performance benchmarks on synthetic circuits.
+
+Builds the circuits of circuit_gen.py and times the work the editor and the
+command-line simulator do with them, then writes the results as JSON so runs
+of different releases can be compared:
+
+    python benchmark.py --output results.json
+    python benchmark.py --size 20000 --circuit random --circuit xor_tree
+    python benchmark.py --baseline results.json   # flag what got slower
+    python benchmark.py --headless                # without PyQt5
+
+The headless benchmarks cover file I/O, importing BLIF and Verilog, compiling, optimizing, evaluating one
+vector, bit-parallel batches and incremental propagation.  Unless --headless
+is given the editor is benchmarked too (loading into a scene, opening a file,
+which is virtual for big circuits, drawing the background and painting the
+items, propagating an edited Input through the worker thread, undo and redo)
+on the offscreen Qt platform, so no display is needed.  Every timing is the best of --repeat runs.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from batch_sim import simulate_columns
+from circuit_gen import GENERATORS
+from circuit_io import read_binary, read_json, write_binary, write_json
+from logic_opt import optimize
+from netlist_io import read_blif, read_verilog, write_blif, write_verilog
+from netlist import Netlist, parse_bit
+
+DEFAULT_SIZE = 5000  # Roughly the number of gates per circuit
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25  # Slowdown reported as a regression by --baseline
+BATCH_VECTORS = 4096
+PROPAGATIONS = 100
+UNDO_STEPS = 100  # Added nodes, then as many moves; within the undo depth
+VIEWPORT = (1920, 1080)
+
+
+def measure(run, repeat, setup=None):
+    """Best time of `repeat` calls of run(setup()); setup is not timed"""
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Benchmarks:
+    """Collects results as {"circuit", "benchmark", "seconds", ...} records"""
+
+    def __init__(self, repeat=DEFAULT_REPEAT, log=None):
+        self.repeat = repeat
+        self.log = log
+        self.results = []
+
+    def time(self, circuit_name, name, run, setup=None, items=None):
+        seconds = measure(run, self.repeat, setup)
+        result = {"circuit": circuit_name, "benchmark": name, "seconds": seconds}
+        if items:
+            result["items"] = items
+            result["seconds_per_item"] = seconds / items
+        self.results.append(result)
+        if self.log:
+            print(f"{circuit_name:>18} {name:<18} {seconds * 1000:10.2f} ms", file=self.log)
+        return seconds
+
+
+def headless_benchmarks(bench, name, circuit, seed=0):
+    binary = io.BytesIO()
+    write_binary(circuit, binary)
+    text = io.StringIO()
+    write_json(circuit, text)
+    bench.time(name, "save_binary", lambda _: write_binary(circuit, io.BytesIO()))
+    bench.time(name, "load_binary", lambda _: read_binary(io.BytesIO(binary.getvalue())))
+    bench.time(name, "save_json", lambda _: write_json(circuit, io.StringIO()))
+    bench.time(name, "load_json", lambda _: read_json(io.StringIO(text.getvalue())))
+    blif = io.StringIO()
+    write_blif(circuit, blif)
+    verilog = io.StringIO()
+    write_verilog(circuit, verilog)
+    bench.time(name, "import_blif", lambda _: read_blif(io.StringIO(blif.getvalue())))
+    bench.time(name, "import_verilog", lambda _: read_verilog(io.StringIO(verilog.getvalue())))
+
+    bench.time(name, "compile", lambda _: Netlist.from_circuit(circuit))
+    netlist = Netlist.from_circuit(circuit)
+    bench.time(name, "optimize", lambda _: optimize(netlist))
+
+    inputs = {node: parse_bit(circuit.values[node]) for node in netlist.inputs}
+    bench.time(name, "evaluate", lambda _: netlist.evaluate(inputs))
+
+    rng = random.Random(seed)
+    vectors = ["".join(rng.choice("01") for _ in netlist.inputs) for _ in range(BATCH_VECTORS)]
+    bench.time(name, "batch_evaluate", lambda _: simulate_columns(netlist, vectors), items=BATCH_VECTORS)
+
+    def toggle_inputs(_):
+        # Flip one Input at a time, so each step re-evaluates one fanout cone
+        for step in range(PROPAGATIONS):
+            node = netlist.inputs[step % len(netlist.inputs)]
+            inputs[node] = 1 - (inputs[node] or 0)
+            netlist.propagate(inputs)
+
+    if netlist.inputs:
+        netlist.evaluate(inputs)
+        bench.time(name, "propagate", toggle_inputs, items=PROPAGATIONS)
+
+
+def gui_benchmarks(bench, name, circuit, editor):
+    from PyQt5.QtCore import QEventLoop, QPointF, QRectF, Qt, QTimer
+    from PyQt5.QtGui import QImage, QPainter
+    from PyQt5.QtWidgets import QApplication
+    from node_editor_gui import AddNodeCommand, MoveNodesCommand, NodeGraphicsScene
+
+    scenes = []
+
+    def new_scene():
+        scene = NodeGraphicsScene(editor)
+        scenes.append(scene)
+        return scene
+
+    bench.time(name, "scene_load", lambda scene: scene.load_circuit(circuit), setup=new_scene)
+    bench.time(name, "scene_open", lambda scene: scene.open_circuit(circuit), setup=new_scene)
+    scene = new_scene()
+    nodes = scene.load_circuit(circuit)
+
+    image = QImage(*VIEWPORT, QImage.Format_ARGB32_Premultiplied)
+    viewport = QRectF(0, 0, *VIEWPORT)
+
+    def paint(draw):
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        draw(painter)
+        painter.end()
+
+    # One screenful at 100% zoom, then the whole circuit zoomed out to fit
+    bench.time(name, "draw_background", lambda _: paint(lambda p: scene.drawBackground(p, viewport)))
+    bench.time(name, "paint_viewport", lambda _: paint(lambda p: scene.render(p, viewport, viewport)))
+    bounds = scene.itemsBoundingRect()
+    bench.time(name, "paint_overview", lambda _: paint(lambda p: scene.render(p, viewport, bounds)))
+
+    inputs = [node for node in nodes if node.text == "Input"]
+    if inputs:
+        def evaluate(start):
+            # Connect first: a quick job may finish before start() returns
+            loop = QEventLoop()
+            scene.evaluation_finished.connect(loop.quit, Qt.QueuedConnection)
+            QTimer.singleShot(60000, loop.quit)
+            start()
+            loop.exec_()
+            scene.evaluation_finished.disconnect(loop.quit)
+
+        evaluate(scene.refresh_outputs)
+
+        def edit_input(_):
+            # From typing a value until the Outputs show the result
+            node = inputs[0]
+            evaluate(lambda: node.set_value_text("0" if node.value_text == "1" else "1"))
+
+        bench.time(name, "gui_propagate", edit_input)
+
+    def fill_history():
+        editor.undo_stack.clear()
+        added = []
+        for i in range(UNDO_STEPS):
+            command = AddNodeCommand(scene, "AND", -1000, i * 60)
+            editor.execute_command(command)
+            added.append(command.node)
+        for node in added:
+            editor.execute_command(MoveNodesCommand(scene, {node: (node.pos(), node.pos() + QPointF(-200, 0))}))
+
+    def undo_redo(_):
+        for _ in range(2 * UNDO_STEPS):
+            editor.undo()
+        for _ in range(2 * UNDO_STEPS):
+            editor.redo()
+
+    bench.time(name, "undo_redo", undo_redo, setup=fill_history, items=4 * UNDO_STEPS)
+    editor.undo_stack.clear()
+
+    QApplication.processEvents()  # Let deferred refreshes run before shutting down
+    for scene in scenes:
+        scene.shutdown()
+        scene.deleteLater()
+    QApplication.processEvents()
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, log=sys.stderr):
+    """Print how results differ from a baseline run; returns the regressions"""
+    old = {(result["circuit"], result["benchmark"]): result["seconds"] for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = old.get((result["circuit"], result["benchmark"]))
+        if not before:
+            continue
+        ratio = result["seconds"] / before
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(result)
+        print(f"{result['circuit']:>18} {result['benchmark']:<18} {ratio:6.2f}x{flag}", file=log)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark simulation and editing on synthetic circuits.")
+    parser.add_argument("--circuit", action="append", choices=sorted(GENERATORS),
+                        help="circuit to benchmark; may be repeated (default: all)")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE,
+                        help=f"approximate number of gates per circuit (default {DEFAULT_SIZE})")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random circuits and vectors")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"runs per benchmark, of which the best counts (default {DEFAULT_REPEAT})")
+    parser.add_argument("--headless", action="store_true", help="skip the editor benchmarks")
+    parser.add_argument("--output", help="write the results to this JSON file (default: standard output)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"slowdown that counts as a regression (default {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+
+    editor = None
+    qt_version = None
+    if not args.headless:
+        # Must be set before the QApplication is created
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        try:
+            from PyQt5.QtCore import QT_VERSION_STR
+            from PyQt5.QtWidgets import QApplication
+            from node_editor_gui import NodeEditor
+        except ImportError as error:
+            print(f"Skipping the editor benchmarks: {error}", file=sys.stderr)
+        else:
+            app = QApplication.instance() or QApplication(sys.argv[:1])
+            editor = NodeEditor()
+            qt_version = QT_VERSION_STR
+
+    bench = Benchmarks(max(1, args.repeat), log=sys.stderr)
+    circuits = []
+    for name in args.circuit or sorted(GENERATORS):
+        circuit = GENERATORS[name](args.size, args.seed)
+        circuits.append({"name": name, "nodes": len(circuit), "wires": len(circuit.wire_src)})
+        headless_benchmarks(bench, name, circuit, args.seed)
+        if editor is not None:
+            gui_benchmarks(bench, name, circuit, editor)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt": qt_version,
+        "size": args.size,
+        "seed": args.seed,
+        "repeat": bench.repeat,
+        "circuits": circuits,
+        "results": bench.results,
+    }
+    if editor is not None:
+        editor.close()
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+
+    if args.baseline:
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as error:
+            print(f"Could not read {args.baseline}: {error}", file=sys.stderr)
+            return 1
+        if compare(bench.results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Synthetic circuits for benchmarking and testing.
+
+Every generator returns a CircuitData (see circuit_io) with the nodes laid out
+left to right by logic level, so the result can be simulated headlessly,
+saved, or loaded into the editor.  Generators taking a seed are deterministic
+for a given seed.
+"""
+
+import random
+
+from circuit_io import CircuitData
+
+COLUMN_WIDTH = 180  # Horizontal distance between logic levels
+ROW_HEIGHT = 80
+RANDOM_GATES = ("AND", "OR", "NAND", "NOR", "XOR", "XNOR", "NOT")
+
+
+def ripple_carry_adder(bits):
+    """An n-bit adder of full adders; Inputs a0, b0, a1, b1, ..., carry in"""
+    circuit = CircuitData()
+    carry = circuit.add_node("Input", 0, 2 * bits * ROW_HEIGHT, "0")
+    sums = []
+    for bit in range(bits):
+        y = 2 * bit * ROW_HEIGHT
+        a = circuit.add_node("Input", 0, y, "1")
+        b = circuit.add_node("Input", 0, y + ROW_HEIGHT, "0")
+        x = (bit + 1) * 3 * COLUMN_WIDTH
+        half = circuit.add_node("XOR", x, y)
+        total = circuit.add_node("XOR", x + COLUMN_WIDTH, y)
+        generate = circuit.add_node("AND", x, y + ROW_HEIGHT)
+        propagate = circuit.add_node("AND", x + COLUMN_WIDTH, y + ROW_HEIGHT)
+        carry_out = circuit.add_node("OR", x + 2 * COLUMN_WIDTH, y + ROW_HEIGHT)
+        circuit.add_wire(a, half, 0)
+        circuit.add_wire(b, half, 1)
+        circuit.add_wire(half, total, 0)
+        circuit.add_wire(carry, total, 1)
+        circuit.add_wire(a, generate, 0)
+        circuit.add_wire(b, generate, 1)
+        circuit.add_wire(half, propagate, 0)
+        circuit.add_wire(carry, propagate, 1)
+        circuit.add_wire(generate, carry_out, 0)
+        circuit.add_wire(propagate, carry_out, 1)
+        sums.append(total)
+        carry = carry_out
+    right = (bits + 2) * 3 * COLUMN_WIDTH
+    for bit, total in enumerate(sums):
+        output = circuit.add_node("Output", right, 2 * bit * ROW_HEIGHT)
+        circuit.add_wire(total, output, 0)
+    output = circuit.add_node("Output", right, 2 * bits * ROW_HEIGHT)
+    circuit.add_wire(carry, output, 0)
+    return circuit
+
+
+def xor_tree(leaves):
+    """A balanced tree of XOR gates computing the parity of `leaves` Inputs"""
+    circuit = CircuitData()
+    level = [circuit.add_node("Input", 0, i * ROW_HEIGHT, str(i % 2)) for i in range(max(1, leaves))]
+    depth = 0
+    while len(level) > 1:
+        depth += 1
+        spacing = ROW_HEIGHT * (1 << depth)
+        paired = []
+        for i in range(0, len(level) - 1, 2):
+            gate = circuit.add_node("XOR", depth * COLUMN_WIDTH, (i // 2) * spacing)
+            circuit.add_wire(level[i], gate, 0)
+            circuit.add_wire(level[i + 1], gate, 1)
+            paired.append(gate)
+        if len(level) % 2:
+            paired.append(level[-1])  # The odd one out moves up a level as is
+        level = paired
+    output = circuit.add_node("Output", (depth + 1) * COLUMN_WIDTH, 0)
+    circuit.add_wire(level[0], output, 0)
+    return circuit
+
+
+def reconvergent_dag(depth, width, seed=0):
+    """`depth` layers of `width` gates, each fed by two gates of the layer before.
+
+    Every signal fans out to about two gates in the next layer, so paths split
+    and merge again many times, which is the worst case for naive recursive
+    evaluation.
+    """
+    rng = random.Random(seed)
+    circuit = CircuitData()
+    layer = [circuit.add_node("Input", 0, i * ROW_HEIGHT, str(rng.randint(0, 1))) for i in range(width)]
+    for level in range(1, depth + 1):
+        gates = []
+        for i in range(width):
+            gate = circuit.add_node(rng.choice(RANDOM_GATES[:-1]), level * COLUMN_WIDTH, i * ROW_HEIGHT)
+            circuit.add_wire(layer[i], gate, 0)
+            circuit.add_wire(layer[rng.randrange(width)], gate, 1)
+            gates.append(gate)
+        layer = gates
+    for i, gate in enumerate(layer):
+        output = circuit.add_node("Output", (depth + 1) * COLUMN_WIDTH, i * ROW_HEIGHT)
+        circuit.add_wire(gate, output, 0)
+    return circuit
+
+
+def random_netlist(gates, inputs=None, outputs=None, seed=0):
+    """`gates` random gates, each driven by earlier nodes, so there are no loops"""
+    rng = random.Random(seed)
+    inputs = inputs or max(2, gates // 20)
+    outputs = outputs or max(1, gates // 20)
+    circuit = CircuitData()
+    columns = max(1, int(gates ** 0.5))
+    drivers = [circuit.add_node("Input", 0, i * ROW_HEIGHT, str(rng.randint(0, 1))) for i in range(inputs)]
+    for i in range(gates):
+        gate_type = rng.choice(RANDOM_GATES)
+        gate = circuit.add_node(gate_type, (1 + i % columns) * COLUMN_WIDTH, (i // columns) * ROW_HEIGHT)
+        # Prefer recent nodes, so the netlist gets deep rather than wide
+        for socket in range(1 if gate_type == "NOT" else 2):
+            window = min(len(drivers), 4 * columns)
+            circuit.add_wire(drivers[-rng.randint(1, window)], gate, socket)
+        drivers.append(gate)
+    for i in range(outputs):
+        output = circuit.add_node("Output", (columns + 2) * COLUMN_WIDTH, i * ROW_HEIGHT)
+        circuit.add_wire(drivers[-1 - i], output, 0)
+    return circuit
+
+
+# Name -> generator taking a size and a seed; size is roughly the gate count
+GENERATORS = {
+    "ripple_adder": lambda size, seed=0: ripple_carry_adder(max(1, size // 5)),
+    "xor_tree": lambda size, seed=0: xor_tree(size + 1),
+    "reconvergent_dag": lambda size, seed=0: reconvergent_dag(max(1, size // 64), 64, seed),
+    "random": lambda size, seed=0: random_netlist(size, seed=seed),
+}
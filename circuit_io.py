@@ -0,0 +1,322 @@
+"""Reading and writing circuits to disk.
+
+A circuit is stored column by column in a CircuitData: one entry per node in
+`types`, `xs`, `ys` and `values`, and one entry per wire in `wire_src`,
+`wire_dst`, `wire_socket` and `wire_src_socket` (the driving node, the driven
+node, the index of the driven input socket and the index of the driving
+output socket).  Subcircuit definitions used by the circuit are stored along
+with it in `modules`, each one a CircuitData of its own.  Two on-disk formats
+are supported:
+
+* .lcb -- compact binary.  A small header and string tables followed by each
+  column as a packed little-endian array, so loading is a handful of
+  array.frombytes() calls no matter how many gates the design has.
+* .jsonl -- streaming JSON.  A header object followed by one JSON object per
+  node and per wire, one per line, so a reader can process the file
+  incrementally without holding the whole document in memory.
+"""
+
+import io
+import json
+import struct
+import sys
+from array import array
+
+BINARY_MAGIC = b"LCB"
+JSON_FORMAT = "logic-circuit"
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)  # Version 1 had no output socket column and no modules
+
+BINARY_EXTENSION = ".lcb"
+JSON_EXTENSION = ".jsonl"
+FILE_FILTER = "Circuit Files (*.lcb *.jsonl);;Binary Circuit (*.lcb);;JSON Lines Circuit (*.jsonl)"
+
+_HEADER = struct.Struct("<IIII")
+_LENGTH = struct.Struct("<H")
+_COUNT = struct.Struct("<I")
+
+
+class CircuitFormatError(ValueError):
+    """Raised when a circuit file is malformed or of an unknown version"""
+
+
+class CircuitData:
+    """Columnar, Qt-free description of a circuit"""
+
+    def __init__(self):
+        self.types = []
+        self.xs = []
+        self.ys = []
+        self.values = []
+        self.wire_src = []
+        self.wire_dst = []
+        self.wire_socket = []
+        self.wire_src_socket = []
+        self.modules = {}  # Subcircuit name -> CircuitData of its body
+
+    def __len__(self):
+        return len(self.types)
+
+    def add_node(self, node_type, x, y, value=""):
+        """Append a node and return its index"""
+        self.types.append(node_type)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.values.append(value)
+        return len(self.types) - 1
+
+    def add_wire(self, src, dst, socket, src_socket=0):
+        """Connect output `src_socket` of node src to input `socket` of node dst"""
+        self.wire_src.append(src)
+        self.wire_dst.append(dst)
+        self.wire_socket.append(socket)
+        self.wire_src_socket.append(src_socket)
+
+    def wires(self):
+        """Iterate over (src, dst, socket, src_socket) tuples"""
+        return zip(self.wire_src, self.wire_dst, self.wire_socket, self.wire_src_socket)
+
+
+def _check_wires(circuit):
+    """Raise CircuitFormatError for a wire of circuit or of a body that refers to a missing node"""
+    count = len(circuit)
+    for wire_ends in (circuit.wire_src, circuit.wire_dst):
+        if wire_ends and (min(wire_ends) < 0 or max(wire_ends) >= count):
+            for src, dst, _, _ in circuit.wires():
+                if not (0 <= src < count and 0 <= dst < count):
+                    raise CircuitFormatError(f"Wire {src}->{dst} refers to a missing node")
+    for body in circuit.modules.values():
+        _check_wires(body)
+
+
+def _little_endian(column):
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _write_strings(stream, strings):
+    for text in strings:
+        data = text.encode("utf-8")
+        stream.write(_LENGTH.pack(len(data)))
+        stream.write(data)
+
+
+def _read_strings(data, offset, count):
+    strings = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        strings.append(bytes(data[offset:offset + length]).decode("utf-8"))
+        offset += length
+    return strings, offset
+
+
+def _read_column(data, offset, typecode, count):
+    column = array(typecode)
+    size = column.itemsize * count
+    if offset + size > len(data):
+        raise CircuitFormatError("Truncated circuit file")
+    column.frombytes(data[offset:offset + size])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column, offset + size
+
+
+def write_binary(circuit, stream):
+    """Write circuit to a binary stream in the compact .lcb format"""
+    stream.write(BINARY_MAGIC + bytes([FORMAT_VERSION]))
+    _write_binary_body(circuit, stream)
+
+
+def _write_binary_body(circuit, stream):
+    type_table = list(dict.fromkeys(circuit.types))
+    value_table = list(dict.fromkeys(circuit.values))
+    type_codes = {name: i for i, name in enumerate(type_table)}
+    value_codes = {text: i for i, text in enumerate(value_table)}
+
+    stream.write(_HEADER.pack(len(circuit), len(circuit.wire_src), len(type_table), len(value_table)))
+    _write_strings(stream, type_table)
+    _write_strings(stream, value_table)
+    columns = [
+        array("H", [type_codes[name] for name in circuit.types]),
+        array("d", circuit.xs),
+        array("d", circuit.ys),
+        array("I", [value_codes[text] for text in circuit.values]),
+        array("I", circuit.wire_src),
+        array("I", circuit.wire_dst),
+        array("H", circuit.wire_socket),
+        array("H", circuit.wire_src_socket),
+    ]
+    for column in columns:
+        stream.write(_little_endian(column).tobytes())
+
+    # Subcircuit bodies follow as nested, length-prefixed circuits
+    stream.write(_COUNT.pack(len(circuit.modules)))
+    for name, body in circuit.modules.items():
+        _write_strings(stream, [name])
+        blob = io.BytesIO()
+        _write_binary_body(body, blob)
+        stream.write(_COUNT.pack(len(blob.getvalue())))
+        stream.write(blob.getvalue())
+
+
+def read_binary(stream):
+    """Read a circuit written by write_binary()"""
+    data = memoryview(stream.read())
+    if bytes(data[:len(BINARY_MAGIC)]) != BINARY_MAGIC or len(data) <= len(BINARY_MAGIC):
+        raise CircuitFormatError("Not a binary circuit file")
+    version = data[len(BINARY_MAGIC)]
+    if version not in SUPPORTED_VERSIONS:
+        raise CircuitFormatError(f"Unsupported circuit file version {version}")
+    try:
+        circuit, _ = _read_binary_body(data, len(BINARY_MAGIC) + 1, version)
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise CircuitFormatError(f"Corrupt circuit file: {error}")
+    _check_wires(circuit)
+    return circuit
+
+
+def _read_binary_body(data, offset, version):
+    node_count, wire_count, type_count, value_count = _HEADER.unpack_from(data, offset)
+    offset += _HEADER.size
+    type_table, offset = _read_strings(data, offset, type_count)
+    value_table, offset = _read_strings(data, offset, value_count)
+
+    type_codes, offset = _read_column(data, offset, "H", node_count)
+    xs, offset = _read_column(data, offset, "d", node_count)
+    ys, offset = _read_column(data, offset, "d", node_count)
+    value_codes, offset = _read_column(data, offset, "I", node_count)
+    wire_src, offset = _read_column(data, offset, "I", wire_count)
+    wire_dst, offset = _read_column(data, offset, "I", wire_count)
+    wire_socket, offset = _read_column(data, offset, "H", wire_count)
+    if version >= 2:
+        wire_src_socket, offset = _read_column(data, offset, "H", wire_count)
+    else:
+        wire_src_socket = array("H", bytes(2 * wire_count))
+
+    circuit = CircuitData()
+    circuit.types = [type_table[code] for code in type_codes]
+    circuit.xs = xs.tolist()
+    circuit.ys = ys.tolist()
+    circuit.values = [value_table[code] for code in value_codes]
+    circuit.wire_src = wire_src.tolist()
+    circuit.wire_dst = wire_dst.tolist()
+    circuit.wire_socket = wire_socket.tolist()
+    circuit.wire_src_socket = wire_src_socket.tolist()
+
+    if version >= 2:
+        (module_count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        for _ in range(module_count):
+            (name,), offset = _read_strings(data, offset, 1)
+            (length,) = _COUNT.unpack_from(data, offset)
+            offset += _COUNT.size
+            circuit.modules[name], _ = _read_binary_body(data[:offset + length], offset, version)
+            offset += length
+    return circuit, offset
+
+
+def write_json(circuit, stream):
+    """Write circuit to a text stream as JSON Lines, one record per line"""
+    dumps = json.dumps
+    stream.write(dumps({"format": JSON_FORMAT, "version": FORMAT_VERSION,
+                        "nodes": len(circuit), "wires": len(circuit.wire_src)}) + "\n")
+    # Subcircuit bodies come first, each on one line in columnar form
+    for name, body in circuit.modules.items():
+        stream.write(dumps({"module": name, "circuit": _to_columns(body)}) + "\n")
+    for i in range(len(circuit)):
+        stream.write(dumps({"node": i, "type": circuit.types[i], "x": circuit.xs[i],
+                            "y": circuit.ys[i], "value": circuit.values[i]}) + "\n")
+    for src, dst, socket, src_socket in circuit.wires():
+        stream.write(dumps({"wire": [src, dst, socket, src_socket]}) + "\n")
+
+
+def _to_columns(circuit):
+    return {
+        "types": circuit.types, "xs": circuit.xs, "ys": circuit.ys, "values": circuit.values,
+        "wires": [circuit.wire_src, circuit.wire_dst, circuit.wire_socket, circuit.wire_src_socket],
+        "modules": {name: _to_columns(body) for name, body in circuit.modules.items()},
+    }
+
+
+def _from_columns(columns):
+    circuit = CircuitData()
+    circuit.types = list(columns["types"])
+    circuit.xs = list(columns["xs"])
+    circuit.ys = list(columns["ys"])
+    circuit.values = list(columns["values"])
+    circuit.wire_src, circuit.wire_dst, circuit.wire_socket, circuit.wire_src_socket = (
+        list(column) for column in columns["wires"])
+    circuit.modules = {name: _from_columns(body) for name, body in columns.get("modules", {}).items()}
+    return circuit
+
+
+def iter_json(stream):
+    """Yield the records of a JSON Lines circuit one at a time.
+
+    Yields ("module", name, CircuitData), ("node", type, x, y, value) and
+    ("wire", src, dst, socket, src_socket) tuples, reading only one line of
+    the file at a time.
+    """
+    try:
+        header = json.loads(stream.readline() or "{}")
+    except ValueError:
+        raise CircuitFormatError("Not a JSON circuit file")
+    if not isinstance(header, dict) or header.get("format") != JSON_FORMAT:
+        raise CircuitFormatError("Not a JSON circuit file")
+    if header.get("version") not in SUPPORTED_VERSIONS:
+        raise CircuitFormatError(f"Unsupported circuit file version {header.get('version')}")
+    for line_number, line in enumerate(stream, start=2):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if "wire" in record:
+                src, dst, socket, *src_socket = record["wire"]
+                yield ("wire", src, dst, socket, src_socket[0] if src_socket else 0)
+            elif "module" in record:
+                yield ("module", record["module"], _from_columns(record["circuit"]))
+            else:
+                yield ("node", record["type"], record["x"], record["y"], record.get("value", ""))
+        except (ValueError, KeyError, TypeError) as error:
+            raise CircuitFormatError(f"Bad record on line {line_number}: {error}")
+
+
+def read_json(stream):
+    """Read a circuit written by write_json()"""
+    circuit = CircuitData()
+    for record in iter_json(stream):
+        if record[0] == "node":
+            circuit.add_node(*record[1:])
+        elif record[0] == "wire":
+            circuit.add_wire(*record[1:])
+        else:
+            circuit.modules[record[1]] = record[2]
+    try:
+        _check_wires(circuit)
+    except TypeError:
+        raise CircuitFormatError("Wire ends must be node numbers")
+    return circuit
+
+
+def save_circuit(circuit, file_name):
+    """Save circuit, choosing the format from the file extension (.lcb or .jsonl)"""
+    if file_name.endswith(JSON_EXTENSION):
+        with open(file_name, "w", encoding="utf-8") as file:
+            write_json(circuit, file)
+    else:
+        with open(file_name, "wb") as file:
+            write_binary(circuit, file)
+
+
+def load_circuit(file_name):
+    """Load a circuit saved by save_circuit(), detecting the format from its contents"""
+    with open(file_name, "rb") as file:
+        magic = file.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        with open(file_name, "rb") as file:
+            return read_binary(file)
+    with open(file_name, "r", encoding="utf-8") as file:
+        return read_json(file)
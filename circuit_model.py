@@ -0,0 +1,191 @@
+"""Compact, array-backed storage of a large circuit.
+
+A QGraphicsItem per gate (with a child item per socket) costs kilobytes, so a
+circuit of a hundred thousand gates would need hundreds of megabytes before
+anything is shown.  A CircuitModel keeps the same information in typed
+arrays instead: a type code and a position per node, and the drivers of all
+input sockets in one flat array indexed through per-node offsets.  The
+editor builds NodeItems only for the nodes near what a view shows (see
+NodeGraphicsScene.update_virtual) and draws the others straight from here.
+
+The model describes the circuit as loaded and is never changed; the editor
+keeps edited nodes as items.  Nodes are bucketed into square cells by
+position, so the nodes within a rectangle are found without scanning them
+all.
+"""
+
+import math
+from array import array
+
+from netlist import input_socket_count
+
+CELL_SIZE = 1000  # Side of a cell of the position index, in scene units
+WIRE_LEVELS = 8  # Grids for wires, each with cells four times as wide as the last
+WIRE_SPAN_CELLS = 16
+NO_DRIVER = -1
+
+
+class CircuitModel:
+    """Nodes and wires of a CircuitData in flat arrays"""
+
+    def __init__(self, circuit, modules=None, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.type_names = []  # Type code -> type name
+        codes = {}
+        self.types = array("H")
+        for node_type in circuit.types:
+            code = codes.get(node_type)
+            if code is None:
+                code = codes[node_type] = len(self.type_names)
+                self.type_names.append(node_type)
+            self.types.append(code)
+        self.xs = array("d", circuit.xs)
+        self.ys = array("d", circuit.ys)
+        # Most values are empty (gates without a delay), so only the rest are kept
+        self.values = {node: value for node, value in enumerate(circuit.values) if value}
+
+        # Socket s of node n is slot first_socket[n] + s of the driver arrays
+        counts = [input_socket_count(name, modules) for name in self.type_names]
+        self.first_socket = array("l", [0])
+        for code in self.types:
+            self.first_socket.append(self.first_socket[-1] + counts[code])
+        slots = self.first_socket[-1]
+        self.driver = array("l", [NO_DRIVER]) * slots  # Driving node of each input socket
+        self.driver_socket = array("H", [0]) * slots  # Output socket of that node
+        fanout_count = array("l", [0]) * (len(self.types) + 1)
+        for src, dst, socket, src_socket in circuit.wires():
+            if socket < self.first_socket[dst + 1] - self.first_socket[dst]:
+                slot = self.first_socket[dst] + socket
+                self.driver[slot] = src
+                self.driver_socket[slot] = src_socket
+                fanout_count[src + 1] += 1
+
+        # Fanout in the same compressed form: the sinks of n are
+        # sinks[first_sink[n]:first_sink[n + 1]]
+        self.first_sink = array("l", [0]) * (len(self.types) + 1)
+        for node in range(len(self.types)):
+            self.first_sink[node + 1] = self.first_sink[node] + fanout_count[node + 1]
+        self.sinks = array("l", [0]) * self.first_sink[-1]
+        filled = array("l", self.first_sink[:-1])
+        for node in range(len(self.types)):
+            for slot in range(self.first_socket[node], self.first_socket[node + 1]):
+                src = self.driver[slot]
+                if src != NO_DRIVER:
+                    self.sinks[filled[src]] = node
+                    filled[src] += 1
+
+        self.cells = {}  # (cell x, cell y) -> array of node numbers
+        for node, (x, y) in enumerate(zip(self.xs, self.ys)):
+            self._bucket(self.cells, self._cell(x, y), node)
+
+        # Wires, by the slot of the socket they drive.  Each goes into the
+        # finest grid in which its bounding box touches at most
+        # WIRE_SPAN_CELLS cells, so short wires are found in small cells and
+        # long ones in big ones
+        self.slot_owner = array("l", [0]) * slots  # Slot -> node of the socket
+        for node in range(len(self.types)):
+            for slot in range(self.first_socket[node], self.first_socket[node + 1]):
+                self.slot_owner[slot] = node
+        self.wire_cells = [{} for _ in range(WIRE_LEVELS)]  # Per level: cell -> array of slots
+        xs, ys = self.xs, self.ys
+        for slot, src in enumerate(self.driver):
+            if src == NO_DRIVER:
+                continue
+            dst = self.slot_owner[slot]
+            left, right = min(xs[src], xs[dst]), max(xs[src], xs[dst])
+            top, bottom = min(ys[src], ys[dst]), max(ys[src], ys[dst])
+            for level, cells in enumerate(self.wire_cells):
+                size = cell_size * 4 ** level
+                first_x, first_y = math.floor(left / size), math.floor(top / size)
+                last_x, last_y = math.floor(right / size), math.floor(bottom / size)
+                if (last_x - first_x + 1) * (last_y - first_y + 1) <= WIRE_SPAN_CELLS or level == WIRE_LEVELS - 1:
+                    for cx in range(first_x, last_x + 1):
+                        for cy in range(first_y, last_y + 1):
+                            self._bucket(cells, (cx, cy), slot)
+                    break
+
+    def _cell(self, x, y, size=None):
+        size = size or self.cell_size
+        return (math.floor(x / size), math.floor(y / size))
+
+    @staticmethod
+    def _bucket(cells, key, item):
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = array("l")
+        cell.append(item)
+
+    def __len__(self):
+        return len(self.types)
+
+    def type_of(self, node):
+        return self.type_names[self.types[node]]
+
+    def value_of(self, node):
+        return self.values.get(node, "")
+
+    def drivers(self, node):
+        """(driving node, output socket) for each input socket, or None if unconnected"""
+        return [None if self.driver[slot] == NO_DRIVER else (self.driver[slot], self.driver_socket[slot])
+                for slot in range(self.first_socket[node], self.first_socket[node + 1])]
+
+    def fanout(self, node):
+        return self.sinks[self.first_sink[node]:self.first_sink[node + 1]]
+
+    def neighbours(self, node):
+        """Every node wired to node, either way"""
+        found = {src for src, _ in filter(None, self.drivers(node))}
+        found.update(self.fanout(node))
+        return found
+
+    def _cells_in(self, cells, left, top, right, bottom, size=None):
+        (first_x, first_y), (last_x, last_y) = self._cell(left, top, size), self._cell(right, bottom, size)
+        if (last_x - first_x + 1) * (last_y - first_y + 1) > len(cells):
+            # Zoomed far out: walking the occupied cells is quicker
+            return [cell for (cx, cy), cell in cells.items()
+                    if first_x <= cx <= last_x and first_y <= cy <= last_y]
+        return [cells[key] for key in ((cx, cy) for cx in range(first_x, last_x + 1)
+                                       for cy in range(first_y, last_y + 1)) if key in cells]
+
+    def nodes_in(self, left, top, right, bottom):
+        """Nodes whose position lies within a rectangle"""
+        xs, ys = self.xs, self.ys
+        for cell in self._cells_in(self.cells, left, top, right, bottom):
+            for node in cell:
+                if left <= xs[node] <= right and top <= ys[node] <= bottom:
+                    yield node
+
+    def wires_in(self, left, top, right, bottom):
+        """(src, dst, socket, src_socket) of the wires whose end nodes' bounding
+        box overlaps a rectangle"""
+        xs, ys = self.xs, self.ys
+        seen = set()
+        candidates = [slot for level, cells in enumerate(self.wire_cells)
+                      for cell in self._cells_in(cells, left, top, right, bottom, self.cell_size * 4 ** level)
+                      for slot in cell]
+        for slot in candidates:
+            if slot in seen:
+                continue
+            seen.add(slot)
+            src, dst = self.driver[slot], self.slot_owner[slot]
+            if (min(xs[src], xs[dst]) <= right and max(xs[src], xs[dst]) >= left
+                    and min(ys[src], ys[dst]) <= bottom and max(ys[src], ys[dst]) >= top):
+                yield src, dst, slot - self.first_socket[dst], self.driver_socket[slot]
+
+    def wires(self):
+        """Iterate over (src, dst, socket, src_socket) tuples"""
+        first_socket = self.first_socket
+        for dst in range(len(self.types)):
+            start = first_socket[dst]
+            for slot in range(start, first_socket[dst + 1]):
+                if self.driver[slot] != NO_DRIVER:
+                    yield self.driver[slot], dst, slot - start, self.driver_socket[slot]
+
+    def nbytes(self):
+        """Approximate memory held by the arrays and the cell index"""
+        arrays = [self.types, self.xs, self.ys, self.first_socket, self.driver, self.driver_socket,
+                  self.first_sink, self.sinks, self.slot_owner]
+        arrays += list(self.cells.values())
+        arrays += [cell for cells in self.wire_cells for cell in cells.values()]
+        cells = len(self.cells) + sum(len(cells) for cells in self.wire_cells)
+        return sum(a.itemsize * len(a) for a in arrays) + 100 * (len(self.values) + cells)
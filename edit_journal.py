@@ -0,0 +1,361 @@
+"""Crash-safe autosave: an append-only journal of the edits made to a circuit.
+
+Saving the whole design after every edit would take as long as saving a file,
+which for a large circuit stalls the editor.  Instead every undoable step
+(a command, an undo or a redo) appends one record to a log, holding only what
+the step changed: the nodes it added, moved or edited, the nodes it removed,
+and the new driver of every input socket it rewired.  Nodes are named by ids
+that never change during a session.
+
+Every CHECKPOINT_RECORDS records the journal is compacted on a background
+thread: the log is renamed out of the way, a fresh one is started, and the
+previous checkpoint (or the design file the session started from) is
+replayed with the old log and written as the new checkpoint.  Recovering a
+session therefore reads one checkpoint and at most two short logs.
+
+Files of a journal called NAME in its directory:
+
+    NAME.log         -- a JSON header line, then one JSON record per line
+    NAME.log.old     -- the log being compacted, if a compaction is running
+    NAME.checkpoint  -- a JSON header line, then the circuit in .lcb form
+
+Records are flushed to the operating system as they are written, so they
+survive the editor crashing, though not necessarily the machine.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+
+from circuit_io import CircuitData, CircuitFormatError, load_circuit, read_binary, read_json, write_binary, write_json
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".logic-circuit-builder", "autosave")
+CHECKPOINT_RECORDS = 1000  # Records appended between compactions
+JOURNAL_VERSION = 1
+LOG_SUFFIX = ".log"
+OLD_LOG_SUFFIX = ".log.old"
+CHECKPOINT_SUFFIX = ".checkpoint"
+UNTITLED_PREFIX = "untitled-"
+
+
+class JournalState:
+    """A circuit as the journal sees it: nodes and input socket drivers by node id"""
+
+    def __init__(self):
+        self.nodes = {}  # Id -> (type, x, y, value)
+        self.drivers = {}  # (id, socket) -> (driving id, output socket)
+        self.modules = {}  # Name -> body CircuitData
+        self.seq = 0  # Number of the last record applied
+        self.next_id = 0
+
+    @classmethod
+    def from_circuit(cls, circuit, ids=None):
+        """The state of a CircuitData whose node i has id ids[i] (default i)"""
+        state = cls()
+        ids = range(len(circuit)) if ids is None else ids
+        for node_id, node_type, x, y, value in zip(ids, circuit.types, circuit.xs, circuit.ys, circuit.values):
+            state.nodes[node_id] = (node_type, x, y, value)
+        for src, dst, socket, src_socket in circuit.wires():
+            state.drivers[(ids[dst], socket)] = (ids[src], src_socket)
+        state.modules = dict(circuit.modules)
+        state.next_id = max(ids, default=-1) + 1
+        return state
+
+    def apply(self, record):
+        """Replay one record written by EditJournal.append"""
+        for node_id in record.get("removed", ()):
+            self.nodes.pop(node_id, None)
+        for node_id, node_type, x, y, value in record.get("nodes", ()):
+            self.nodes[node_id] = (node_type, x, y, value)
+            self.next_id = max(self.next_id, node_id + 1)
+        for wire in record.get("wires", ()):
+            if len(wire) == 4:
+                self.drivers[(wire[0], wire[1])] = (wire[2], wire[3])
+            else:
+                self.drivers.pop((wire[0], wire[1]), None)  # Disconnected
+        for name, text in record.get("modules", {}).items():
+            self.modules[name] = read_json(io.StringIO(text))
+        self.seq = record["seq"]
+
+    def to_circuit(self):
+        """Return (CircuitData, ids): the circuit and the id of each of its nodes"""
+        ids = sorted(self.nodes)
+        index = {node_id: i for i, node_id in enumerate(ids)}
+        circuit = CircuitData()
+        for node_id in ids:
+            circuit.add_node(*self.nodes[node_id])
+        for (dst, socket), (src, src_socket) in sorted(self.drivers.items()):
+            # Wires of removed nodes are left behind by their removal
+            if dst in index and src in index:
+                circuit.add_wire(index[src], index[dst], socket, src_socket)
+        circuit.modules = dict(self.modules)
+        return circuit, ids
+
+
+def _source_stamp(source):
+    """What identifies the saved version of a design file: (size, mtime)"""
+    try:
+        info = os.stat(source)
+    except OSError:
+        return None
+    return [info.st_size, info.st_mtime]
+
+
+def _read_log(path):
+    """(header, records) of a log file, or (None, []) if there is none.
+
+    A crash can leave the last line half written; it is ignored.
+    """
+    try:
+        file = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return None, []
+    with file:
+        header = None
+        records = []
+        for line in file:
+            try:
+                value = json.loads(line)
+            except ValueError:
+                break
+            if header is None:
+                header = value
+            else:
+                records.append(value)
+    return header, records
+
+
+def _read_checkpoint(path):
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with file:
+        header = json.loads(file.readline())
+        circuit = read_binary(file)
+    state = JournalState.from_circuit(circuit, header["ids"])
+    state.seq = header["seq"]
+    state.next_id = max(state.next_id, header["next_id"])
+    return state
+
+
+def journal_name(file_name):
+    """Name of the journal of a design file; one per absolute path"""
+    digest = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()
+    return f"{os.path.splitext(os.path.basename(file_name))[0]}-{digest[:12]}"
+
+
+def untitled_journals(directory=AUTOSAVE_DIR):
+    """Names of the journals of designs that were never saved, oldest first"""
+    try:
+        names = [name[:-len(LOG_SUFFIX)] for name in os.listdir(directory)
+                 if name.startswith(UNTITLED_PREFIX) and name.endswith(LOG_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda name: os.path.getmtime(os.path.join(directory, name + LOG_SUFFIX)))
+
+
+class EditJournal:
+    """The journal of one design, in `directory` under `name`.
+
+    source is the design file the session started from (None for a new
+    design); the journal only records the changes made to it.  Node i of the
+    source has id source_ids[i], or i if not given.  Call recover() before
+    start() to pick up what an earlier session left.
+    """
+
+    def __init__(self, directory, name, source=None, source_ids=None):
+        self.directory = directory
+        self.name = name
+        self.source = source
+        self.source_ids = source_ids
+        base = os.path.join(directory, name)
+        self.log_path = base + LOG_SUFFIX
+        self.old_log_path = base + OLD_LOG_SUFFIX
+        self.checkpoint_path = base + CHECKPOINT_SUFFIX
+        self.seq = 0
+        self.records = 0  # Appended since the last compaction
+        self.modules = set()  # Subcircuits already written
+        self._file = None
+        self._lock = threading.Lock()  # Compactions run one at a time
+        self._compaction = None
+
+    @classmethod
+    def untitled(cls, directory=AUTOSAVE_DIR):
+        """A journal for a new design, with a name no other journal has"""
+        number = 1
+        while os.path.exists(os.path.join(directory, f"{UNTITLED_PREFIX}{os.getpid()}-{number}{LOG_SUFFIX}")):
+            number += 1
+        return cls(directory, f"{UNTITLED_PREFIX}{os.getpid()}-{number}")
+
+    @classmethod
+    def for_file(cls, file_name, directory=AUTOSAVE_DIR, ids=None):
+        return cls(directory, journal_name(file_name), file_name, ids)
+
+    def exists(self):
+        return any(os.path.exists(path) for path in (self.log_path, self.old_log_path, self.checkpoint_path))
+
+    def _base_state(self):
+        """The checkpoint, or else the state of the source file the records apply to"""
+        state = _read_checkpoint(self.checkpoint_path)
+        if state is not None:
+            return state
+        if self.source is None:
+            return JournalState()
+        ids = None
+        for path in (self.old_log_path, self.log_path):
+            header, _ = _read_log(path)
+            if header is not None:
+                ids = header.get("ids")
+                break
+        return JournalState.from_circuit(load_circuit(self.source), ids)
+
+    def _replay(self):
+        """The state after the checkpoint and every record after it, or None if stale"""
+        state = self._base_state()
+        for path in (self.old_log_path, self.log_path):
+            header, records = _read_log(path)
+            if header is None:
+                continue
+            if self.source is not None and header.get("stamp") != _source_stamp(self.source):
+                return None  # The design file was saved (or replaced) since
+            for record in records:
+                if record["seq"] > state.seq:
+                    state.apply(record)
+        return state
+
+    def recover(self):
+        """Return (CircuitData, ids, next id) of the journaled session, or None.
+
+        None means there is nothing to recover: no journal, one without
+        records, or one that applies to an earlier version of the source.
+        The journal continues from the recovered state once started.
+        """
+        if not self.exists():
+            return None
+        try:
+            state = self._replay()
+        except (OSError, ValueError, KeyError, TypeError, CircuitFormatError):
+            return None
+        if state is None or state.seq == 0:
+            return None
+        self.seq = state.seq
+        self.modules = set(state.modules)
+        circuit, ids = state.to_circuit()
+        return circuit, ids, state.next_id
+
+    def start(self, modules=()):
+        """Open the log for appending; modules are subcircuits the source already defines"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.modules.update(modules)
+        self._file = open(self.log_path, "a", encoding="utf-8")
+        if self._file.tell() == 0:
+            self._write_header()
+
+    def _write_header(self):
+        header = {"journal": JOURNAL_VERSION, "source": self.source,
+                  "stamp": None if self.source is None else _source_stamp(self.source)}
+        if self.source_ids is not None:
+            header["ids"] = self.source_ids
+        self._file.write(json.dumps(header, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def append(self, nodes=(), removed=(), wires=(), modules=None):
+        """Write the record of one step.
+
+        nodes   -- (id, type, x, y, value) of each node added or changed
+        removed -- ids of the nodes removed
+        wires   -- (id, socket, driving id, output socket) for each input
+                   socket connected, or (id, socket) for one disconnected
+        modules -- {name: body CircuitData} of subcircuits to define
+        """
+        if self._file is None:
+            return
+        self.seq += 1
+        record = {"seq": self.seq}
+        if nodes:
+            record["nodes"] = list(nodes)
+        if removed:
+            record["removed"] = list(removed)
+        if wires:
+            record["wires"] = list(wires)
+        if modules:
+            record["modules"] = {}
+            for name, body in modules.items():
+                text = io.StringIO()
+                write_json(body, text)
+                record["modules"][name] = text.getvalue()
+                self.modules.add(name)
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.records += 1
+        if self.records >= CHECKPOINT_RECORDS:
+            self.compact()
+
+    def compact(self, wait=False):
+        """Fold the log into a new checkpoint, on a background thread unless wait"""
+        if self._file is None or (self._compaction is not None and self._compaction.is_alive()):
+            return
+        if not os.path.exists(self.old_log_path):
+            # Otherwise it was left by a compaction that did not finish, and
+            # this one folds that in first
+            self._file.close()
+            os.replace(self.log_path, self.old_log_path)
+            self._file = open(self.log_path, "a", encoding="utf-8")
+            self._write_header()
+            self.records = 0
+        self._compaction = threading.Thread(target=self._write_checkpoint, name="journal", daemon=True)
+        self._compaction.start()
+        if wait:
+            self._compaction.join()
+
+    def _write_checkpoint(self):
+        with self._lock:
+            state = self._base_state()
+            header, records = _read_log(self.old_log_path)
+            for record in records:
+                if record["seq"] > state.seq:
+                    state.apply(record)
+            circuit, ids = state.to_circuit()
+            self._store_checkpoint(circuit, ids, state.seq, state.next_id)
+            os.remove(self.old_log_path)
+
+    def _store_checkpoint(self, circuit, ids, seq, next_id):
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(json.dumps({"journal": JOURNAL_VERSION, "seq": seq, "ids": ids, "next_id": next_id},
+                                  separators=(",", ":")).encode("utf-8") + b"\n")
+            write_binary(circuit, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def seed(self, circuit):
+        """Start a design that has no file from circuit, node i having id i.
+
+        For designs that did not start out empty, such as imported netlists.
+        The circuit is written as the checkpoint, at once, rather than as a
+        record of every node.  Call before start().
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.seq += 1
+        self._store_checkpoint(circuit, list(range(len(circuit))), self.seq, len(circuit))
+
+    def close(self):
+        """Stop appending; the files stay for the next session to recover"""
+        if self._compaction is not None:
+            self._compaction.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Close the journal and delete its files, e.g. once the design was saved"""
+        self.close()
+        for path in (self.log_path, self.old_log_path, self.checkpoint_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,238 @@
+"""Logic optimization of a compiled Netlist.
+
+optimize() rebuilds a netlist so that simulating it produces the same
+Output values with fewer operations:
+
+* dead gates -- gates with no path to any Output/Write Output are dropped;
+* constant folding -- gates whose operands are all known (from Inputs the
+  caller declares fixed, or from other folded gates) become constants, and
+  identities such as AND(x, 1) = x or XOR(x, 1) = NOT x are applied;
+* double NOT -- NOT(NOT(x)) is replaced by x;
+* common subexpressions -- structurally identical gates are merged by
+  hash-consing (type, operands), with operands sorted for the symmetric
+  gates.
+
+Gates on buses are only merged, never folded or simplified: a constant is
+a single bit, and AND(x, 1) is not x when x is wider.  Gates with more than
+two inputs are folded once all their operands are known, but the identities
+are only applied to two-input gates.
+
+Inputs keep their order and keys, and Outputs keep their order and keys, so
+the optimized netlist is a drop-in replacement for simulation.  Clocks,
+flip-flops and latches are kept as they are (unless dead), since two of them
+with the same drivers can still differ in period or delay.
+"""
+
+from netlist import Netlist, SINK_TYPES, SOURCE_TYPES
+
+# Every two-input gate is a base operation, optionally inverted
+_BASE = {
+    "AND": ("AND", False), "NAND": ("AND", True),
+    "OR": ("OR", False), "NOR": ("OR", True),
+    "XOR": ("XOR", False), "XNOR": ("XOR", True),
+}
+_INVERTED = {"AND": "NAND", "OR": "NOR", "XOR": "XNOR"}
+
+
+class _Constant:
+    """Signal with a value known at optimization time (0, 1 or None)"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class OptimizationReport:
+    def __init__(self):
+        self.nodes_before = 0
+        self.nodes_after = 0
+        self.dead = []  # Keys of gates with no path to an output
+        self.folded = []  # Keys of gates replaced by a constant
+        self.merged = []  # Keys of gates identical to an earlier one
+        self.double_nots = []  # Keys of NOT gates cancelled by a second NOT
+        self.simplified = []  # Keys of gates reduced by an identity
+
+    def removed(self):
+        return self.nodes_before - self.nodes_after
+
+    def summary(self):
+        return (f"{self.nodes_before} -> {self.nodes_after} nodes: "
+                f"{len(self.dead)} dead, {len(self.folded)} folded, {len(self.merged)} merged, "
+                f"{len(self.double_nots)} double NOTs, {len(self.simplified)} simplified")
+
+    def __str__(self):
+        return self.summary()
+
+
+class _Builder:
+    """Emits the optimized netlist node by node with hash-consing"""
+
+    def __init__(self):
+        self.keys = []
+        self.types = []
+        self.fanin = []
+        self.table = {}  # (type, operands) -> new node index
+
+    def emit(self, key, node_type, operands, symmetric=False):
+        """Add a node unless an identical one exists; returns (index, is_new)"""
+        signature = (node_type, tuple(sorted(operands)) if symmetric else tuple(operands))
+        existing = self.table.get(signature)
+        if existing is not None:
+            return existing, False
+        self.keys.append(key)
+        self.types.append(node_type)
+        self.fanin.append(list(operands))
+        index = len(self.keys) - 1
+        self.table[signature] = index
+        return index, True
+
+    def emit_unique(self, key, node_type, operands):
+        """Add a node that must never be merged (Inputs and Outputs)"""
+        self.keys.append(key)
+        self.types.append(node_type)
+        self.fanin.append(list(operands))
+        return len(self.keys) - 1
+
+
+def _live_nodes(netlist):
+    """Nodes with a path to some output"""
+    live = set()
+    stack = list(netlist.outputs)
+    while stack:
+        node = stack.pop()
+        if node in live:
+            continue
+        live.add(node)
+        stack.extend(d for d in netlist.fanin[node] if d is not None)
+    return live
+
+
+def optimize(netlist, constants=None):
+    """Return (optimized Netlist, OptimizationReport).
+
+    constants maps Input node indices to a fixed 0/1 value; those Inputs are
+    kept (so input order is unchanged) but treated as constants.
+    """
+    constants = constants or {}
+    report = OptimizationReport()
+    report.nodes_before = len(netlist)
+    builder = _Builder()
+    live = _live_nodes(netlist)
+    signal = {}  # old node -> new index or _Constant
+
+    for node in netlist.inputs:
+        index = builder.emit_unique(netlist.keys[node], netlist.types[node], [None] * len(netlist.fanin[node]))
+        signal[node] = _Constant(constants[node]) if node in constants else index
+
+    for node in range(len(netlist)):
+        if node not in live and netlist.types[node] not in SOURCE_TYPES:
+            report.dead.append(netlist.keys[node])
+
+    # Clocks and state elements come next; a flip-flop's drivers are usually
+    # computed from its own output, so its operands are filled in at the end
+    stateful = [node for node in netlist.clocks + netlist.state if node in live]
+    for node in stateful:
+        signal[node] = builder.emit_unique(netlist.keys[node], netlist.types[node], [None] * len(netlist.fanin[node]))
+
+    def constant_node(value):
+        index, _ = builder.emit(("Constant", value), f"Constant {value}", [])
+        return index
+
+    def as_operand(sig):
+        if isinstance(sig, _Constant):
+            return None if sig.value is None else constant_node(sig.value)
+        return sig
+
+    def emit_not(key, operand):
+        # NOT(NOT(x)) is x
+        if builder.types[operand] == "NOT" and builder.fanin[operand][0] is not None:
+            report.double_nots.append(key)
+            return builder.fanin[operand][0]
+        index, new = builder.emit(key, "NOT", [operand])
+        if not new:
+            report.merged.append(key)
+        return index
+
+    cyclic = set(netlist.cyclic)
+    for node in netlist.order + netlist.cyclic:
+        node_type = netlist.types[node]
+        key = netlist.keys[node]
+        if node not in live or node_type in SOURCE_TYPES or node in signal:
+            continue
+        if node in cyclic:
+            signal[node] = _Constant(None)
+            continue
+        operands = [_Constant(None) if d is None else signal.get(d, _Constant(None)) for d in netlist.fanin[node]]
+        if node_type in SINK_TYPES:
+            # Outputs are emitted last; a wire out of one passes its value on
+            signal[node] = operands[0]
+            continue
+
+        # Anything fed by an undefined value is undefined
+        if any(isinstance(op, _Constant) and op.value is None for op in operands):
+            signal[node] = _Constant(None)
+            report.folded.append(key)
+            continue
+        wide = netlist.widths[node] > 1
+        if all(isinstance(op, _Constant) for op in operands) and netlist.ops[node] is not None and not wide:
+            signal[node] = _Constant(netlist.ops[node]([op.value for op in operands], 1))
+            report.folded.append(key)
+            continue
+
+        if node_type == "NOT":
+            signal[node] = emit_not(key, operands[0])
+        elif node_type in _BASE and not wide:
+            signal[node] = _simplify_gate(builder, report, key, node_type, operands, emit_not, constant_node)
+        else:
+            # Subcircuits, Ports, buses and wide gates: only merge identical ones
+            index, new = builder.emit(key, node_type, [as_operand(op) for op in operands])
+            if not new:
+                report.merged.append(key)
+            signal[node] = index
+
+    for node in stateful:
+        builder.fanin[signal[node]] = [None if d is None else as_operand(signal.get(d, _Constant(None)))
+                                       for d in netlist.fanin[node]]
+
+    for node in netlist.outputs:
+        driver = netlist.fanin[node][0] if netlist.fanin[node] else None
+        operand = None if driver is None else as_operand(signal.get(driver, _Constant(None)))
+        builder.emit_unique(netlist.keys[node], netlist.types[node], [operand])
+
+    optimized = Netlist(builder.keys, builder.types, builder.fanin, netlist.modules)
+    report.nodes_after = len(optimized)
+    return optimized, report
+
+
+def _simplify_gate(builder, report, key, node_type, operands, emit_not, constant_node):
+    """Apply constant identities to a two-input gate and emit what is left"""
+    base, inverted = _BASE[node_type]
+    variables = [op for op in operands if not isinstance(op, _Constant)]
+    known = [op.value for op in operands if isinstance(op, _Constant)]
+
+    if known:
+        report.simplified.append(key)
+        if base == "AND" and 0 in known:
+            return _Constant(1 if inverted else 0)
+        if base == "OR" and 1 in known:
+            return _Constant(0 if inverted else 1)
+        if base == "XOR":
+            # Each constant 1 flips the result; constant 0s drop out
+            inverted ^= bool(sum(known) % 2)
+        # AND with 1s, OR with 0s: the constants drop out
+
+    if base in ("AND", "OR") and len(variables) > 1 and len(set(variables)) == 1:
+        report.simplified.append(key)
+        variables = variables[:1]  # x AND x = x
+    elif base == "XOR" and len(variables) == 2 and variables[0] == variables[1]:
+        report.simplified.append(key)
+        return _Constant(1 if inverted else 0)  # x XOR x = 0
+
+    if len(variables) == 1:
+        operand = variables[0]
+        return emit_not(key, operand) if inverted else operand
+
+    gate = _INVERTED[base] if inverted else base
+    index, new = builder.emit(key, gate, variables, symmetric=True)
+    if not new:
+        report.merged.append(key)
+    return index
@@ -0,0 +1,150 @@
+"""Reusable subcircuits (hierarchical module nodes).
+
+A ModuleDefinition is a named circuit body whose Input and Output nodes become
+the sockets of every instance placed in the editor.  The body is compiled
+and optimized into a Netlist once and shared by all instances in all tabs;
+an instance evaluates by running the shared body netlist on its input values,
+so memory and compile cost grow with the number of distinct modules rather
+than the number of flattened gates.  That makes an instance a function of its
+inputs alone, so a body cannot hold Clocks, flip-flops or latches.
+"""
+
+import copy
+import threading
+
+from logic_opt import optimize
+from netlist import CLOCK_TYPES, STATE_TYPES, Netlist
+
+MEMO_LIMIT = 4096  # Cached single-vector results per module
+
+
+def stateful_types(node_types):
+    """The Clock, flip-flop and latch types among node_types, which no subcircuit may hold"""
+    return sorted({t for t in node_types if t in STATE_TYPES or t in CLOCK_TYPES})
+
+
+def same_body(a, b):
+    """True when two body CircuitData describe the same nodes and wires"""
+    return (a.types == b.types and a.xs == b.xs and a.ys == b.ys and a.values == b.values
+            and list(a.wires()) == list(b.wires()))
+
+
+def renamed(circuit, renames):
+    """A copy of circuit whose node types old are replaced by renames[old]"""
+    if not any(t in renames for t in circuit.types):
+        return circuit
+    circuit = copy.copy(circuit)
+    circuit.types = [renames.get(t, t) for t in circuit.types]
+    return circuit
+
+
+class ModuleDefinition:
+    def __init__(self, name, body, library):
+        self.name = name
+        self.body = body  # CircuitData of the module contents
+        self.library = library  # Resolves modules used inside the body
+        self.input_count = sum(1 for t in body.types if t == "Input")
+        self.output_count = sum(1 for t in body.types if t in ("Output", "Write Output"))
+        self._netlist = None
+        self.report = None  # OptimizationReport of the compiled body
+        self._compiling = False
+        self._lock = threading.RLock()  # Instances are evaluated on worker threads too
+        self._memo = {}
+
+    @property
+    def netlist(self):
+        """The compiled, optimized body, built on first use and then shared"""
+        if self._netlist is None:
+            with self._lock:
+                if self._netlist is not None:
+                    return self._netlist
+                if self._compiling:
+                    raise ValueError(f"Subcircuit {self.name} contains itself")
+                stateful = stateful_types(self.body.types)
+                if stateful:
+                    raise ValueError(f"Subcircuit {self.name} holds {', '.join(stateful)} nodes; "
+                                     "subcircuits must be combinational")
+                self._compiling = True
+                try:
+                    compiled = Netlist.from_circuit(self.body, self.library)
+                    self._netlist, self.report = optimize(compiled)
+                finally:
+                    self._compiling = False
+        return self._netlist
+
+    @property
+    def output_widths(self):
+        """Bits of each output, in socket order; buses come from Merges in the body"""
+        body = self.netlist
+        return [body.widths[node] for node in body.outputs]
+
+    def evaluate(self, operands, mask):
+        """Evaluate the body for one instance; returns a tuple of output values.
+
+        Works on single 0/1 values (mask=1) as well as on packed words.
+        Single-vector results are memoized, since many instances of the same
+        module usually see the same few input combinations.
+        """
+        key = tuple(operands) if mask == 1 else None
+        if key is not None and key in self._memo:
+            return self._memo[key]
+        body = self.netlist
+        words = body.evaluate_words(dict(zip(body.inputs, operands)), mask)
+        result = tuple(words[node] for node in body.outputs)
+        if key is not None:
+            if len(self._memo) >= MEMO_LIMIT:
+                self._memo.clear()
+            self._memo[key] = result
+        return result
+
+
+class ModuleLibrary(dict):
+    """Subcircuit definitions by name, shared by every tab of the editor"""
+
+    def define(self, name, body):
+        """Create (or replace) the definition called name and return it"""
+        definition = ModuleDefinition(name, body, self)
+        self[name] = definition
+        return definition
+
+    def bodies(self):
+        """Return {name: body CircuitData} for saving alongside a circuit"""
+        return {name: definition.body for name, definition in self.items()}
+
+    def unique_name(self, base, taken=()):
+        """Return base followed by the lowest number that is not yet defined nor taken"""
+        number = 1
+        while f"{base}{number}" in self or f"{base}{number}" in taken:
+            number += 1
+        return f"{base}{number}"
+
+    def merge(self, bodies):
+        """Define incoming bodies; returns (names added, {incoming name: new name}).
+
+        A body equal to the definition of the same name reuses it.  One that
+        differs is defined under a unique name instead, and the bodies using
+        it are rewritten to match, so merging never changes a definition.
+        """
+        renames = {}
+        changed = True
+        while changed:  # A rename changes the bodies that use it
+            changed = False
+            for name, body in bodies.items():
+                if (name not in renames and name in self
+                        and not same_body(self[name].body, renamed(body, renames))):
+                    renames[name] = self.unique_name(name, set(bodies) | set(renames.values()))
+                    changed = True
+        added = []
+        for name, body in bodies.items():
+            name = renames.get(name, name)
+            if name not in self:
+                self.define(name, renamed(body, renames))
+                added.append(name)
+        return added, renames
+
+    @classmethod
+    def from_bodies(cls, bodies):
+        library = cls()
+        for name, body in bodies.items():
+            library.define(name, body)
+        return library
@@ -0,0 +1,507 @@
+"""Headless netlist compiler and evaluator for the node editor.
+
+The editor draws circuits as QGraphicsItems, but evaluating them does not need
+Qt at all.  A Netlist is a flat, topologically sorted copy of the circuit:
+every node gets an integer index, its type, and the indices of the nodes that
+drive its input sockets.  Evaluation walks the sorted order once, so every
+node is computed exactly once per input change no matter how much fanout the
+circuit has.
+
+Gates take any number of inputs ("AND 8" is an eight-input AND; "AND" has
+two).  A signal can also be a bus: a "Merge <n>" node packs n single bits into
+one n-bit integer (socket i becomes bit i) and a "Split <n>" node unpacks one.
+Gates work bitwise on buses, a narrower operand counting as zero-extended,
+so a 32-bit datapath costs one node and one evaluation per operation rather
+than one per bit.  The width of every signal is worked out when compiling.
+
+Flip-flops, latches and Clocks hold state rather than computing a value from
+their drivers.  The evaluators here treat them like Inputs (their current
+value is used as is), which also breaks every feedback loop that passes
+through a flip-flop; sequential.py advances their state over time.
+"""
+
+import copy
+from functools import reduce
+from heapq import heappush, heappop
+
+GATE_TYPES = ("AND", "OR", "NOT", "NAND", "NOR", "XOR", "XNOR")
+SOURCE_TYPES = ("Input",)
+SINK_TYPES = ("Output", "Write Output")
+CONSTANT_TYPES = ("Constant 0", "Constant 1")  # Produced by the optimizer (logic_opt.py)
+CLOCK_TYPES = ("Clock",)
+STATE_TYPES = ("D Flip-Flop", "D Latch")  # Input sockets: D, then CLK (or enable)
+WIDE_GATE_TYPES = ("AND", "OR", "NAND", "NOR", "XOR", "XNOR")  # Take "<type> <inputs>" forms
+BUS_TYPES = ("Split", "Merge")  # Always sized: "Split <bits>", "Merge <bits>"
+MAX_GATE_INPUTS = 64
+MAX_BUS_WIDTH = 64
+CANCEL_CHECK_INTERVAL = 4096  # Nodes evaluated between checks for cancellation
+
+
+class EvaluationCancelled(Exception):
+    """Raised inside an evaluation whose cancel event was set"""
+
+
+def _and(operands, mask):
+    return reduce(lambda a, b: a & b, operands)
+
+
+def _or(operands, mask):
+    return reduce(lambda a, b: a | b, operands)
+
+
+def _xor(operands, mask):
+    return reduce(lambda a, b: a ^ b, operands)
+
+
+def _not(operands, mask):
+    return ~operands[0] & mask
+
+
+def _nand(operands, mask):
+    return ~_and(operands, mask) & mask
+
+
+def _nor(operands, mask):
+    return ~_or(operands, mask) & mask
+
+
+def _xnor(operands, mask):
+    return ~_xor(operands, mask) & mask
+
+
+def _buffer(operands, mask):
+    return operands[0]
+
+
+def _constant_0(operands, mask):
+    return 0
+
+
+def _constant_1(operands, mask):
+    return mask
+
+
+def _merge(operands, mask):
+    word = 0
+    for bit, operand in enumerate(operands):
+        word |= (operand & 1) << bit
+    return word
+
+
+def _split(width):
+    def unpack(operands, mask):
+        word = operands[0]
+        return tuple((word >> bit) & 1 for bit in range(width))
+    return unpack
+
+
+# Every operation works on integers, so the same table evaluates a single
+# 0/1 vector (mask=1) or many vectors packed side by side into one word.
+GATE_OPS = {
+    "AND": _and,
+    "OR": _or,
+    "NOT": _not,
+    "NAND": _nand,
+    "NOR": _nor,
+    "XOR": _xor,
+    "XNOR": _xnor,
+    "Output": _buffer,
+    "Write Output": _buffer,
+    "Constant 0": _constant_0,
+    "Constant 1": _constant_1,
+}
+
+
+def port_type(index):
+    """Type name of the node selecting output `index` of a subcircuit instance"""
+    return f"Port {index}"
+
+
+def _port(index):
+    def select(operands, mask):
+        return operands[0][index]
+    return select
+
+
+def sized_type(node_type):
+    """Split a sized type name into its base and size: "AND 8" gives ("AND", 8).
+
+    Plain types give (node_type, None); so do sizes out of range.
+    """
+    base, _, size = node_type.rpartition(" ")
+    if size.isdigit():
+        if base in WIDE_GATE_TYPES and 2 <= int(size) <= MAX_GATE_INPUTS:
+            return base, int(size)
+        if base in BUS_TYPES and 1 <= int(size) <= MAX_BUS_WIDTH:
+            return base, int(size)
+    return node_type, None
+
+
+def is_gate(node_type):
+    """Whether a type is a logic gate, of any number of inputs"""
+    return sized_type(node_type)[0] in GATE_TYPES
+
+
+def input_socket_count(node_type, modules=None):
+    """Number of input sockets a node of the given type has"""
+    if modules and node_type in modules:
+        return modules[node_type].input_count
+    base, size = sized_type(node_type)
+    if size is not None:
+        return 1 if base == "Split" else size
+    if node_type in CONSTANT_TYPES or node_type in CLOCK_TYPES:
+        return 0
+    if node_type in ("Output", "Write Output", "NOT", "Input"):
+        return 1
+    return 2
+
+
+def output_socket_count(node_type, modules=None):
+    """Number of output sockets a node of the given type has"""
+    if modules and node_type in modules:
+        return modules[node_type].output_count
+    base, size = sized_type(node_type)
+    return size if base == "Split" else 1
+
+
+def port_count(node_type, modules=None):
+    """Number of Port nodes a node of the given type is compiled with.
+
+    Subcircuit instances and Splits evaluate to a tuple with one value per
+    output socket; the others to a single value and need no Ports.
+    """
+    if (modules and node_type in modules) or sized_type(node_type)[0] == "Split":
+        return output_socket_count(node_type, modules)
+    return 0
+
+
+def parse_bit(text):
+    """Convert the text of an Input field to 0/1, or None if it is invalid"""
+    text = text.strip()
+    if text == "0":
+        return 0
+    if text == "1":
+        return 1
+    return None
+
+
+def format_bit(value):
+    """Convert an evaluated value back to the "0"/"1" strings shown in the editor"""
+    return None if value is None else str(value)
+
+
+def format_value(value, width=1):
+    """Like format_bit, but buses are shown in hexadecimal with every digit"""
+    if value is None or width <= 1:
+        return format_bit(value)
+    return "0x{:0{}X}".format(value, (width + 3) // 4)
+
+
+class Netlist:
+    """A compiled circuit: flat arrays indexed by node number.
+
+    keys    -- the object each node was compiled from (a NodeItem in the editor)
+    types   -- node type names ("Input", "AND", "Output", ...)
+    fanin   -- for every node, the driving node index of each input socket,
+               or None when the socket is not connected
+    modules -- subcircuit definitions by type name (see modules.py)
+
+    A subcircuit instance evaluates to a tuple with one value per output; a
+    "Port <i>" node after it selects output i for the nodes it drives.
+    Splits work the same way.  widths holds the number of bits of every
+    node's value, and masks the matching all-ones words.
+    """
+
+    def __init__(self, keys, types, fanin, modules=None):
+        self.keys = list(keys)
+        self.types = list(types)
+        self.fanin = [tuple(drivers) for drivers in fanin]
+        self.index = {key: i for i, key in enumerate(self.keys)}
+
+        self.fanout = [[] for _ in self.keys]
+        for node, drivers in enumerate(self.fanin):
+            for driver in drivers:
+                if driver is not None:
+                    self.fanout[driver].append(node)
+
+        self.inputs = [i for i, t in enumerate(self.types) if t in SOURCE_TYPES]
+        self.outputs = [i for i, t in enumerate(self.types) if t in SINK_TYPES]
+        self.clocks = [i for i, t in enumerate(self.types) if t in CLOCK_TYPES]
+        self.state = [i for i, t in enumerate(self.types) if t in STATE_TYPES]
+        self.modules = modules or {}
+        self.ops = [self._op_for(t) for t in self.types]
+
+        self.order, self.cyclic = self._topological_order()
+        self.rank = [None] * len(self.keys)
+        for position, node in enumerate(self.order):
+            self.rank[node] = position
+        self.widths = self._widths()
+        self.masks = [(1 << width) - 1 for width in self.widths]
+        self.values = [None] * len(self.keys)
+        for node in self.clocks + self.state:
+            self.values[node] = 0  # Clocks start low and flip-flops cleared
+        self.evaluated = False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _op_for(self, node_type):
+        if node_type in GATE_OPS:
+            return GATE_OPS[node_type]
+        base, size = sized_type(node_type)
+        if size is not None:
+            return _merge if base == "Merge" else _split(size) if base == "Split" else GATE_OPS[base]
+        if node_type in self.modules:
+            return self.modules[node_type].evaluate
+        if node_type.startswith("Port "):
+            return _port(int(node_type[5:]))
+        return None
+
+    def _topological_order(self):
+        """Kahn's algorithm; nodes left over sit on a combinational loop"""
+        # Flip-flops and latches do not wait for their drivers
+        pending = [0 if t in STATE_TYPES else sum(1 for d in drivers if d is not None)
+                   for t, drivers in zip(self.types, self.fanin)]
+        ready = [i for i, count in enumerate(pending) if count == 0]
+        order = []
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for sink in self.fanout[node]:
+                pending[sink] -= 1
+                if pending[sink] == 0:
+                    ready.append(sink)
+        placed = set(order)
+        cyclic = [i for i in range(len(self.keys)) if i not in placed]
+        return order, cyclic
+
+    def _widths(self):
+        """Bits of every node's value, in topological order.
+
+        A gate is as wide as its widest operand and a flip-flop or latch as
+        its D input.  State breaks the order, so the pass repeats until no
+        width grows (widths only grow, so this ends).
+        """
+        widths = [1] * len(self.keys)
+        changed = True
+        while changed:
+            changed = False
+            for node in self.order:
+                node_type = self.types[node]
+                drivers = self.fanin[node]
+                base, size = sized_type(node_type)
+                if base == "Merge":
+                    width = size
+                elif base == "Split":
+                    width = 1  # Its Ports carry the bits
+                elif node_type.startswith("Port "):
+                    driver = drivers[0]
+                    module = self.modules.get(self.types[driver]) if driver is not None else None
+                    width = module.output_widths[int(node_type[5:])] if module is not None else 1
+                elif node_type in STATE_TYPES:
+                    width = widths[drivers[0]] if drivers and drivers[0] is not None else 1
+                elif self.ops[node] is not None and node_type not in self.modules:
+                    width = max((widths[d] for d in drivers if d is not None), default=1)
+                else:
+                    width = 1
+                if width != widths[node]:
+                    widths[node] = width
+                    changed = True
+        return widths
+
+    @property
+    def bit_parallel(self):
+        """Whether every signal, including those inside subcircuits, is one bit wide.
+
+        Only then can evaluate_words() pack vectors side by side into words.
+        """
+        if any(width > 1 for width in self.widths):
+            return False
+        return all(self.modules[t].netlist.bit_parallel for t in set(self.types) if t in self.modules)
+
+    def snapshot(self):
+        """Return a copy sharing this netlist's structure but with its own values.
+
+        The structure is never changed after compiling, so the copy can be
+        evaluated on another thread while this netlist stays in use.
+        """
+        clone = copy.copy(self)
+        clone.values = list(self.values)
+        return clone
+
+    def set_input(self, node, value):
+        """Set the value of an Input node (by index)"""
+        self.values[node] = value
+
+    def _evaluate_node(self, node, values, mask=None):
+        """Compute the value of one gate or sink from its drivers' values.
+
+        mask is the all-ones word of packed vectors; by default the node's
+        own width.
+        """
+        operands = [None if d is None else values[d] for d in self.fanin[node]]
+        if None in operands:
+            return None
+        return self.ops[node](operands, self.masks[node] if mask is None else mask)
+
+    def evaluate(self, input_values=None, cancel=None):
+        """Evaluate every node once in topological order and return the values.
+
+        input_values maps Input node indices to 0, 1 or None; Inputs that are
+        not mentioned keep their current value.  If the threading.Event cancel
+        gets set, EvaluationCancelled is raised part way through.
+        """
+        values = self.values
+        if input_values:
+            for node, value in input_values.items():
+                values[node] = value
+
+        ops = self.ops
+        order = self.order
+        for start in range(0, len(order), CANCEL_CHECK_INTERVAL):
+            if cancel is not None and cancel.is_set():
+                raise EvaluationCancelled()
+            for node in order[start:start + CANCEL_CHECK_INTERVAL]:
+                if ops[node] is not None:
+                    values[node] = self._evaluate_node(node, values)
+
+        # Nodes on a combinational loop have no well-defined value
+        for node in self.cyclic:
+            values[node] = None
+        self.evaluated = True
+        return values
+
+    def propagate(self, input_values, cancel=None):
+        """Apply changed Input values and re-evaluate only their fanout cone.
+
+        Dirty nodes are visited in topological order, and propagation stops at
+        any node whose value did not change.  Returns the indices of every node
+        whose value changed, in the order they were updated.  cancel works as
+        for evaluate().
+        """
+        if not self.evaluated:
+            self.evaluate(input_values, cancel)
+            return list(self.order)
+
+        values = self.values
+        rank = self.rank
+        fanout = self.fanout
+        heap = []
+        queued = set()
+        changed = []
+
+        def schedule(node):
+            for sink in fanout[node]:
+                if sink not in queued and rank[sink] is not None:
+                    queued.add(sink)
+                    heappush(heap, (rank[sink], sink))
+
+        for node, value in input_values.items():
+            if values[node] != value:
+                values[node] = value
+                changed.append(node)
+                schedule(node)
+
+        steps = 0
+        while heap:
+            steps += 1
+            if cancel is not None and steps % CANCEL_CHECK_INTERVAL == 0 and cancel.is_set():
+                raise EvaluationCancelled()
+            _, node = heappop(heap)
+            queued.discard(node)
+            if self.ops[node] is None:
+                continue
+            value = self._evaluate_node(node, values)
+            if value != values[node]:
+                values[node] = value
+                changed.append(node)
+                schedule(node)
+        return changed
+
+    def evaluate_words(self, input_words, mask, cancel=None):
+        """Evaluate with every signal packed into one integer word.
+
+        Bit k of each word belongs to test vector k, so a single pass over the
+        netlist simulates as many vectors as mask has bits.  input_words maps
+        Input node indices to words.  Returns a new list of words; the
+        single-vector values are left untouched.  Clocks and flip-flops hold
+        their current value in every vector.  cancel works as for evaluate().
+
+        Buses do not fit in such words, so a netlist that has any is
+        evaluated one vector at a time instead (see _evaluate_vectors); the
+        Outputs must then be single bits.  mask=1 is a single vector, which
+        works on buses directly.
+        """
+        if mask != 1 and not self.bit_parallel:
+            return self._evaluate_vectors(input_words, mask, cancel)
+        node_mask = None if mask == 1 else mask
+        words = [None] * len(self.keys)
+        for node in self.clocks + self.state:
+            value = self.values[node]
+            if mask != 1:
+                value = None if value is None else (mask if value else 0)
+            words[node] = value
+        for node, word in input_words.items():
+            words[node] = word
+        ops = self.ops
+        order = self.order
+        for start in range(0, len(order), CANCEL_CHECK_INTERVAL):
+            if cancel is not None and cancel.is_set():
+                raise EvaluationCancelled()
+            for node in order[start:start + CANCEL_CHECK_INTERVAL]:
+                if ops[node] is not None:
+                    words[node] = self._evaluate_node(node, words, node_mask)
+        return words
+
+    def _evaluate_vectors(self, input_words, mask, cancel=None):
+        """evaluate_words() for netlists with buses: one vector per pass.
+
+        Single-bit nodes get their packed words; bus nodes get None.
+        """
+        wide = [node for node in self.outputs if self.widths[node] > 1]
+        if wide:
+            raise ValueError(f"{len(wide)} Outputs carry buses, which cannot be packed into words")
+        words = [0] * len(self.keys)
+        for vector in range(mask.bit_length()):
+            values = self.evaluate_words({node: None if word is None else (word >> vector) & 1
+                                          for node, word in input_words.items()}, 1, cancel)
+            for node, value in enumerate(values):
+                if words[node] is None:
+                    continue
+                if value is None or self.widths[node] > 1:
+                    words[node] = None  # Undefined in some vector, so in the word
+                else:
+                    words[node] |= value << vector
+        return words
+
+    @classmethod
+    def from_circuit(cls, circuit, modules=None):
+        """Compile a CircuitData (see circuit_io) without any graphics items.
+
+        Node indices of the netlist are the node indices of the circuit; the
+        Port nodes of subcircuit instances and Splits are appended after them,
+        keyed by (node, output socket).
+        """
+        if modules is None and circuit.modules:
+            from modules import ModuleLibrary
+            modules = ModuleLibrary.from_bodies(circuit.modules)
+        keys = list(range(len(circuit.types)))
+        types = list(circuit.types)
+        fanin = [[None] * input_socket_count(t, modules) for t in types]
+        ports = {}
+        for node, node_type in enumerate(circuit.types):
+            if port_count(node_type, modules):
+                for output in range(port_count(node_type, modules)):
+                    ports[(node, output)] = len(keys)
+                    keys.append((node, output))
+                    types.append(port_type(output))
+                    fanin.append([node])
+        for src, dst, socket, src_socket in circuit.wires():
+            if socket < len(fanin[dst]):
+                fanin[dst][socket] = ports.get((src, src_socket), src)
+        return cls(keys, types, fanin, modules)
+
+    def value_of(self, key):
+        """Return the last evaluated value of the node compiled from key"""
+        node = self.index.get(key)
+        return None if node is None else self.values[node]
@@ -0,0 +1,897 @@
+"""Importing and exporting gate-level netlists: BLIF and structural Verilog.
+
+Synthesis tools write their results in these formats, often with hundreds of
+thousands of cells, so both readers stream the text one statement at a time
+and keep only the netlist: every net name is interned to a number and a gate
+is its type and the numbers of its nets.  Once the file is read every net is
+resolved to the node driving it and the nodes are placed in columns by logic
+level, Inputs on the left and Outputs on the right, so the CircuitData that
+comes out opens like a saved design.
+
+Cells become the editor's own node types:
+
+* A BLIF .names cover that is one gate (an AND, OR or parity of any number of
+  inputs, or its complement) becomes that gate; any other cover is built as a
+  sum of products from NOTs, ANDs and an OR.  A buffer is not a node at all,
+  just a second name for its input net.  .latch becomes a D Flip-Flop (or a
+  D Latch for level-sensitive ones), .clock a Clock node, and the cells of
+  .gate and .subckt are mapped by name like Verilog cells.
+* Verilog gate primitives (and, or, nand, nor, xor, xnor, not, buf), cells
+  whose names say what they are (NAND2X1, INV_X1, sky130_fd_sc_hd__nor3_1,
+  $_AND_, DFFPOSX1, $_DFF_P_ ...) and simple assigns (a net, a constant or
+  the complement of a net).  An input with a (* clock_period = N *)
+  attribute, as the writer marks Clocks, becomes a Clock of that period.
+
+A file that does not say which inputs are clocks (no .clock line, no
+clock_period or clocks attribute) has every input that drives only the clock
+pins of flip-flops and latches taken to be a free-running Clock, so designs
+from synthesis tools simulate after import.  A clock meant to be toggled by
+hand comes in as a Clock too; the editor's own files declare their Clocks,
+even when there are none, so they round-trip as they were.
+
+Gates of more than MAX_GATE_INPUTS inputs are split into trees.  Only flat
+netlists of one module are read; anything else raises CircuitFormatError.
+
+The writers name Input k "in<k>" and Output k "out<k>" in node order, the
+order the simulators use (top to bottom for a design saved by the editor),
+and the other nets "n<node>".
+"""
+
+import os
+import re
+
+from circuit_gen import COLUMN_WIDTH, ROW_HEIGHT
+from circuit_io import CircuitData, CircuitFormatError
+from netlist import (CLOCK_TYPES, CONSTANT_TYPES, GATE_TYPES, MAX_GATE_INPUTS, SINK_TYPES, STATE_TYPES,
+                     input_socket_count, sized_type)
+from sequential import DEFAULT_PERIOD, MIN_PERIOD, parse_ticks
+
+BLIF_EXTENSION = ".blif"
+VERILOG_EXTENSION = ".v"
+NETLIST_FILTER = "Netlists (*.blif *.v);;BLIF (*.blif);;Structural Verilog (*.v)"
+NODE_GAP = 30  # Vertical space between the nodes of a column
+MAX_PARITY_INPUTS = 16  # Wider .names covers are not checked for being an XOR
+PORTS_PER_LINE = 8
+
+NO_DRIVER = -1
+_INVERSE = {"AND": "NAND", "NAND": "AND", "OR": "NOR", "NOR": "OR", "XOR": "XNOR", "XNOR": "XOR",
+            "BUF": "NOT", "NOT": "BUF"}
+_NON_INVERTING = {"AND": "AND", "NAND": "AND", "OR": "OR", "NOR": "OR", "XOR": "XOR", "XNOR": "XOR"}
+
+# Cell names: an optional library prefix ending in "__", the function, the
+# number of inputs and a drive strength ("X1", "_X2", "_1")
+_CELL = re.compile(r"(nand|nor|xnor|xor|and|or|inv|not|clkinv|buf|clkbuf)(\d*)(?:x\d+|_x?\d+)?")
+_TIE_CELL = re.compile(r"(tiehi|tie1|logic1|tielo|tie0|logic0)(?:x\d+|_x?\d+)?")
+_FLIP_FLOP_CELL = re.compile(r"dff(?:pos|_p)?(?:x\d+|_x?\d+)?")
+_LATCH_CELL = re.compile(r"dlatch(?:_p)?(?:x\d+|_x?\d+)?")
+_CELL_TYPES = {"nand": "NAND", "nor": "NOR", "xnor": "XNOR", "xor": "XOR", "and": "AND", "or": "OR",
+               "inv": "NOT", "not": "NOT", "clkinv": "NOT", "buf": "BUF", "clkbuf": "BUF"}
+_OUTPUT_PINS = ("y", "z", "zn", "q", "o", "out", "x")
+_CLOCK_PINS = ("c", "ck", "clk", "cp", "e", "en", "g", "gate")
+
+_PRIMITIVES = {"and": "AND", "or": "OR", "nand": "NAND", "nor": "NOR", "xor": "XOR", "xnor": "XNOR",
+               "not": "NOT", "buf": "BUF"}
+_DECLARATIONS = ("input", "output", "inout", "wire", "reg", "signed", "supply0", "supply1")
+_IGNORED = ("wire", "reg", "tri", "parameter", "localparam", "specify", "endspecify", "timeunit",
+            "timeprecision", "defparam")
+_VERILOG_TOKEN = re.compile(r"\(\*clock(?:_period|s)=\d+\*\)|\\\S+|[A-Za-z_][\w$]*|\$[\w$]+|\d*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ_?]+|\d+|\S")
+_VERILOG_CONSTANT = re.compile(r"\d*'[sS]?[bBoOdDhH]\s*([0-9a-fA-F_]+)|(\d+)")
+_VERILOG_NAME = re.compile(r"[A-Za-z_][\w$]*")
+_COMMENT_OR_ATTRIBUTE = re.compile(r"/\*.*?\*/|\(\*.*?\*\)")
+_CLOCK_ATTRIBUTE = re.compile(r"\(\*.*\b(clock_period|clocks)\s*=\s*(\d+).*\*\)")
+# Lines of only names, bit selects and punctuation, which most of a netlist is,
+# are tokenized with str methods rather than the (much slower) regular expression
+_PLAIN_LINE = re.compile(r"[\w\s(),.;$\[\]]*")
+
+
+class _NetlistBuilder:
+    """Gates over named nets, resolved into a placed CircuitData at the end"""
+
+    def __init__(self):
+        self.net_ids = {}  # Name -> net
+        self.net_names = []  # Net -> name, for error messages
+        self.driver = []  # Net -> the node driving it, or NO_DRIVER
+        self.alias = {}  # Net -> the net it is another name for (buffers)
+        self.types = []  # Per node
+        self.fanin = []  # Per node: the nets of its input sockets
+        self.values = {}  # Node -> value text
+        self.outputs = []  # Nets of the output ports, in order
+        self.constants = {}  # 0/1 -> net of a Constant node
+        self.inverted = {}  # Net -> net of a NOT of it
+        self.clock = None  # Net of the Clock of latches that name none
+        self.clocks_declared = False  # Whether the file says which inputs are clocks
+        self.cover_gates = {}  # Cubes -> the gate that cover is, or None; most covers repeat
+
+    def net(self, name):
+        net = self.net_ids.get(name)
+        if net is None:
+            net = self.net_ids[name] = len(self.net_names)
+            self.net_names.append(name)
+            self.driver.append(NO_DRIVER)
+        return net
+
+    def fresh(self):
+        """A net no name in the file refers to"""
+        net = len(self.net_names)
+        self.net_names.append(f"${net}")
+        self.driver.append(NO_DRIVER)
+        return net
+
+    def _drive(self, net):
+        if self.driver[net] != NO_DRIVER or net in self.alias:
+            raise CircuitFormatError(f"Net {self.net_names[net]} has more than one driver")
+
+    def add(self, node_type, fanin, net=None):
+        """Add a node driving net (a fresh one if None); returns the net"""
+        net = self.fresh() if net is None else net
+        self._drive(net)
+        self.driver[net] = len(self.types)
+        self.types.append(node_type)
+        self.fanin.append(fanin)
+        return net
+
+    def input(self, name, node_type="Input"):
+        net = self.add(node_type, [], self.net(name))
+        self.values[self.driver[net]] = "0" if node_type == "Input" else str(DEFAULT_PERIOD)
+        return net
+
+    def buffer(self, source, net):
+        """Make net another name for source"""
+        self._drive(net)
+        if source == net:
+            raise CircuitFormatError(f"Net {self.net_names[net]} drives itself")
+        self.alias[net] = source
+
+    def constant(self, value):
+        net = self.constants.get(value)
+        if net is None:
+            net = self.constants[value] = self.add(f"Constant {value}", [])
+        return net
+
+    def negated(self, net):
+        """A net carrying the complement of net, shared by all that need it"""
+        result = self.inverted.get(net)
+        if result is None:
+            result = self.inverted[net] = self.add("NOT", [net])
+        return result
+
+    def global_clock(self):
+        if self.clock is None:
+            self.clock = self.add("Clock", [])
+            self.values[self.driver[self.clock]] = str(DEFAULT_PERIOD)
+        return self.clock
+
+    def gate(self, base, fanin, net=None):
+        """A gate of any number of inputs (BUF for a buffer); returns its net"""
+        if base in ("BUF", "NOT") or len(fanin) == 1:
+            if len(fanin) != 1:
+                raise CircuitFormatError(f"A {base} takes one input, not {len(fanin)}")
+            if base in ("BUF", "AND", "OR", "XOR"):
+                if net is None:
+                    return fanin[0]
+                self.buffer(fanin[0], net)
+                return net
+            return self.add("NOT", fanin, net)
+        if not fanin:
+            raise CircuitFormatError(f"A {base} gate has no inputs")
+        if len(fanin) > MAX_GATE_INPUTS:
+            # A tree: the chunks are combined by a gate of the same kind
+            part = _NON_INVERTING[base]
+            fanin = [self.gate(part, fanin[i:i + MAX_GATE_INPUTS])
+                     for i in range(0, len(fanin), MAX_GATE_INPUTS)]
+            return self.gate(base, fanin, net)
+        return self.add(base if len(fanin) == 2 else f"{base} {len(fanin)}", list(fanin), net)
+
+    def cover(self, fanin, net, cubes, on=True):
+        """Drive net with the function of a BLIF cover.
+
+        cubes are strings of 0, 1 and - (one character per input); the
+        function is 1 where a cube matches if on, and 0 there otherwise.
+        """
+        if not cubes:
+            self.buffer(self.constant(0), net)
+            return
+        if any(cube.count("-") == len(cube) for cube in cubes):
+            self.buffer(self.constant(1 if on else 0), net)
+            return
+        key = tuple(cubes)
+        base = self.cover_gates.get(key, False)
+        if base is False:
+            base = self.cover_gates[key] = _cover_gate(cubes, len(fanin))
+        if base is not None:
+            self.gate(base if on else _INVERSE[base], fanin, net)
+            return
+        terms = []
+        for cube in cubes:
+            literals = [fanin[i] if bit == "1" else self.negated(fanin[i])
+                        for i, bit in enumerate(cube) if bit != "-"]
+            terms.append(self.gate("AND", literals))
+        self.gate("OR" if on else "NOR", terms, net)
+
+    def cell(self, cell, pins):
+        """Add a library cell, given (pin name or None, net) connections"""
+        name = cell.lstrip("\\$").lower().rsplit("__", 1)[-1].strip("_")
+        named = all(pin is not None for pin, _ in pins)
+        if named:
+            outputs = [net for pin, net in pins if pin.lower() in _OUTPUT_PINS]
+            inputs = [(pin.lower(), net) for pin, net in pins if pin.lower() not in _OUTPUT_PINS]
+        else:
+            outputs = [net for _, net in pins[:1]]
+            inputs = [(None, net) for _, net in pins[1:]]
+        if len(outputs) != 1 or outputs[0] is None:
+            raise CircuitFormatError(f"cell {cell} must drive exactly one net")
+        inputs = [(pin, self.fresh() if net is None else net) for pin, net in inputs]  # Unconnected pins
+        match = _CELL.fullmatch(name)
+        if match:
+            fanin = [net for _, net in inputs]
+            if match.group(2) and int(match.group(2)) != len(fanin):
+                raise CircuitFormatError(f"cell {cell} has {len(fanin)} inputs connected")
+            self.gate(_CELL_TYPES[match.group(1)], fanin, outputs[0])
+            return
+        match = _TIE_CELL.fullmatch(name)
+        if match and not inputs:
+            self.buffer(self.constant(1 if match.group(1) in ("tiehi", "tie1", "logic1") else 0), outputs[0])
+            return
+        state = "D Flip-Flop" if _FLIP_FLOP_CELL.fullmatch(name) else "D Latch" if _LATCH_CELL.fullmatch(name) else None
+        if state is not None and len(inputs) == 2:
+            if named:
+                clocks = [net for pin, net in inputs if pin in _CLOCK_PINS]
+                data = [net for pin, net in inputs if pin not in _CLOCK_PINS]
+                if len(clocks) != 1:
+                    raise CircuitFormatError(f"cannot tell the clock pin of cell {cell}")
+                inputs = [(None, data[0]), (None, clocks[0])]
+            self.add(state, [net for _, net in inputs], outputs[0])
+            return
+        raise CircuitFormatError(f"unknown cell {cell}")
+
+    def _find(self, net):
+        """The net that actually has a driver, following buffers"""
+        seen = 0
+        while net in self.alias:
+            net = self.alias[net]
+            seen += 1
+            if seen > len(self.alias):
+                raise CircuitFormatError(f"Buffers form a loop through net {self.net_names[net]}")
+        return net
+
+    def circuit(self):
+        """Resolve the nets and place the nodes; returns the CircuitData"""
+        types = self.types
+        for net in self.outputs:
+            types.append("Output")
+            self.fanin.append([net])
+        resolved = self.driver  # Net -> driving node, through buffers
+        for net in self.alias:
+            resolved[net] = self.driver[self._find(net)]
+        count = len(types)
+
+        # Wires, and the fanout for levelling the nodes
+        circuit = CircuitData()
+        wire_src, wire_dst, wire_socket = circuit.wire_src, circuit.wire_dst, circuit.wire_socket
+        fanout = [[] for _ in range(count)]
+        pending = [0] * count  # Drivers not yet levelled
+        clocking = set()  # Drivers of flip-flop and latch clock sockets
+        latched = set()  # Drivers of their D sockets
+        for node, nets in enumerate(self.fanin):
+            breaks_loops = types[node] in STATE_TYPES  # Like Inputs
+            for socket, net in enumerate(nets):
+                source = resolved[net]
+                if source != NO_DRIVER:
+                    wire_src.append(source)
+                    wire_dst.append(node)
+                    wire_socket.append(socket)
+                    if not breaks_loops:
+                        fanout[source].append(node)
+                        pending[node] += 1
+                    elif socket:
+                        clocking.add(source)
+                    else:
+                        latched.add(source)
+        circuit.wire_src_socket = [0] * len(wire_src)
+
+        # Unless the file says which inputs are clocks, one that only drives
+        # clock sockets is taken to be one (most netlists have no Clock type)
+        for node in () if self.clocks_declared else clocking:
+            if types[node] == "Input" and not fanout[node] and node not in latched:
+                types[node] = "Clock"
+                self.values[node] = str(DEFAULT_PERIOD)
+
+        # Logic levels, in topological order; nodes on combinational loops go last
+        level = [0] * count
+        ready = [node for node, waiting in enumerate(pending) if not waiting]
+        for node in ready:
+            next_level = level[node] + 1
+            for sink in fanout[node]:
+                if level[sink] < next_level:
+                    level[sink] = next_level
+                pending[sink] -= 1
+                if not pending[sink]:
+                    ready.append(sink)
+        del fanout, ready
+        last = max(level, default=0) + 1
+        looped = [node for node, waiting in enumerate(pending) if waiting]
+        for node in looped:
+            level[node] = last
+        if looped:
+            last += 1
+        for node in range(count - len(self.outputs), count):
+            level[node] = last
+
+        # Columns are filled top to bottom, in node order
+        column_ys = {}
+        ys = circuit.ys
+        for column, nets in zip(level, self.fanin):
+            y = column_ys.get(column, 0)
+            column_ys[column] = y + max(ROW_HEIGHT, 25 + 15 * len(nets) + NODE_GAP)
+            ys.append(y)
+        self.fanin = None
+        circuit.types = types
+        circuit.xs = [column * COLUMN_WIDTH for column in level]
+        circuit.values = [""] * count
+        for node, value in self.values.items():
+            circuit.values[node] = value
+        return circuit
+
+
+def _cover_gate(cubes, inputs):
+    """The gate a cover without an all-don't-care cube is, or None"""
+    if len(cubes) == 1:
+        if cubes[0] == "1" * inputs:
+            return "AND"
+        if cubes[0] == "0" * inputs:
+            return "NOR"
+    if len(cubes) == inputs:
+        literals = {}
+        for cube in cubes:
+            cared = [(i, bit) for i, bit in enumerate(cube) if bit != "-"]
+            if len(cared) != 1:
+                break
+            literals[cared[0][0]] = cared[0][1]
+        else:
+            if len(literals) == inputs:
+                if all(bit == "1" for bit in literals.values()):
+                    return "OR"
+                if all(bit == "0" for bit in literals.values()):
+                    return "NAND"
+    if 2 <= inputs <= MAX_PARITY_INPUTS and len(cubes) == 1 << (inputs - 1) and len(set(cubes)) == len(cubes):
+        parities = {cube.count("1") % 2 for cube in cubes if "-" not in cube}
+        if len(parities) == 1 and all("-" not in cube for cube in cubes):
+            return "XOR" if parities.pop() else "XNOR"
+    return None
+
+
+def _blif_lines(stream):
+    """Yield (line number, tokens) of each logical line, joining \\ continuations"""
+    tokens = []
+    start = None
+    for number, line in enumerate(stream, 1):
+        if "#" in line:
+            line = line.split("#", 1)[0]
+        if "\\" in line and line.rstrip().endswith("\\"):
+            tokens.extend(line.rstrip()[:-1].split())
+            if start is None:
+                start = number
+        elif tokens:
+            tokens.extend(line.split())
+            yield start, tokens
+            tokens = []
+            start = None
+        else:
+            words = line.split()
+            if words:
+                yield number, words
+    if tokens:
+        yield start, tokens
+
+
+def read_blif(stream):
+    """Read the first model of a BLIF text stream into a placed CircuitData"""
+    builder = _NetlistBuilder()
+    cover = None  # [fanin nets, net, cubes, output value, line] of the .names being read
+
+    def finish_cover():
+        fanin, net, cubes, value, number = cover
+        try:
+            builder.cover(fanin, net, cubes, value != "0")
+        except CircuitFormatError as error:
+            raise CircuitFormatError(f"Line {number}: {error}") from None
+
+    for number, tokens in _blif_lines(stream):
+        keyword = tokens[0]
+        if keyword[0] != ".":
+            if cover is None:
+                raise CircuitFormatError(f"Line {number}: cover line outside of .names")
+            fanin = cover[0]
+            cube, value = (tokens[0], tokens[1]) if len(tokens) == 2 else ("", tokens[0])
+            if len(tokens) > 2 or len(cube) != len(fanin) or value not in ("0", "1") or cube.strip("01-"):
+                raise CircuitFormatError(f"Line {number}: malformed cover line")
+            if cover[3] is not None and cover[3] != value:
+                raise CircuitFormatError(f"Line {number}: a cover lists both ones and zeros")
+            cover[2].append(cube)
+            cover[3] = value
+            continue
+        if cover is not None:
+            finish_cover()
+            cover = None
+        arguments = tokens[1:]
+        try:
+            if keyword == ".inputs":
+                for name in arguments:
+                    builder.input(name)
+            elif keyword == ".clock":
+                builder.clocks_declared = True
+                for name in arguments:
+                    builder.input(name, "Clock")
+            elif keyword == ".outputs":
+                builder.outputs.extend(builder.net(name) for name in arguments)
+            elif keyword == ".names":
+                if not arguments:
+                    raise CircuitFormatError(".names without an output")
+                cover = [[builder.net(name) for name in arguments[:-1]], builder.net(arguments[-1]), [], None, number]
+            elif keyword == ".latch":
+                _read_latch(builder, arguments)
+            elif keyword in (".gate", ".subckt"):
+                if not arguments:
+                    raise CircuitFormatError(f"{keyword} without a cell")
+                pins = []
+                for argument in arguments[1:]:
+                    pin, _, name = argument.partition("=")
+                    pins.append((pin, builder.net(name)))
+                builder.cell(arguments[0], pins)
+            elif keyword in (".end", ".exdc"):
+                break  # Only the first model; don't-care networks are not logic
+            # Other keywords (.model, timing and area annotations) carry no logic
+        except CircuitFormatError as error:
+            raise CircuitFormatError(f"Line {number}: {error}") from None
+    if cover is not None:
+        finish_cover()
+    return builder.circuit()
+
+
+def _read_latch(builder, arguments):
+    """.latch input output [type control] [init]; without a control the global clock"""
+    if len(arguments) < 2:
+        raise CircuitFormatError(".latch needs an input and an output")
+    data, net = builder.net(arguments[0]), builder.net(arguments[1])
+    kind = arguments[2] if len(arguments) > 3 else "re"
+    control = arguments[3] if len(arguments) > 3 else "NIL"
+    clock = builder.global_clock() if control == "NIL" else builder.net(control)
+    if kind in ("fe", "al"):
+        clock = builder.negated(clock)
+    if kind in ("re", "fe"):
+        builder.add("D Flip-Flop", [data, clock], net)
+    elif kind in ("ah", "al"):
+        builder.add("D Latch", [data, clock], net)
+    else:
+        raise CircuitFormatError(f"unsupported latch type {kind}")
+
+
+def _verilog_statements(stream):
+    """Yield (line number, tokens) of each statement, without comments and attributes.
+
+    A statement ends at a semicolon, except for endmodule, which has none.
+    Bit selects such as a [ 3 ] are joined into one token "a[3]".
+    """
+    statement = []
+    start = None
+    in_comment = False
+    for number, line in enumerate(stream, 1):
+        if in_comment or "/" in line or "(*" in line or "`" in line:
+            if in_comment:
+                end = line.find("*/")
+                if end < 0:
+                    continue
+                line = line[end + 2:]
+                in_comment = False
+            line = _COMMENT_OR_ATTRIBUTE.sub(_clock_attribute_token, line)
+            if "/*" in line:
+                line, in_comment = line[:line.index("/*")], True
+            line = line.split("//", 1)[0]
+            if line.lstrip().startswith("`"):
+                continue  # Compiler directive
+        plain = _PLAIN_LINE.fullmatch(line) and " [" not in line
+        if plain and not statement and line.count(";") == 1:
+            line = line.rstrip()
+            if line.endswith(";"):
+                # The common case: one whole statement on the line
+                tokens = line[:-1].replace("(", " ( ").replace(")", " ) ").replace(",", " , ").replace(".", " . ").split()
+                if tokens:
+                    yield number, tokens
+                continue
+        parts = line.split(";")
+        for i, part in enumerate(parts):
+            if plain:
+                tokens = part.replace("(", " ( ").replace(")", " ) ").replace(",", " , ").replace(".", " . ").split()
+            else:
+                tokens = _VERILOG_TOKEN.findall(part)
+            if tokens and not statement:
+                start = number
+                if tokens[0] == "endmodule":
+                    yield number, tokens[:1]
+                    tokens = tokens[1:]
+            statement.extend(tokens)
+            if i < len(parts) - 1 and statement:
+                yield start, _join_selects(statement) if "[" in statement and not plain else statement
+                statement = []
+    if statement:
+        raise CircuitFormatError(f"Line {start}: statement not ended by a semicolon")
+
+
+def _clock_attribute_token(match):
+    """A clock_period or clocks attribute as one token (see _VerilogReader); anything else is dropped"""
+    attribute = _CLOCK_ATTRIBUTE.fullmatch(match.group())
+    return f" (*{attribute.group(1)}={attribute.group(2)}*) " if attribute else " "
+
+
+def _join_selects(tokens):
+    joined = []
+    i = 0
+    while i < len(tokens):
+        if (tokens[i] == "[" and joined and i + 2 < len(tokens) and tokens[i + 1].isdigit()
+                and tokens[i + 2] == "]" and joined[-1] not in _DECLARATIONS):
+            joined[-1] += f"[{tokens[i + 1]}]"
+            i += 3
+        else:
+            joined.append(tokens[i])
+            i += 1
+    return joined
+
+
+def _closing(tokens, i):
+    """Index of the parenthesis that closes the one at tokens[i]"""
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j] == "(":
+            depth += 1
+        elif tokens[j] == ")":
+            depth -= 1
+            if not depth:
+                return j
+    raise CircuitFormatError("Unbalanced parentheses")
+
+
+def _split_commas(tokens):
+    """Split tokens at the commas outside parentheses"""
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if token == "," and not depth:
+            parts.append([])
+            continue
+        depth += (token == "(") - (token == ")")
+        parts[-1].append(token)
+    return parts
+
+
+class _VerilogReader:
+    """Turns the statements of one module into gates of a _NetlistBuilder"""
+
+    def __init__(self):
+        self.builder = _NetlistBuilder()
+        self.module = None
+        self.outputs = []
+
+    def declare(self, tokens):
+        """Input and output declarations, also those in an ANSI port list.
+
+        Inputs declared after a (* clock_period = N *) attribute are Clocks.
+        """
+        direction = None
+        msb = lsb = None
+        period = attribute = None
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token in ("input", "output", "inout"):
+                direction = token
+                msb = lsb = None
+                period, attribute = attribute, None
+            elif token.startswith("(*"):
+                self.builder.clocks_declared = True
+                key, value = token[2:-2].split("=")
+                attribute = value if key == "clock_period" else None
+            elif token == "[":
+                try:
+                    close = tokens.index("]", i)
+                    msb, lsb = int(tokens[i + 1]), int(tokens[i + 3])
+                except (ValueError, IndexError):
+                    raise CircuitFormatError("unsupported range") from None
+                i = close
+            elif token in ("wire", "reg", "signed", "logic", ","):
+                pass
+            elif direction is not None:
+                step = 1 if msb is None or lsb >= msb else -1
+                names = [token] if msb is None else [f"{token}[{bit}]" for bit in range(msb, lsb + step, step)]
+                for name in names:
+                    name = name.lstrip("\\")
+                    if direction == "input" and period is not None:
+                        net = self.builder.input(name, "Clock")
+                        self.builder.values[self.builder.driver[net]] = period
+                    elif direction == "input":
+                        self.builder.input(name)
+                    elif direction == "output":
+                        self.outputs.append(self.builder.net(name))
+                    else:
+                        raise CircuitFormatError("inout ports are not supported")
+            i += 1
+
+    def net(self, tokens):
+        """The net of an expression: a name, a constant or nothing (None)"""
+        if len(tokens) == 1 and tokens[0][0] not in "0123456789'\\":
+            return self.builder.net(tokens[0])  # The common case: a plain name
+        if not tokens:
+            return None
+        if len(tokens) == 2 and tokens[0] == "~":
+            return self.builder.negated(self.net(tokens[1:]))
+        if len(tokens) != 1:
+            raise CircuitFormatError(f"only nets and constants can be connected, not {' '.join(tokens)}")
+        token = tokens[0]
+        match = _VERILOG_CONSTANT.fullmatch(token)
+        if match:
+            digits = (match.group(1) or match.group(2)).replace("_", "")
+            if digits not in ("0", "1"):
+                raise CircuitFormatError(f"only one-bit constants are supported, not {token}")
+            return self.builder.constant(int(digits))
+        if "'" in token:
+            return None  # x or z: left unconnected
+        return self.builder.net(token.lstrip("\\"))
+
+    def instances(self, tokens):
+        """(instance, [(pin or None, net)]) of each instance in a statement after the cell name"""
+        i = 0
+        if tokens and tokens[0] == "#":
+            i = _closing(tokens, 1) + 1 if len(tokens) > 1 and tokens[1] == "(" else 2
+        elif len(tokens) > 2 and tokens[-1] == ")" and "(" in tokens:
+            # One instance connected by plain names, as netlists mostly are:
+            # "g (y, a, b)" or "u (.A(a), .B(b), .Y(y))"
+            open_index = tokens.index("(")
+            body = tokens[open_index + 1:-1]
+            if "(" not in body and len(body) % 2 and body[1::2].count(",") == len(body) // 2:
+                yield " ".join(tokens[:open_index]), [(None, self.net(body[i:i + 1]))
+                                                       for i in range(0, len(body), 2)]
+                return
+            pins = (len(body) + 1) // 6
+            if (len(body) % 6 == 5 and body[0::6].count(".") == pins and body[2::6].count("(") == pins
+                    and body[4::6].count(")") == pins and body[5::6].count(",") == pins - 1):
+                yield " ".join(tokens[:open_index]), [(pin.lstrip("\\"), self.net([net]))
+                                                       for pin, net in zip(body[1::6], body[3::6])]
+                return
+        for part in _split_commas(tokens[i:]):
+            if not part:
+                raise CircuitFormatError("malformed instance")
+            open_index = part.index("(") if "(" in part else -1
+            if open_index < 0 or part[-1] != ")" or _closing(part, open_index) != len(part) - 1:
+                raise CircuitFormatError("malformed instance")
+            pins = []
+            for connection in _split_commas(part[open_index + 1:-1]):
+                if connection and connection[0] == ".":
+                    if len(connection) < 4 or connection[2] != "(" or connection[-1] != ")":
+                        raise CircuitFormatError("malformed connection")
+                    pins.append((connection[1].lstrip("\\"), self.net(connection[3:-1])))
+                else:
+                    pins.append((None, self.net(connection)))
+            yield " ".join(part[:open_index]), pins
+
+    def statement(self, tokens):
+        keyword = tokens[0]
+        builder = self.builder
+        if keyword.startswith("(*"):
+            builder.clocks_declared = True  # Only clock attributes are kept as tokens
+            if len(tokens) > 1 and tokens[1] in ("input", "output", "inout"):
+                self.declare(tokens)
+            elif len(tokens) > 1:
+                self.statement(tokens[1:])
+        elif keyword == "module":
+            if self.module is not None:
+                raise CircuitFormatError("only flat netlists of one module can be imported")
+            self.module = tokens[1] if len(tokens) > 1 else ""
+            if "(" in tokens:
+                start = tokens.index("(")
+                self.declare(tokens[start + 1:_closing(tokens, start)])
+        elif keyword in ("input", "output", "inout"):
+            self.declare(tokens)
+        elif keyword in ("supply0", "supply1"):
+            for name in tokens[1:]:
+                if name != ",":
+                    builder.buffer(builder.constant(int(keyword[-1])), builder.net(name.lstrip("\\")))
+        elif keyword == "assign":
+            for part in _split_commas(tokens[1:]):
+                if "=" not in part or part.index("=") != 1:
+                    raise CircuitFormatError("malformed assign")
+                source = self.net(part[2:])
+                if source is not None:
+                    builder.buffer(source, self.net(part[:1]))
+        elif keyword in _PRIMITIVES:
+            for _, pins in self.instances(tokens[1:]):
+                nets = [net for _, net in pins]
+                if None in nets or len(nets) < 2:
+                    raise CircuitFormatError(f"{keyword} gates need an output and inputs")
+                if keyword in ("not", "buf"):
+                    for net in nets[:-1]:  # Several outputs, one input
+                        builder.gate(_PRIMITIVES[keyword], nets[-1:], net)
+                else:
+                    builder.gate(_PRIMITIVES[keyword], nets[1:], nets[0])
+        elif keyword in ("wire", "reg") and "=" in tokens:
+            equals = tokens.index("=")  # A declaration with an assignment
+            self.statement(["assign"] + tokens[equals - 1:])
+        elif keyword in _IGNORED:
+            pass
+        elif _VERILOG_NAME.fullmatch(keyword) or keyword.startswith(("\\", "$")):
+            for _, pins in self.instances(tokens[1:]):
+                builder.cell(keyword, pins)
+        else:
+            raise CircuitFormatError(f"unexpected {keyword}")
+
+
+def read_verilog(stream):
+    """Read a flat structural Verilog module from a text stream into a placed CircuitData"""
+    reader = _VerilogReader()
+    ended = False
+    for number, tokens in _verilog_statements(stream):
+        if tokens[0] == "endmodule":
+            ended = True
+            continue
+        if ended and tokens[0] != "module":
+            raise CircuitFormatError(f"Line {number}: {tokens[0]} outside of a module")
+        try:
+            reader.statement(tokens)
+        except CircuitFormatError as error:
+            raise CircuitFormatError(f"Line {number}: {error}") from None
+    if reader.module is None:
+        raise CircuitFormatError("No module found")
+    reader.builder.outputs = reader.outputs
+    return reader.builder.circuit()
+
+
+class _ExportNames:
+    """Net names of a CircuitData, and its nodes checked for what the formats can hold"""
+
+    def __init__(self, circuit):
+        self.drivers = [[None] * input_socket_count(node_type, circuit.modules) for node_type in circuit.types]
+        for src, dst, socket, src_socket in circuit.wires():
+            if src_socket:
+                raise ValueError(f"Cannot export {circuit.types[src]} nodes")
+            if socket < len(self.drivers[dst]):
+                self.drivers[dst][socket] = src
+        self.names = [f"n{node}" for node in range(len(circuit))]
+        self.inputs = [node for node, node_type in enumerate(circuit.types) if node_type == "Input"]
+        self.clocks = [node for node, node_type in enumerate(circuit.types) if node_type in CLOCK_TYPES]
+        self.outputs = [node for node, node_type in enumerate(circuit.types) if node_type in SINK_TYPES]
+        for k, node in enumerate(self.inputs):
+            self.names[node] = f"in{k}"
+        for k, node in enumerate(self.clocks):
+            self.names[node] = f"clk{k}"
+        self.logic = []  # (node, base type, input net names), in file order
+        for node, node_type in enumerate(circuit.types):
+            base = sized_type(node_type)[0]
+            if node_type in ("Input", "Output", "Write Output") or node_type in CLOCK_TYPES:
+                continue
+            if base not in GATE_TYPES and node_type not in CONSTANT_TYPES and node_type not in STATE_TYPES:
+                raise ValueError(f"Cannot export {node_type} nodes")
+            self.logic.append((node, base, self.fanin(circuit, node)))
+        self.output_drivers = [self.fanin(circuit, node)[0] for node in self.outputs]
+
+    def fanin(self, circuit, node):
+        missing = [socket for socket, src in enumerate(self.drivers[node]) if src is None]
+        if missing:
+            raise ValueError(f"A {circuit.types[node]} node has an unconnected input")
+        return [self.names[src] for src in self.drivers[node]]
+
+
+def write_blif(circuit, stream, model="circuit"):
+    """Write a circuit of gates, constants, flip-flops and latches as a BLIF model.
+
+    Raises ValueError for what BLIF cannot hold: buses, subcircuits and
+    unconnected inputs.
+    """
+    names = _ExportNames(circuit)
+    stream.write(f".model {model}\n")
+    _write_wrapped(stream, ".inputs", [names.names[node] for node in names.inputs])
+    _write_wrapped(stream, ".clock", [names.names[node] for node in names.clocks])
+    _write_wrapped(stream, ".outputs", [f"out{k}" for k in range(len(names.outputs))])
+    for node, base, fanin in names.logic:
+        net = names.names[node]
+        node_type = circuit.types[node]
+        if node_type in CONSTANT_TYPES:
+            stream.write(f".names {net}\n" + ("1\n" if node_type == "Constant 1" else ""))
+        elif node_type == "D Flip-Flop":
+            stream.write(f".latch {fanin[0]} {net} re {fanin[1]} 2\n")
+        elif node_type == "D Latch":
+            stream.write(f".latch {fanin[0]} {net} ah {fanin[1]} 2\n")
+        elif base in ("XOR", "XNOR") and len(fanin) > 2:
+            # A chain of two-input gates rather than a cover of 2^(n-1) cubes
+            previous = fanin[0]
+            for i, name in enumerate(fanin[1:-1], 1):
+                stream.write(f".names {previous} {name} {net}_{i}\n01 1\n10 1\n")
+                previous = f"{net}_{i}"
+            _write_cover(stream, base, [previous, fanin[-1]], net)
+        else:
+            _write_cover(stream, base, fanin, net)
+    for k, source in enumerate(names.output_drivers):
+        stream.write(f".names {source} out{k}\n1 1\n")
+    stream.write(".end\n")
+
+
+def _write_wrapped(stream, keyword, names):
+    for i in range(0, len(names), PORTS_PER_LINE):
+        stream.write(" ".join([keyword] + names[i:i + PORTS_PER_LINE]) + "\n")
+    if not names:
+        stream.write(keyword + "\n")
+
+
+def _write_cover(stream, base, fanin, net):
+    n = len(fanin)
+    stream.write(f".names {' '.join(fanin)} {net}\n")
+    if base == "NOT":
+        stream.write("0 1\n")
+    elif base in ("AND", "NAND"):
+        stream.write("1" * n + (" 1\n" if base == "AND" else " 0\n"))
+    elif base in ("OR", "NOR"):
+        stream.write("".join("-" * i + "1" + "-" * (n - i - 1) + " 1\n" for i in range(n)) if base == "OR"
+                     else "0" * n + " 1\n")
+    else:
+        stream.write("01 1\n10 1\n" if base == "XOR" else "00 1\n11 1\n")
+
+
+def write_verilog(circuit, stream, module="circuit"):
+    """Write a circuit as a flat structural Verilog module of gate primitives.
+
+    Flip-flops and latches are written as instances of Yosys' $_DFF_P_ and
+    $_DLATCH_P_ cells, each Clock as an input with a clock_period attribute,
+    and the module gets a clocks attribute, so that a file without Clocks
+    declares that too.  Raises ValueError like write_blif.
+    """
+    names = _ExportNames(circuit)
+    inputs = [names.names[node] for node in names.inputs]
+    clocks = [names.names[node] for node in names.clocks]
+    outputs = [f"out{k}" for k in range(len(names.outputs))]
+    ports = inputs + clocks + outputs
+    stream.write(f"(* clocks = {len(clocks)} *)\nmodule {module} (\n")
+    for i in range(0, len(ports), PORTS_PER_LINE):
+        last = i + PORTS_PER_LINE >= len(ports)
+        stream.write("  " + ", ".join(ports[i:i + PORTS_PER_LINE]) + ("\n" if last else ",\n"))
+    stream.write(");\n")
+    for direction, group in (("input", inputs), ("output", outputs)):
+        for i in range(0, len(group), PORTS_PER_LINE):
+            stream.write(f"  {direction} {', '.join(group[i:i + PORTS_PER_LINE])};\n")
+        if direction == "input":
+            for node, name in zip(names.clocks, clocks):
+                period = parse_ticks(circuit.values[node], DEFAULT_PERIOD, MIN_PERIOD)
+                stream.write(f"  (* clock_period = {period} *) input {name};\n")
+    for node, _, _ in names.logic:
+        stream.write(f"  wire {names.names[node]};\n")
+    for node, base, fanin in names.logic:
+        net = names.names[node]
+        node_type = circuit.types[node]
+        if node_type in CONSTANT_TYPES:
+            stream.write(f"  assign {net} = 1'b{node_type[-1]};\n")
+        elif node_type in STATE_TYPES:
+            cell, clock = ("\\$_DFF_P_", "C") if node_type == "D Flip-Flop" else ("\\$_DLATCH_P_", "E")
+            stream.write(f"  {cell} g{node} (.{clock}({fanin[1]}), .D({fanin[0]}), .Q({net}));\n")
+        else:
+            stream.write(f"  {base.lower()} g{node} ({net}, {', '.join(fanin)});\n")
+    for k, source in enumerate(names.output_drivers):
+        stream.write(f"  assign out{k} = {source};\n")
+    stream.write("endmodule\n")
+
+
+def _module_name(file_name):
+    name = re.sub(r"\W", "_", os.path.splitext(os.path.basename(file_name))[0]) or "circuit"
+    return name if not name[0].isdigit() else "_" + name
+
+
+def load_netlist(file_name):
+    """Import a .blif file, or structural Verilog from any other"""
+    with open(file_name, encoding="utf-8", errors="replace") as file:
+        if file_name.lower().endswith(BLIF_EXTENSION):
+            return read_blif(file)
+        return read_verilog(file)
+
+
+def save_netlist(circuit, file_name):
+    """Export to BLIF or, unless the name ends in .blif, structural Verilog"""
+    with open(file_name, "w", encoding="utf-8") as file:
+        if file_name.lower().endswith(BLIF_EXTENSION):
+            write_blif(circuit, file, _module_name(file_name))
+        else:
+            write_verilog(circuit, file, _module_name(file_name))
@@ -1,44 +1,126 @@
-from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, QMenu, QTabWidget, QFileDialog, QWidget, QVBoxLayout, QListWidget, QSplitter, QGraphicsScene, QGraphicsView, QGraphicsItem, QLineEdit, QGraphicsProxyWidget, QPushButton
-from PyQt5.QtCore import Qt, QRectF, QMimeData, QPointF, QLineF
-from PyQt5.QtGui import QBrush, QPen, QPainter, QDrag, QColor
+from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, QMenu, QTabWidget, QFileDialog, QWidget, QVBoxLayout, QListWidget, QSplitter, QGraphicsScene, QGraphicsView, QGraphicsItem, QLineEdit, QGraphicsProxyWidget, QStyleOptionGraphicsItem, QInputDialog, QMessageBox, QDockWidget, QLabel
+from PyQt5.QtCore import Qt, QRectF, QMimeData, QPointF, QLineF, QTimer, pyqtSignal
+from PyQt5.QtGui import QBrush, QPen, QPainter, QDrag, QColor, QPixmap, QTransform, QFont
+import io
+import math
+import os
 import sys
+import time
+from array import array
+from contextlib import contextmanager
+
+from netlist import (Netlist, SINK_TYPES, STATE_TYPES, WIDE_GATE_TYPES, BUS_TYPES, MAX_GATE_INPUTS,
+                     MAX_BUS_WIDTH, input_socket_count, output_socket_count, port_type, sized_type, is_gate,
+                     parse_bit, format_value)
+from modules import ModuleLibrary, renamed, stateful_types
+from logic_opt import optimize
+from sim_worker import JobRunner, equivalence_job, evaluate_job, import_job, profiled_evaluate_job, truth_table_job
+from profiler import Profiler
+from output_sink import FILE_FILTER as SINK_FILE_FILTER, FORMAT_EXTENSIONS, format_for, open_sink
+from sequential import (EventSimulator, OscillationError, DEFAULT_PERIOD, node_delay,
+                        parse_ticks, read_timing)
+from spatial_index import SpatialHash
+from circuit_model import CircuitModel
+from netlist_io import BLIF_EXTENSION, NETLIST_FILTER, VERILOG_EXTENSION, save_netlist
+from edit_journal import AUTOSAVE_DIR, EditJournal, untitled_journals
+from circuit_io import (CircuitData, CircuitFormatError, load_circuit, save_circuit, read_json, write_json,
+                        FILE_FILTER, BINARY_EXTENSION, JSON_EXTENSION)
 
 class NodeEditor(QMainWindow):
-    def __init__(self):
+    batch_finished = pyqtSignal(object, object, object)  # File name, result, error
+    equivalence_finished = pyqtSignal(object, object, object)  # Tab names, result, error
+    import_finished = pyqtSignal(object, object, object)  # File name, CircuitData, error
+    PROFILE_INTERVAL = 500  # Milliseconds between updates of the profiling readout
+    CLIPBOARD_MIME = "application/x-logic-circuit"  # JSON Lines, see circuit_io.write_json
+    PASTE_OFFSET = 20  # Each paste of the same clipboard lands this much further down and right
+
+    def __init__(self, autosave_dir=None):
         super().__init__()
         self.setWindowTitle("Node Editor")
         self.setGeometry(100, 100, 1000, 600)
         
         # For undo/redo functionality
-        self.command_history = []
-        self.redo_history = []
-        self.clipboard = None
+        self.undo_stack = UndoStack()
+        self.modules = ModuleLibrary()  # Subcircuits shared by every tab
+        self._paste_source = None  # Clipboard text of the last paste, see paste()
+        self._paste_count = 0
         self.current_theme = "Light"  # Default theme
+        self.autosave_dir = autosave_dir  # Where edits are journaled (see edit_journal.py); None for nowhere
+        self.batch_jobs = JobRunner("batch")  # Truth tables, off the GUI thread
+        self.batch_finished.connect(self.truth_table_finished, Qt.QueuedConnection)
+        self.equivalence_jobs = JobRunner("equivalence")
+        self.equivalence_finished.connect(self.equivalence_check_finished, Qt.QueuedConnection)
+        self.import_jobs = JobRunner("import")  # Netlists of many gates take seconds to read
+        self.import_finished.connect(self.netlist_imported, Qt.QueuedConnection)
+        self.profiling = False  # Every tab collects a Profiler while this is on
+        self.profile_overlay = False
         
         # Add status bar
         self.status_bar = self.statusBar()
+        self.profile_label = QLabel()  # Profiling readout of the current tab
+        self.status_bar.addPermanentWidget(self.profile_label)
+        self.profile_label.hide()
+        self.profile_timer = QTimer(self)
+        self.profile_timer.setInterval(self.PROFILE_INTERVAL)
+        self.profile_timer.timeout.connect(self.update_profile)
         
         self.initUI()
     
+    def closeEvent(self, event):
+        # Do not wait for the background jobs of a window that is going away
+        self.batch_jobs.shutdown()
+        self.equivalence_jobs.shutdown()
+        self.import_jobs.shutdown()
+        for i in range(self.tab_widget.count()):
+            self.tab_widget.widget(i).scene.shutdown()
+        super().closeEvent(event)
+
     def execute_command(self, command):
         command.execute()
-        self.command_history.append(command)
-        self.redo_history.clear()  # Clear redo history after a new command
+        self.undo_stack.push(command)  # Also clears the redo history
+        self.flush_journals()
 
     def undo(self):
-        if self.command_history:
-            command = self.command_history.pop()
-            command.undo()
-            self.redo_history.append(command)
+        command = self.undo_stack.undo()
+        if command:
+            self.flush_journals()
             self.status_bar.showMessage(f"Undo: {command}", 2000)
 
     def redo(self):
-        if self.redo_history:
-            command = self.redo_history.pop()
-            command.execute()
-            self.command_history.append(command)
+        command = self.undo_stack.redo()
+        if command:
+            self.flush_journals()
             self.status_bar.showMessage(f"Redo: {command}", 2000)
 
+    def flush_journals(self):
+        """Journal the step just taken; undo and redo may reach any tab"""
+        for i in range(self.tab_widget.count()):
+            self.tab_widget.widget(i).scene.flush_journal()
+
+    def recover_autosaved(self):
+        """Reopen the designs that were never saved, as an earlier session left them"""
+        if self.autosave_dir is None:
+            return
+        recovered = 0
+        in_use = {self.tab_widget.widget(i).scene.journal.name for i in range(self.tab_widget.count())
+                  if self.tab_widget.widget(i).scene.journal is not None}
+        for name in untitled_journals(self.autosave_dir):
+            if name in in_use:
+                continue
+            journal = EditJournal(self.autosave_dir, name)
+            result = journal.recover()
+            if result is None:
+                journal.discard()
+                continue
+            circuit, ids, next_id = result
+            tab = self.new_tab(journal=False)
+            tab.scene.open_circuit(circuit, ids)
+            tab.scene.start_journal(journal, next_id, circuit.modules)
+            self.tab_widget.setTabText(self.tab_widget.indexOf(tab), "Recovered")
+            recovered += 1
+        if recovered:
+            self.status_bar.showMessage(f"Recovered {recovered} unsaved design{'s' if recovered != 1 else ''}", 5000)
+
     def initUI(self):
         # Create Menu Bar
         menubar = self.menuBar()
@@ -48,12 +130,16 @@ class NodeEditor(QMainWindow):
         new_action = QAction("New", self)
         open_action = QAction("Open", self)
         save_action = QAction("Save", self)
+        import_action = QAction("Import Netlist...", self)
+        export_action = QAction("Export Netlist...", self)
         exit_action = QAction("Exit", self)
-        file_menu.addActions([new_action, open_action, save_action, exit_action])
+        file_menu.addActions([new_action, open_action, save_action, import_action, export_action, exit_action])
         
-        new_action.triggered.connect(self.new_tab)
+        new_action.triggered.connect(lambda: self.new_tab())
         open_action.triggered.connect(self.open_file)
         save_action.triggered.connect(self.save_file)
+        import_action.triggered.connect(self.import_netlist)
+        export_action.triggered.connect(self.export_netlist)
         exit_action.triggered.connect(self.close)
         
         # Edit Menu
@@ -68,12 +154,18 @@ class NodeEditor(QMainWindow):
         copy_action.setShortcut("Ctrl+C")
         paste_action = QAction("Paste", self)
         paste_action.setShortcut("Ctrl+V")
+        duplicate_action = QAction("Duplicate", self)
+        duplicate_action.setShortcut("Ctrl+D")
         delete_action = QAction("Delete", self)
         delete_action.setShortcut("Delete")
         
+        subcircuit_action = QAction("Create Subcircuit...", self)
+        
         edit_menu.addActions([undo_action, redo_action])
         edit_menu.addSeparator()
-        edit_menu.addActions([cut_action, copy_action, paste_action, delete_action])
+        edit_menu.addActions([cut_action, copy_action, paste_action, duplicate_action, delete_action])
+        edit_menu.addSeparator()
+        edit_menu.addAction(subcircuit_action)
         
         # Connect edit actions
         undo_action.triggered.connect(self.undo)
@@ -81,7 +173,9 @@ class NodeEditor(QMainWindow):
         cut_action.triggered.connect(self.cut)
         copy_action.triggered.connect(self.copy)
         paste_action.triggered.connect(self.paste)
+        duplicate_action.triggered.connect(self.duplicate)
         delete_action.triggered.connect(self.delete_selected)
+        subcircuit_action.triggered.connect(self.create_subcircuit)
         
         # Window Menu
         window_menu = menubar.addMenu("Window")
@@ -98,6 +192,45 @@ class NodeEditor(QMainWindow):
         blue_theme_action.triggered.connect(lambda: self.change_theme("Blue"))
         green_theme_action.triggered.connect(lambda: self.change_theme("Green"))
         
+        # Simulate Menu
+        simulate_menu = menubar.addMenu("Simulate")
+        truth_table_action = QAction("Generate Truth Table...", self)
+        optimize_action = QAction("Optimization Report", self)
+        equivalence_action = QAction("Check Equivalence...", self)
+        simulate_menu.addActions([truth_table_action, optimize_action, equivalence_action])
+        truth_table_action.triggered.connect(self.generate_truth_table)
+        optimize_action.triggered.connect(self.show_optimization_report)
+        equivalence_action.triggered.connect(self.check_equivalence)
+
+        simulate_menu.addSeparator()
+        self.run_action = QAction("Run Clock", self)
+        self.run_action.setCheckable(True)
+        self.run_action.setShortcut("Ctrl+R")
+        step_action = QAction("Step Clock", self)
+        step_action.setShortcut("Ctrl+T")
+        reset_action = QAction("Reset Simulation", self)
+        speed_action = QAction("Simulation Speed...", self)
+        simulate_menu.addActions([self.run_action, step_action, reset_action, speed_action])
+        self.run_action.toggled.connect(self.run_clock)
+        step_action.triggered.connect(self.step_clock)
+        reset_action.triggered.connect(self.reset_simulation)
+        speed_action.triggered.connect(self.set_simulation_speed)
+
+        simulate_menu.addSeparator()
+        self.profile_action = QAction("Profiling", self)
+        self.profile_action.setCheckable(True)
+        self.profile_action.setShortcut("Ctrl+Shift+P")
+        self.overlay_action = QAction("Profile Overlay", self)
+        self.overlay_action.setCheckable(True)
+        reset_profile_action = QAction("Reset Profile", self)
+        export_profile_action = QAction("Export Profile Trace...", self)
+        simulate_menu.addActions([self.profile_action, self.overlay_action,
+                                  reset_profile_action, export_profile_action])
+        self.profile_action.toggled.connect(self.set_profiling)
+        self.overlay_action.toggled.connect(self.set_profile_overlay)
+        reset_profile_action.triggered.connect(self.reset_profile)
+        export_profile_action.triggered.connect(self.export_profile_trace)
+
         # Main Layout
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -117,11 +250,20 @@ class NodeEditor(QMainWindow):
         
         layout.addWidget(splitter)
         self.central_widget.setLayout(layout)
+
+        # Waveforms of the current tab's simulation, shown once a clock runs
+        self.waveform_view = WaveformView()
+        self.waveform_dock = QDockWidget("Waveforms", self)
+        self.waveform_dock.setWidget(self.waveform_view)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.waveform_dock)
+        self.waveform_dock.hide()
+        self.tab_widget.currentChanged.connect(self.tab_changed)
         
         # Create a default tab
         self.new_tab()
     
-    def new_tab(self):
+    def new_tab(self, journal=True):
+        """Add a tab with an empty scene; journal starts autosaving it as a new design"""
         tab = QWidget()
         layout = QVBoxLayout()
         scene = NodeGraphicsScene(self)
@@ -130,436 +272,2124 @@ class NodeEditor(QMainWindow):
         view.setSceneRect(-5000, -5000, 10000, 10000)
         tab.scene = scene  # Store scene reference in tab
         tab.view = view  # Store view reference in tab
+        scene.set_profiling(self.profiling, self.profile_overlay)
+        scene.apply_theme()
         layout.addWidget(view)
         tab.setLayout(layout)
         self.tab_widget.addTab(tab, "New Tab")
+        self.tab_widget.setCurrentWidget(tab)
+        if journal and self.autosave_dir is not None:
+            scene.start_journal(EditJournal.untitled(self.autosave_dir))
+        return tab
     
     def open_file(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Open File")
+        file_name, _ = QFileDialog.getOpenFileName(self, "Open File", "", FILE_FILTER)
         if file_name:
-            print(f"Opened file: {file_name}")
-            self.status_bar.showMessage(f"Opened file: {file_name}", 2000)
+            try:
+                circuit = load_circuit(file_name)
+            except (OSError, CircuitFormatError) as error:
+                self.status_bar.showMessage(f"Could not open {file_name}: {error}", 5000)
+                return
+            journal = ids = None
+            next_id = len(circuit)
+            if self.autosave_dir is not None:
+                # Edits an earlier session made after the last save are replayed over it
+                journal = EditJournal.for_file(file_name, self.autosave_dir)
+                recovered = journal.recover()
+                if recovered is not None:
+                    circuit, ids, next_id = recovered
+                else:
+                    journal.discard()
+            tab = self.new_tab(journal=False)
+            tab.scene.open_circuit(circuit, ids)
+            if journal is not None:
+                tab.scene.start_journal(journal, next_id, circuit.modules)
+            self.tab_widget.setTabText(self.tab_widget.indexOf(tab), os.path.basename(file_name))
+            if ids is not None:
+                self.status_bar.showMessage(f"Opened file: {file_name} with the unsaved edits of the last session", 5000)
+            elif tab.scene.model is not None:
+                self.status_bar.showMessage(f"Opened file: {file_name} ({len(circuit)} nodes; gates get items as you scroll to them)", 5000)
+            else:
+                self.status_bar.showMessage(f"Opened file: {file_name}", 2000)
     
     def save_file(self):
-        file_name, _ = QFileDialog.getSaveFileName(self, "Save File")
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save File", "", FILE_FILTER)
         if file_name:
-            print(f"Saved file: {file_name}")
+            if not file_name.endswith((BINARY_EXTENSION, JSON_EXTENSION)):
+                file_name += BINARY_EXTENSION
+            scene = current_tab.scene
+            circuit, ids = scene.to_circuit(with_ids=True)
+            try:
+                save_circuit(circuit, file_name)
+            except OSError as error:
+                self.status_bar.showMessage(f"Could not save {file_name}: {error}", 5000)
+                return
+            if scene.journal is not None:
+                # The file now holds everything journaled so far
+                scene.journal.discard()
+                scene.start_journal(EditJournal.for_file(file_name, self.autosave_dir, ids),
+                                    scene.next_node_id, circuit.modules)
+            self.tab_widget.setTabText(self.tab_widget.currentIndex(), os.path.basename(file_name))
             self.status_bar.showMessage(f"Saved file: {file_name}", 2000)
     
+    def import_netlist(self):
+        """Open a BLIF or structural Verilog netlist in a new tab"""
+        file_name, _ = QFileDialog.getOpenFileName(self, "Import Netlist", "", NETLIST_FILTER)
+        if file_name:
+            self.import_jobs.submit(import_job, (file_name,),
+                                    lambda job, result, error: self.import_finished.emit(file_name, result, error))
+            self.status_bar.showMessage(f"Importing {file_name}...")
+
+    def netlist_imported(self, file_name, circuit, error):
+        if error is not None:
+            self.status_bar.showMessage(f"Could not import {file_name}: {error}", 5000)
+            return
+        tab = self.new_tab(journal=False)
+        tab.scene.open_circuit(circuit)
+        if self.autosave_dir is not None:
+            # There is no design file to replay edits over, so the journal starts from a copy
+            journal = EditJournal.untitled(self.autosave_dir)
+            try:
+                journal.seed(circuit)
+            except OSError as error:
+                self.status_bar.showMessage(f"Autosave is off: {error}", 5000)
+            else:
+                tab.scene.start_journal(journal, len(circuit))
+        self.tab_widget.setTabText(self.tab_widget.indexOf(tab), os.path.basename(file_name))
+        self.status_bar.showMessage(f"Imported {file_name} ({len(circuit)} nodes)", 5000)
+
+    def export_netlist(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        file_name, selected = QFileDialog.getSaveFileName(self, "Export Netlist", "", NETLIST_FILTER)
+        if file_name:
+            if not file_name.endswith((BLIF_EXTENSION, VERILOG_EXTENSION)):
+                file_name += VERILOG_EXTENSION if "Verilog" in selected else BLIF_EXTENSION
+            try:
+                save_netlist(current_tab.scene.to_circuit(), file_name)
+            except (OSError, ValueError) as error:
+                self.status_bar.showMessage(f"Could not export {file_name}: {error}", 5000)
+                return
+            self.status_bar.showMessage(f"Exported {file_name}", 2000)
+
+    def generate_truth_table(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        netlist = current_tab.scene.netlist()
+        if not netlist.inputs or not netlist.outputs:
+            self.status_bar.showMessage("Truth table needs at least one Input and one Output", 2000)
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Truth Table", "", "CSV Files (*.csv)")
+        if file_name:
+            # Optimizing and simulating run on a snapshot on the worker thread
+            self.batch_jobs.submit(truth_table_job, (netlist.snapshot(), file_name),
+                                   lambda job, result, error: self.batch_finished.emit(file_name, result, error))
+            self.status_bar.showMessage(f"Generating truth table {file_name}...")
+
+    def truth_table_finished(self, file_name, result, error):
+        if error is not None:
+            self.status_bar.showMessage(f"Could not write {file_name}: {error}", 5000)
+            return
+        rows, report = result
+        self.status_bar.showMessage(f"Wrote {rows} rows to {file_name} ({report})", 5000)
+
+    def show_optimization_report(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        _, report = optimize(current_tab.scene.netlist())
+        QMessageBox.information(self, "Optimization Report", report.summary())
+
+    def check_equivalence(self):
+        """Compare the current tab's circuit with another tab's, Input by Input and Output by Output"""
+        current = self.tab_widget.currentIndex()
+        if current < 0:
+            return
+        others = [i for i in range(self.tab_widget.count()) if i != current]
+        if not others:
+            self.status_bar.showMessage("Open the circuit to compare with in another tab first", 2000)
+            return
+        labels = [f"{i + 1}: {self.tab_widget.tabText(i)}" for i in others]
+        label, ok = QInputDialog.getItem(self, "Check Equivalence", "Compare with:", labels, 0, False)
+        if not ok:
+            return
+        other = others[labels.index(label)]
+        names = (self.tab_widget.tabText(current), self.tab_widget.tabText(other))
+        first = self.tab_widget.widget(current).scene.netlist()
+        second = self.tab_widget.widget(other).scene.netlist()
+        # Building the BDDs can take a while, so it runs on snapshots on the worker thread
+        self.equivalence_jobs.submit(equivalence_job, (first.snapshot(), second.snapshot()),
+                                     lambda job, result, error: self.equivalence_finished.emit(names, result, error))
+        self.status_bar.showMessage(f"Comparing {names[0]} with {names[1]}...")
+
+    def equivalence_check_finished(self, names, result, error):
+        if error is not None:
+            self.status_bar.showMessage(f"Could not compare {names[0]} with {names[1]}: {error}", 5000)
+            return
+        if result is None:
+            self.status_bar.showMessage(f"{names[0]} and {names[1]} are equivalent", 5000)
+            QMessageBox.information(self, "Check Equivalence", f"{names[0]} and {names[1]} compute the same Outputs.")
+            return
+        self.status_bar.clearMessage()
+        QMessageBox.information(self, "Check Equivalence",
+                                f"{names[0]} and {names[1]} differ.\n\n{result}\n\n"
+                                "Inputs and Outputs are counted top to bottom, then left to right.")
+
+    def run_clock(self, running):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        scene = current_tab.scene
+        if not running:
+            scene.stop_simulation()
+            self.status_bar.showMessage("Clock stopped", 2000)
+            return
+        scene.start_simulation()
+        self.waveform_dock.show()
+        loops = len(scene.simulator().loops)
+        if loops:
+            self.status_bar.showMessage(f"Clock running; the circuit has {loops} feedback loop(s)", 5000)
+        else:
+            self.status_bar.showMessage("Clock running", 2000)
+
+    def step_clock(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        self.waveform_dock.show()
+        current_tab.scene.step_simulation()
+        self.status_bar.showMessage(f"Tick {current_tab.scene.simulator().time}", 2000)
+
+    def reset_simulation(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        self.set_run_checked(False)
+        current_tab.scene.reset_simulation()
+        self.status_bar.showMessage("Simulation reset", 2000)
+
+    def set_simulation_speed(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return
+        scene = current_tab.scene
+        speed, ok = QInputDialog.getInt(self, "Simulation Speed", "Ticks per second:",
+                                        scene.ticks_per_second, 1, 1000000)
+        if ok:
+            scene.ticks_per_second = speed
+
+    def set_run_checked(self, running):
+        """Update the Run Clock check mark without starting or stopping anything"""
+        self.run_action.blockSignals(True)
+        self.run_action.setChecked(running)
+        self.run_action.blockSignals(False)
+
+    def simulation_stopped(self, scene, message):
+        current_tab = self.tab_widget.currentWidget()
+        if current_tab and current_tab.scene is scene:
+            self.set_run_checked(False)
+        self.status_bar.showMessage(message, 5000)
+
+    def show_waveforms(self, scene):
+        """Redraw the waveforms if they belong to the current tab"""
+        current_tab = self.tab_widget.currentWidget()
+        if current_tab and current_tab.scene is scene and self.waveform_dock.isVisible():
+            self.waveform_view.show_simulation(scene.simulator(create=False), scene.trace_labels)
+
+    def tab_changed(self, index):
+        tab = self.tab_widget.widget(index)
+        if tab is None:
+            self.set_run_checked(False)
+            self.waveform_view.show_simulation(None, {})
+            return
+        self.set_run_checked(tab.scene.simulation_running())
+        self.waveform_view.show_simulation(tab.scene.simulator(create=False), tab.scene.trace_labels)
+        self.update_profile()
+
+    def set_profiling(self, enabled):
+        """Switch profiling of every tab on or off; off, nothing is recorded"""
+        self.profiling = enabled
+        if not enabled and self.profile_overlay:
+            self.overlay_action.setChecked(False)  # Calls set_profile_overlay
+        for i in range(self.tab_widget.count()):
+            self.tab_widget.widget(i).scene.set_profiling(enabled, self.profile_overlay)
+        self.profile_label.setVisible(enabled)
+        if enabled:
+            self.profile_timer.start()
+            self.update_profile()
+        else:
+            self.profile_timer.stop()
+        self.status_bar.showMessage(f"Profiling {'on' if enabled else 'off'}", 2000)
+
+    def set_profile_overlay(self, shown):
+        self.profile_overlay = shown
+        if shown and not self.profiling:
+            self.profile_action.setChecked(True)  # Calls set_profiling
+        for i in range(self.tab_widget.count()):
+            self.tab_widget.widget(i).scene.set_profiling(self.profiling, shown)
+
+    def update_profile(self):
+        """Refresh the status bar readout and the overlay of the current tab"""
+        current_tab = self.tab_widget.currentWidget()
+        if not self.profiling or not current_tab or current_tab.scene.profiler is None:
+            return
+        scene = current_tab.scene
+        scene.count_profile_items()
+        self.profile_label.setText(scene.profiler.summary())
+        if self.profile_overlay:
+            current_tab.view.viewport().update()
+
+    def reset_profile(self):
+        current_tab = self.tab_widget.currentWidget()
+        if current_tab and current_tab.scene.profiler is not None:
+            current_tab.scene.profiler.reset()
+            self.update_profile()
+
+    def export_profile_trace(self):
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab or current_tab.scene.profiler is None:
+            self.status_bar.showMessage("Turn on Simulate > Profiling first", 2000)
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export Profile Trace", "", "Trace Files (*.json)")
+        if not file_name:
+            return
+        try:
+            with open(file_name, "w") as file:
+                current_tab.scene.profiler.write_trace(file, current_tab.scene.node_label)
+        except OSError as error:
+            self.status_bar.showMessage(f"Could not save {file_name}: {error}", 5000)
+            return
+        self.status_bar.showMessage(f"Saved profile trace to {file_name}", 2000)
+
     # Edit menu functions
-    def undo(self):
-        if self.command_history:
-            command = self.command_history.pop()
-            self.redo_history.append(command)
-            print(f"Undo: {command}")
-            # Here you would implement the actual undo functionality
-            self.status_bar.showMessage("Undo operation", 2000)
-    
-    def redo(self):
-        if self.redo_history:
-            command = self.redo_history.pop()
-            self.command_history.append(command)
-            print(f"Redo: {command}")
-            # Here you would implement the actual redo functionality
-            self.status_bar.showMessage("Redo operation", 2000)
-    
     def cut(self):
-        selected_items = self.get_selected_items()
-        if selected_items:
-            self.clipboard = selected_items
+        if self.copy():
             self.delete_selected()
             self.status_bar.showMessage("Cut items to clipboard", 2000)
     
     def copy(self):
-        selected_items = self.get_selected_items()
-        if selected_items:
-            self.clipboard = selected_items
-            self.status_bar.showMessage("Copied items to clipboard", 2000)
+        """Put the selected nodes, their wires and values on the system clipboard"""
+        circuit = self.selected_circuit()
+        if circuit is None:
+            return False
+        text = io.StringIO()
+        write_json(circuit, text)
+        mime = QMimeData()
+        mime.setData(self.CLIPBOARD_MIME, text.getvalue().encode("utf-8"))
+        mime.setText(text.getvalue())  # Also readable by other instances as plain text
+        QApplication.clipboard().setMimeData(mime)
+        self.status_bar.showMessage(f"Copied {len(circuit)} nodes to clipboard", 2000)
+        return True
     
     def paste(self):
-        if self.clipboard:
-            current_tab = self.tab_widget.currentWidget()
-            if current_tab:
-                scene = current_tab.scene
-                for item_data in self.clipboard:
-                    # Create a new node based on clipboard data
-                    new_node = NodeItem(
-                        item_data['x'] + 20,  # Offset to make it visible
-                        item_data['y'] + 20,  # Offset to make it visible
-                        item_data['text']
-                    )
-                    scene.addItem(new_node)
-                self.status_bar.showMessage("Pasted items from clipboard", 2000)
+        mime = QApplication.clipboard().mimeData()
+        if mime is None:
+            return
+        if mime.hasFormat(self.CLIPBOARD_MIME):
+            text = bytes(mime.data(self.CLIPBOARD_MIME)).decode("utf-8")
+        elif mime.hasText() and mime.text().startswith("{"):
+            text = mime.text()
+        else:
+            return
+        try:
+            circuit = read_json(io.StringIO(text))
+        except (CircuitFormatError, ValueError):
+            self.status_bar.showMessage("The clipboard does not hold a circuit", 2000)
+            return
+        # Pasting the same thing again moves it a step further, so copies do not pile up
+        self._paste_count = self._paste_count + 1 if text == self._paste_source else 1
+        self._paste_source = text
+        self.paste_circuit(circuit, self.PASTE_OFFSET * self._paste_count)
+
+    def duplicate(self):
+        """Copy the selection in place, leaving the clipboard alone"""
+        circuit = self.selected_circuit()
+        if circuit is not None:
+            self.paste_circuit(circuit, self.PASTE_OFFSET)
+
+    def paste_circuit(self, circuit, offset):
+        """Add a copied subgraph to the current tab as one undo step and select it"""
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab or not len(circuit):
+            return
+        scene = current_tab.scene
+        added, renames = scene.module_library().merge(circuit.modules)
+        for name in added:
+            self.node_list.add_module(name)
+        circuit = renamed(circuit, renames)  # Clashing subcircuits were defined under new names
+        circuit.modules = {}  # Defined above; load_circuit would replace them
+        circuit.xs = [x + offset for x in circuit.xs]
+        circuit.ys = [y + offset for y in circuit.ys]
+        command = PasteCommand(scene, circuit)
+        self.execute_command(command)
+        scene.clearSelection()
+        for node in command.nodes:
+            node.setSelected(True)
+        self.status_bar.showMessage(f"Pasted {len(circuit)} nodes from clipboard", 2000)
     
     def delete_selected(self):
         current_tab = self.tab_widget.currentWidget()
         if current_tab:
             scene = current_tab.scene
             selected_items = [item for item in scene.selectedItems() if isinstance(item, NodeItem)]
-            for item in selected_items:
-                # Remove all connections
-                for socket in item.input_sockets:
-                    if socket.connection:
-                        if isinstance(socket.connection, ConnectionLine):
-                            scene.removeItem(socket.connection)
-                        socket.connection = None
-                
-                # Remove output connections
-                if item.output_socket and item.output_socket.connection:
-                    if isinstance(item.output_socket.connection, ConnectionLine):
-                        scene.removeItem(item.output_socket.connection)
-                    item.output_socket.connection = None
-                
-                # Remove the node
-                scene.removeItem(item)
+            if not selected_items:
+                return
+            # The commands remove each node together with its connections,
+            # grouped so that one undo restores the whole selection
+            commands = [DeleteNodeCommand(scene, item) for item in selected_items]
+            if len(commands) == 1:
+                self.execute_command(commands[0])
+            else:
+                self.execute_command(CompoundCommand(f"Delete {len(commands)} nodes", commands))
             
             self.status_bar.showMessage(f"Deleted {len(selected_items)} items", 2000)
     
-    def get_selected_items(self):
+    def create_subcircuit(self):
+        """Collapse the selected gates into a new reusable subcircuit node"""
         current_tab = self.tab_widget.currentWidget()
-        if current_tab:
-            scene = current_tab.scene
-            selected_items = []
-            for item in scene.selectedItems():
-                if isinstance(item, NodeItem):
-                    # Store relevant data for copying
-                    item_data = {
-                        'x': item.x(),
-                        'y': item.y(),
-                        'text': item.text,
-                    }
-                    selected_items.append(item_data)
-            return selected_items
-        return []
+        if not current_tab:
+            return
+        scene = current_tab.scene
+        gates = [item for item in scene.selectedItems()
+                 if isinstance(item, NodeItem) and item.text not in ["Input", "Output", "Write Output"]]
+        if not gates:
+            self.status_bar.showMessage("Select the gates to turn into a subcircuit", 2000)
+            return
+        stateful = stateful_types(node.text for node in gates)
+        if stateful:
+            # Instances are evaluated as functions of their inputs, which state would break
+            self.status_bar.showMessage(f"Subcircuits cannot hold {', '.join(stateful)} nodes", 5000)
+            return
+        name, ok = QInputDialog.getText(self, "Create Subcircuit", "Name:", text=self.modules.unique_name("Module"))
+        name = name.strip()
+        if not ok or not name:
+            return
+        if (name in self.modules or name in NodeList.BUILTIN_NODES or name.startswith("Port ")
+                or sized_type(name)[1] is not None):
+            self.status_bar.showMessage(f"A node type called {name} already exists", 2000)
+            return
+        command = scene.collapse_to_subcircuit(gates, name)
+        if command is None:
+            self.status_bar.showMessage("The selection does not drive anything outside it", 2000)
+            return
+        self.node_list.add_module(name)
+        self.execute_command(command)
+        self.status_bar.showMessage(f"Created subcircuit {name}", 2000)
+
+    def selected_circuit(self):
+        """The selected nodes of the current tab and the wires between them, or None"""
+        current_tab = self.tab_widget.currentWidget()
+        if not current_tab:
+            return None
+        nodes = [item for item in current_tab.scene.selectedItems() if isinstance(item, NodeItem)]
+        return current_tab.scene.to_circuit(nodes) if nodes else None
     
     # Window menu functions
     def change_theme(self, theme):
         self.current_theme = theme
-        
-        # Apply theme to all tabs and scenes
+        # Nodes and wires paint from the shared resources, so swapping them
+        # and repainting each scene once covers every tab
+        RenderResources.shared().set_theme(theme)
         for i in range(self.tab_widget.count()):
-            tab = self.tab_widget.widget(i)
-            view = tab.view
-            scene = tab.scene
-            
-            # Set scene background color based on theme
-            if theme == "Light":
-                scene.setBackgroundBrush(QBrush(Qt.white))
-            elif theme == "Dark":
-                scene.setBackgroundBrush(QBrush(Qt.black))
-            elif theme == "Blue":
-                scene.setBackgroundBrush(QBrush(QColor(200, 210, 255)))
-            elif theme == "Green":
-                scene.setBackgroundBrush(QBrush(QColor(200, 255, 210)))
+            self.tab_widget.widget(i).scene.apply_theme()
         
         # Apply theme to UI elements
         self.status_bar.showMessage(f"Theme changed to {theme}", 2000)
 
-class ConnectionLine(QGraphicsItem):
-    def __init__(self, start_socket, end_socket=None):
-        super().__init__()
+class ConnectionIndex:
+    """Adjacency index of the connections in one scene.
+
+    An input socket has at most one driver, found in O(1); an output socket
+    can fan out to any number of input sockets, listed in O(fanout).
+    """
+
+    def __init__(self):
+        self.drivers = {}  # input Socket -> ConnectionLine
+        self.sinks = {}  # output Socket -> {ConnectionLine: None}, insertion ordered
+
+    def __len__(self):
+        return len(self.drivers)
+
+    def add(self, line):
+        """Record a finished connection from line.start_socket to line.end_socket"""
+        self.drivers[line.end_socket] = line
+        self.sinks.setdefault(line.start_socket, {})[line] = None
+
+    def remove(self, line):
+        """Forget a connection; unknown lines are ignored"""
+        if self.drivers.get(line.end_socket) is line:
+            del self.drivers[line.end_socket]
+        sinks = self.sinks.get(line.start_socket)
+        if sinks is not None:
+            sinks.pop(line, None)
+            if not sinks:
+                del self.sinks[line.start_socket]
+
+    def driver(self, socket):
+        """Return the ConnectionLine driving an input socket, or None"""
+        return self.drivers.get(socket)
+
+    def fanout(self, socket):
+        """Return the ConnectionLines leaving an output socket"""
+        return list(self.sinks.get(socket, ()))
+
+    def node_connections(self, node):
+        """Return every ConnectionLine attached to a NodeItem"""
+        lines = [self.drivers[s] for s in node.input_sockets if s in self.drivers]
+        for socket in node.output_sockets:
+            lines.extend(self.fanout(socket))
+        return lines
+
+# Theme name -> colors of the scene background and of everything drawn on it
+THEMES = {
+    "Light": {"background": QColor(Qt.white), "grid": QColor(200, 200, 200), "node": QColor(Qt.white),
+              "outline": QColor(Qt.black), "field": QColor(Qt.white), "read_only": QColor(240, 240, 240),
+              "button": QColor(230, 230, 230), "wire": QColor(Qt.black),
+              "input": QColor(Qt.blue), "output": QColor(Qt.red)},
+    "Dark": {"background": QColor(Qt.black), "grid": QColor(60, 60, 60), "node": QColor(50, 52, 56),
+             "outline": QColor(220, 220, 220), "field": QColor(35, 36, 40), "read_only": QColor(65, 67, 72),
+             "button": QColor(80, 82, 88), "wire": QColor(200, 200, 200),
+             "input": QColor(90, 140, 255), "output": QColor(255, 90, 90)},
+    "Blue": {"background": QColor(200, 210, 255), "grid": QColor(200, 200, 200), "node": QColor(240, 244, 255),
+             "outline": QColor(20, 30, 80), "field": QColor(Qt.white), "read_only": QColor(225, 230, 250),
+             "button": QColor(210, 218, 245), "wire": QColor(20, 30, 80),
+             "input": QColor(Qt.blue), "output": QColor(Qt.red)},
+    "Green": {"background": QColor(200, 255, 210), "grid": QColor(200, 200, 200), "node": QColor(240, 255, 244),
+              "outline": QColor(10, 60, 20), "field": QColor(Qt.white), "read_only": QColor(225, 245, 230),
+              "button": QColor(210, 240, 218), "wire": QColor(10, 60, 20),
+              "input": QColor(Qt.blue), "output": QColor(Qt.red)},
+}
+
+class RenderResources:
+    """Pens, brushes and fonts of the current theme, shared by every item.
+
+    Items paint with these instead of building a QPen or QBrush on every
+    paint call.  set_theme() replaces them all at once; the scenes then only
+    need one repaint (see NodeGraphicsScene.apply_theme).
+    """
+    _shared = None
+
+    def __init__(self, theme="Light"):
+        self.set_theme(theme)
+
+    @classmethod
+    def shared(cls):
+        # Created on first use: a QFont needs the QApplication to exist
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def set_theme(self, theme):
+        colors = THEMES[theme]
+        self.theme = theme
+        self.background_brush = QBrush(colors["background"])
+        self.grid_color = colors["grid"]
+        self.node_brush = QBrush(colors["node"])
+        self.node_pen = QPen(colors["outline"])
+        self.field_brush = QBrush(colors["field"])
+        self.read_only_brush = QBrush(colors["read_only"])
+        self.button_brush = QBrush(colors["button"])
+        self.wire_pen = QPen(colors["wire"], 2)
+        self.bus_pen = QPen(colors["wire"], 5)
+        self.input_socket_brush = QBrush(colors["input"])
+        self.output_socket_brush = QBrush(colors["output"])
+        self.label_font = QFont()
+
+class ConnectionLine:
+    """A wire from an output socket to an input socket; its scene's WireLayer draws it"""
+
+    def __init__(self, start_socket, end_socket):
         self.start_socket = start_socket
-        self.end_socket = end_socket or start_socket.scenePos()
+        self.end_socket = end_socket
+        self.slot = None  # Index into the WireLayer arrays while it is drawn
+
+class WireLayer(QGraphicsItem):
+    """Every wire of a scene, drawn by one item.
+
+    An item per wire costs memory and a paint call each, and is not told when
+    the nodes it joins move.  The layer keeps the endpoints of all wires in
+    packed arrays, one slot per ConnectionLine, and paints the ones crossing
+    the exposed rectangle with one drawLines() per pen.  Moving a node only
+    refreshes the slots of its own wires (see refresh).
+
+    Slots are found through grids like CircuitModel's: a wire goes into the
+    finest grid in which its bounding box touches at most SPAN_CELLS cells.
+    """
+    CELL_SIZE = 250
+    LEVELS = 6  # Grids, each with cells four times as wide as the last
+    SPAN_CELLS = 16
+    MARGIN = 4  # Half the widest pen, so repaints cover the whole stroke
+
+    def __init__(self):
+        super().__init__()
         self.setZValue(-1)
-    
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)  # Fills in option.exposedRect
+        self.coords = array("d")  # x1, y1, x2, y2 of each slot
+        self.bus = array("B")  # 1 where the wire carries a bus
+        self.spans = []  # Slot -> grid cells it is in, see _span
+        self.lines = []  # Slot -> ConnectionLine, or None while the slot is free
+        self.free = []
+        self.cells = [{} for _ in range(self.LEVELS)]  # Per level: cell -> {slot: None}
+        self.bounds = QRectF()  # Grows to fit every wire drawn so far
+        self.drag = None  # QLineF of the wire being dragged out of a socket
+
+    def __len__(self):
+        return len(self.lines) - len(self.free)
+
+    def _span(self, x1, y1, x2, y2):
+        """(level, first cell x, first cell y, last cell x, last cell y) of the
+        grid a wire with these endpoints is kept in"""
+        left, right, top, bottom = min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)
+        size = self.CELL_SIZE
+        for level in range(self.LEVELS):
+            first_x, first_y = math.floor(left / size), math.floor(top / size)
+            last_x, last_y = math.floor(right / size), math.floor(bottom / size)
+            if (last_x - first_x + 1) * (last_y - first_y + 1) <= self.SPAN_CELLS or level == self.LEVELS - 1:
+                return level, first_x, first_y, last_x, last_y
+            size *= 4
+
+    def _grid(self, slot, span, add):
+        level, first_x, first_y, last_x, last_y = span
+        cells = self.cells[level]
+        for key in ((cx, cy) for cx in range(first_x, last_x + 1) for cy in range(first_y, last_y + 1)):
+            if add:
+                cells.setdefault(key, {})[slot] = None
+            else:
+                bucket = cells.get(key)
+                if bucket is not None:
+                    bucket.pop(slot, None)
+                    if not bucket:
+                        del cells[key]
+
+    def _store(self, slot, line):
+        """Write a line's current endpoints into its slot and the grids.
+
+        Returns (left, top, right, bottom) covering the old and new stroke.
+        """
+        start, end = line.start_socket.scenePos(), line.end_socket.scenePos()
+        new = (start.x(), start.y(), end.x(), end.y())
+        i = 4 * slot
+        xs, ys = [new[0], new[2]], [new[1], new[3]]
+        old_span = self.spans[slot]
+        if old_span is not None:
+            xs += (self.coords[i], self.coords[i + 2])
+            ys += (self.coords[i + 1], self.coords[i + 3])
+        self.coords[i:i + 4] = array("d", new)
+        self.bus[slot] = line.start_socket.bus_width > 1
+        span = self._span(*new)
+        if span != old_span:
+            if old_span is not None:
+                self._grid(slot, old_span, False)
+            self._grid(slot, span, True)
+            self.spans[slot] = span
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _dirty(self, left, top, right, bottom):
+        """Repaint a rectangle of wires, growing the bounding rect to it first"""
+        rect = QRectF(left - self.MARGIN, top - self.MARGIN,
+                      right - left + 2 * self.MARGIN, bottom - top + 2 * self.MARGIN)
+        if not self.bounds.contains(rect):
+            self.prepareGeometryChange()
+            self.bounds = self.bounds.united(rect)
+        self.update(rect)
+
+    def add(self, line):
+        if self.free:
+            slot = self.free.pop()
+            self.lines[slot] = line
+        else:
+            slot = len(self.lines)
+            self.lines.append(line)
+            self.coords.extend((0.0,) * 4)
+            self.bus.append(0)
+            self.spans.append(None)
+        line.slot = slot
+        self._dirty(*self._store(slot, line))
+
+    def remove(self, line):
+        slot, line.slot = line.slot, None
+        i = 4 * slot
+        x1, y1, x2, y2 = self.coords[i:i + 4]
+        self._grid(slot, self.spans[slot], False)
+        self.spans[slot] = None
+        self.lines[slot] = None
+        self.free.append(slot)
+        self._dirty(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+    def refresh(self, lines):
+        """Follow the sockets of lines that moved or changed width; one repaint covers all"""
+        left = top = math.inf
+        right = bottom = -math.inf
+        for line in lines:
+            if line.slot is not None:
+                l, t, r, b = self._store(line.slot, line)
+                left, top, right, bottom = min(left, l), min(top, t), max(right, r), max(bottom, b)
+        if left <= right:
+            self._dirty(left, top, right, bottom)
+
+    def set_drag(self, line=None):
+        """Show (or with None, stop showing) the QLineF of a wire being dragged"""
+        for old in filter(None, (self.drag, line)):
+            rect = QRectF(old.p1(), old.p2()).normalized().adjusted(
+                -self.MARGIN, -self.MARGIN, self.MARGIN, self.MARGIN)
+            if not self.bounds.contains(rect):
+                self.prepareGeometryChange()
+                self.bounds = self.bounds.united(rect)
+            self.update(rect)
+        self.drag = line
+
+    def slots_in(self, rect):
+        """Slots of the wires whose bounding box overlaps a rectangle"""
+        left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+        found = set()
+        for level, cells in enumerate(self.cells):
+            size = self.CELL_SIZE * 4 ** level
+            first_x, first_y = math.floor(left / size), math.floor(top / size)
+            last_x, last_y = math.floor(right / size), math.floor(bottom / size)
+            if (last_x - first_x + 1) * (last_y - first_y + 1) > len(cells):
+                # Zoomed far out: walking the occupied cells is quicker
+                buckets = [bucket for (cx, cy), bucket in cells.items()
+                           if first_x <= cx <= last_x and first_y <= cy <= last_y]
+            else:
+                buckets = [cells[key] for key in ((cx, cy) for cx in range(first_x, last_x + 1)
+                                                  for cy in range(first_y, last_y + 1)) if key in cells]
+            for bucket in buckets:
+                found.update(bucket)
+        coords = self.coords
+        return [slot for slot in found
+                if min(coords[4 * slot], coords[4 * slot + 2]) <= right
+                and max(coords[4 * slot], coords[4 * slot + 2]) >= left
+                and min(coords[4 * slot + 1], coords[4 * slot + 3]) <= bottom
+                and max(coords[4 * slot + 1], coords[4 * slot + 3]) >= top]
+
     def boundingRect(self):
-        start_pos = self.mapFromScene(self.start_socket.scenePos()) if isinstance(self.start_socket, QGraphicsItem) else self.start_socket
-        end_pos = self.mapFromScene(self.end_socket.scenePos()) if isinstance(self.end_socket, QGraphicsItem) else self.end_socket
-        return QRectF(start_pos, end_pos).normalized().adjusted(-10, -10, 10, 10)
-    
+        return self.bounds
+
     def paint(self, painter, option, widget):
-        start_pos = self.start_socket.scenePos() if isinstance(self.start_socket, QGraphicsItem) else self.start_socket
-        end_pos = self.end_socket.scenePos() if isinstance(self.end_socket, QGraphicsItem) else self.end_socket
-        painter.setPen(QPen(Qt.black, 2))
-        painter.drawLine(QLineF(start_pos, end_pos))
-        
-    def removeFromSockets(self):
-        """Remove this connection from its sockets"""
-        if isinstance(self.start_socket, Socket):
-            if self.start_socket.connection == self:
-                self.start_socket.connection = None
-        if isinstance(self.end_socket, Socket):
-            if self.end_socket.connection == self:
-                self.end_socket.connection = None
+        rect = option.exposedRect.adjusted(-self.MARGIN, -self.MARGIN, self.MARGIN, self.MARGIN)
+        coords, bus = self.coords, self.bus
+        wires, buses = [], []
+        for slot in self.slots_in(rect):
+            i = 4 * slot
+            (buses if bus[slot] else wires).append(QLineF(coords[i], coords[i + 1], coords[i + 2], coords[i + 3]))
+        resources = RenderResources.shared()
+        painter.setPen(resources.wire_pen)
+        if self.drag is not None:
+            wires.append(self.drag)
+        painter.drawLines(wires)
+        if buses:
+            painter.setPen(resources.bus_pen)
+            painter.drawLines(buses)
 
 class Socket(QGraphicsItem):
+    RADIUS = 6
+    FIRST_OFFSET = 15  # Distance of the first socket from the top of its node
+    SPACING = 15
+    bus_width = 1  # Bits carried out of an output socket, see show_bus_widths
+
     def __init__(self, parent, is_input=True, index=0):
         super().__init__(parent)
         self.parent_item = parent
         self.is_input = is_input
         self.index = index
-        self.radius = 6
+        self.radius = self.RADIUS
         self.setPos(self.socket_position())
-        self.connection = None
+        self.dragging = False  # A wire is being dragged out of this output socket
     
     def boundingRect(self):
         return QRectF(-self.radius, -self.radius, self.radius * 2, self.radius * 2)
     
     def paint(self, painter, option, widget):
-        painter.setBrush(QBrush(Qt.blue if self.is_input else Qt.red))
+        if option.levelOfDetailFromTransform(painter.worldTransform()) < NodeItem.DETAIL_LOD:
+            return
+        resources = RenderResources.shared()
+        painter.setPen(resources.node_pen)
+        painter.setBrush(resources.input_socket_brush if self.is_input else resources.output_socket_brush)
         painter.drawEllipse(self.boundingRect())
     
     def socket_position(self):
-        y_offset = 15 + self.index * 15
+        y_offset = self.FIRST_OFFSET + self.index * self.SPACING
         return QPointF(-self.radius if self.is_input else self.parent_item.width + self.radius, y_offset)
     
     def mousePressEvent(self, event):
         if not self.is_input:
-            self.connection = ConnectionLine(self)
-            self.scene().addItem(self.connection)
-    
+            # Outputs can drive any number of inputs, so every drag starts a new line
+            self.dragging = True
+            self.scene().wires.set_drag(QLineF(self.scenePos(), self.scenePos()))
+
     def mouseMoveEvent(self, event):
-        if self.connection:
-            pos = event.scenePos()
-            self.connection.prepareGeometryChange()
-            self.connection.end_socket = pos
-            self.scene().update()
+        if self.dragging:
+            # Snap the loose end onto a nearby input socket
+            target = self.scene().nearest_input_socket(event.scenePos())
+            self.scene().wires.set_drag(QLineF(self.scenePos(), target.scenePos() if target else event.scenePos()))
 
     def mouseReleaseEvent(self, event):
-        if not self.connection:
+        if not self.dragging:
             return
 
-        items = self.scene().items(event.scenePos())
-        for item in items:
-            if isinstance(item, Socket) and item.is_input and item != self:
-                # Make connection
-                self.connection.end_socket = item
-                item.connection = self.connection
-                self.scene().update()
-
-                # Call process method if connecting to Output or Write Output node
-                if item.parentItem() and item.parentItem().text in ["Output", "Write Output"]:
-                    print(f"Connected to {item.parentItem().text} node, processing...")
-                    item.parentItem().process()
-                return
-
-        # If we reach here, no valid socket was found at release position
-        if self.connection:
-            self.scene().removeItem(self.connection)
-            self.connection = None
+        self.dragging = False
+        scene = self.scene()
+        scene.wires.set_drag(None)
+        target = scene.nearest_input_socket(event.scenePos())
+        if target is not None:
+            # Make connection; an input socket only keeps its newest driver
+            scene.execute_command(ConnectCommand(scene, ConnectionLine(self, target)))
 
 class NodeItem(QGraphicsItem):
-    def __init__(self, x, y, text):
+    EDITABLE_TYPES = ("Input", "Clock")  # Nodes with a field the user types into
+    FIELD_RECT = QRectF(10, 20, 100, 22)  # Where the value field is drawn
+    WRITE_BUTTON_RECT = QRectF(10, 45, 100, 20)
+    DETAIL_LOD = 0.4  # Below this zoom text and sockets are not drawn
+    WIDTH = 120
+    HEIGHT = 50  # Of a gate; Write Outputs and subcircuits are taller
+
+    def __init__(self, x, y, text, module=None):
         super().__init__()
         self.text = text
-        self.setFlags(QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemIsSelectable)
+        self.module = module  # ModuleDefinition for subcircuit instances
+        self.setFlags(QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemIsSelectable |
+                      QGraphicsItem.ItemSendsGeometryChanges)
         self.setPos(x, y)
         
-        self.width = 120
-        self.height = 70 if text == "Write Output" else 50
-        self.input_field = None
+        inputs = module.input_count if module else input_socket_count(text)
+        outputs = module.output_count if module else output_socket_count(text)
+        self.width = self.WIDTH
+        self.height = 70 if text == "Write Output" else self.HEIGHT
+        self.height = max(self.height, 25 + 15 * max(inputs, outputs))
+        # Subcircuits and Splits compile to a Port node per output socket
+        self.has_ports = module is not None or sized_type(text)[0] == "Split"
         self.output_value = None
 
-        if text == "Input":
-            self.input_field = QLineEdit()
-            self.input_field.setFixedWidth(100)
-            self.input_field.setText("1")
-            self.input_field.textChanged.connect(self.on_input_changed)  # Connect signal
-            self.input_proxy = QGraphicsProxyWidget(self)
-            self.input_proxy.setWidget(self.input_field)
-            self.input_proxy.setPos(10, 20)
-        elif text == "Output":
-            self.output_field = QLineEdit()
-            self.output_field.setFixedWidth(100)
-            self.output_field.setReadOnly(True)
-            self.output_field.setText("--")
-            self.output_proxy = QGraphicsProxyWidget(self)
-            self.output_proxy.setWidget(self.output_field)
-            self.output_proxy.setPos(10, 20)
-        elif text == "Write Output":
-            self.output_field = QLineEdit()
-            self.output_field.setFixedWidth(100)
-            self.output_field.setReadOnly(True)
-            self.output_field.setText("--")
-            self.output_proxy = QGraphicsProxyWidget(self)
-            self.output_proxy.setWidget(self.output_field)
-            self.output_proxy.setPos(10, 20)
-            self.write_button = QPushButton("Write")
-            self.write_button.setFixedWidth(100)
-            self.write_proxy = QGraphicsProxyWidget(self)
-            self.write_proxy.setWidget(self.write_button)
-            self.write_proxy.setPos(10, 50)
-            self.write_button.clicked.connect(self.write_to_file)
-
-        if text in ["Output", "Write Output"]:
-            self.input_sockets = [Socket(self, is_input=True, index=0)]
-        else:
-            self.input_sockets = [Socket(self, is_input=True, index=i) for i in range(2 if text not in ["NOT", "Input"] else 1)]
+        # Values are painted directly; a QLineEdit proxy only exists while an
+        # Input is being edited (see start_editing).  A Clock's value is its
+        # period and any other node's value, if set, its delay in ticks
+        self.value_text = "1" if text == "Input" else str(DEFAULT_PERIOD) if text == "Clock" else ""
+        self.output_text = "--"
+        self.input_field = None
+        self.input_proxy = None
+        self.sink = None  # OutputSink while a Write Output is recording
+        self.model_index = None  # Node number in the scene's CircuitModel, see open_circuit
+        self.edited = False  # Moved, rewired or changed since it was created
+        self.journal_id = None  # Names the node in the scene's EditJournal, see NodeGraphicsScene.adopt
+
+        self.input_sockets = [Socket(self, is_input=True, index=i) for i in range(inputs)]
         
-        self.output_socket = Socket(self, is_input=False)
+        # Only subcircuit instances and Splits have more than one output
+        self.output_sockets = [Socket(self, is_input=False, index=i) for i in range(outputs)]
+        self.output_socket = self.output_sockets[0]
+
+    def on_input_changed(self, text):
+        if text == self.value_text:
+            return  # The change came from set_value_text itself
+        command = SetInputValueCommand(self, self.value_text, text)
+        scene = self.scene()
+        if scene:
+            scene.execute_command(command)
+        else:
+            command.execute()
 
-    def on_input_changed(self):
-        # Trigger processing for connected nodes
-        if self.output_socket and self.output_socket.connection:
-            connected_node = self.output_socket.connection.end_socket.parentItem()
-            if connected_node:
-                connected_node.process()
+    def set_value_text(self, text):
+        """Set the text of an Input node and push it through the circuit"""
+        if text == self.value_text:
+            return
+        self.value_text = text
+        self.edited = True
+        if self.input_field is not None and self.input_field.text() != text:
+            self.input_field.setText(text)
+        self.update()
+        scene = self.scene()
+        if scene is None:
+            return
+        scene.journal_node(self)
+        if self.text == "Input":
+            # Re-evaluate only the gates downstream of this Input
+            scene.propagate_input(self)
+        else:
+            # A Clock period or a delay
+            scene.timing_changed()
+
+    def set_output_text(self, text):
+        """Set the text shown in an Output/Write Output node"""
+        if text != self.output_text:
+            self.output_text = text
+            self.update()
+
+    def start_editing(self):
+        """Swap in a real QLineEdit for the Input value until editing finishes"""
+        if self.text not in self.EDITABLE_TYPES or self.input_field is not None:
+            return
+        self.input_field = QLineEdit()
+        self.input_field.setFixedWidth(100)
+        self.input_field.setText(self.value_text)
+        self.input_field.textChanged.connect(self.on_input_changed)
+        self.input_field.editingFinished.connect(self.finish_editing)
+        self.input_proxy = QGraphicsProxyWidget(self)
+        self.input_proxy.setWidget(self.input_field)
+        self.input_proxy.setPos(self.FIELD_RECT.topLeft())
+        self.input_field.setFocus()
+        self.input_field.selectAll()
+
+    def finish_editing(self):
+        """Drop the editor widget again; the value keeps being painted directly"""
+        if self.input_field is None:
+            return
+        field, proxy = self.input_field, self.input_proxy
+        self.input_field = self.input_proxy = None
+        # Called from the widget's own signal, so delete it once it returns
+        field.textChanged.disconnect(self.on_input_changed)
+        proxy.hide()
+        proxy.deleteLater()
+        self.update()
 
     def process(self):
+        """Refresh this Output/Write Output node; the circuit is evaluated in the background"""
         if self.text in ["Output", "Write Output"]:
-            if self.input_sockets[0].connection and self.input_sockets[0].connection.start_socket:
-                start_socket = self.input_sockets[0].connection.start_socket
-                start_node = start_socket.parentItem()
-                if start_node:
-                    if start_node.text == "Input" and start_node.input_field:
-                        input_value = start_node.input_field.text().strip()
-                        if input_value in ["0", "1"]:
-                            self.output_field.setText(input_value)
-                            self.output_value = input_value
-                        else:
-                            self.output_field.setText("Use 0/1")
-                    elif start_node.text in ["AND", "OR", "NOT", "NAND", "NOR", "XOR", "XNOR"]:
-                        result = self.process_logic_gate(start_node)
-                        if result is not None:
-                            self.output_field.setText(result)
-                            self.output_value = result
-                        else:
-                            self.output_field.setText("Error")
-                    else:
-                        self.output_field.setText("Error")
-                else:
-                    self.output_field.setText("Error")
-            else:
-                self.output_field.setText("No input")
+            scene = self.scene()
+            if scene is not None:
+                scene.request_evaluation()
+
+    def show_result(self, netlist):
+        """Display the value the netlist computed for this Output/Write Output node"""
+        node = netlist.index.get(self)
+        if node is None:
+            return
+        if self.text in STATE_TYPES:
+            self.set_output_text(format_value(netlist.values[node], netlist.widths[node]) or "--")
+            return
+        driver = netlist.fanin[node][0]
+        value = format_value(netlist.values[node], netlist.widths[node])
+        if driver is None:
+            self.set_output_text("No input")
+        elif value is not None:
+            self.set_output_text(value)
+            self.output_value = value
+        elif netlist.types[driver] == "Input":
+            self.set_output_text("Use 0/1")
+        else:
+            self.set_output_text("Error")
 
     def write_to_file(self):
-        if self.output_field and self.output_field.text() != "--":
+        if self.output_text != "--":
             file_name, _ = QFileDialog.getSaveFileName(None, "Save Output", "", "Text Files (*.txt)")
             if file_name:
                 with open(file_name, "w") as file:
-                    file.write(self.output_field.text())
+                    file.write(self.output_text)
                 print(f"Output written to {file_name}")
 
+    def record_to_file(self):
+        """Append every value of this Write Output to a file until recording stops"""
+        file_name, selected_filter = QFileDialog.getSaveFileName(
+            None, "Record Output", "", SINK_FILE_FILTER, options=QFileDialog.DontConfirmOverwrite)
+        if not file_name or self.scene() is None:
+            return
+        sink_format = format_for(file_name, None)
+        if sink_format is None:
+            # No known extension typed; use the one of the chosen filter
+            sink_format = next((name for name, extension in FORMAT_EXTENSIONS.items()
+                                if extension in selected_filter), "text")
+            file_name += FORMAT_EXTENSIONS[sink_format]
+        try:
+            self.sink = open_sink(file_name, sink_format)
+        except OSError as error:
+            self.scene().show_status(f"Could not record to {file_name}: {error}", 5000)
+            return
+        self.scene().recording_changed(self)
+        self.scene().show_status(f"Recording to {file_name}")
+        self.update()
+
+    def stop_recording(self):
+        if self.sink is None:
+            return
+        sink, self.sink = self.sink, None
+        sink.close()
+        if self.scene():
+            self.scene().recording_changed(self)
+            self.scene().show_status(f"Recorded {sink.count} values to {sink.file_name}")
+        self.update()
+
     def boundingRect(self):
         return QRectF(0, 0, self.width, self.height)
     
     def paint(self, painter, option, widget):
-        painter.setBrush(QBrush(Qt.white))
-        painter.setPen(QPen(Qt.black))
+        resources = RenderResources.shared()
+        painter.setBrush(resources.node_brush)
+        painter.setPen(resources.node_pen)
         painter.drawRect(self.boundingRect())
+
+        # Far zoom: the outline is all that can be seen anyway
+        if option.levelOfDetailFromTransform(painter.worldTransform()) < self.DETAIL_LOD:
+            return
+        painter.setFont(resources.label_font)
         painter.drawText(10, 15, self.text)
 
+        if self.text in self.EDITABLE_TYPES and self.input_field is None:
+            self.paint_field(painter, self.value_text)
+        elif self.text in ["Output", "Write Output"] or self.text in STATE_TYPES:
+            self.paint_field(painter, self.output_text, read_only=True)
+        if self.text == "Write Output":
+            painter.setBrush(resources.button_brush)
+            painter.drawRoundedRect(self.WRITE_BUTTON_RECT, 3, 3)
+            painter.drawText(self.WRITE_BUTTON_RECT, Qt.AlignCenter, "Stop" if self.sink else "Write")
+
+    def paint_field(self, painter, text, read_only=False):
+        """Draw a value the way a QLineEdit would show it"""
+        resources = RenderResources.shared()
+        painter.setBrush(resources.read_only_brush if read_only else resources.field_brush)
+        painter.drawRect(self.FIELD_RECT)
+        painter.drawText(self.FIELD_RECT.adjusted(4, 0, -4, 0), Qt.AlignVCenter | Qt.AlignLeft, text)
+
+    def mousePressEvent(self, event):
+        # Clicking the value field or the Write button acts on it instead of
+        # starting a move
+        if self.text in self.EDITABLE_TYPES and self.FIELD_RECT.contains(event.pos()):
+            self.start_editing()
+            event.accept()
+            return
+        if self.text == "Write Output" and self.WRITE_BUTTON_RECT.contains(event.pos()):
+            if self.sink:
+                self.stop_recording()
+            else:
+                self.write_to_file()
+            event.accept()
+            return
+        super().mousePressEvent(event)
+
+    def edit_size(self):
+        """Ask for the number of inputs of a gate, or the bits of a Split or Merge"""
+        base, size = sized_type(self.text)
+        if base in BUS_TYPES:
+            size, ok = QInputDialog.getInt(None, "Set Width", "Bits:", size, 1, MAX_BUS_WIDTH)
+        else:
+            size, ok = QInputDialog.getInt(None, "Set Inputs", "Inputs:", size or 2, 2, MAX_GATE_INPUTS)
+        # A two-input gate keeps its plain name
+        node_type = base if base in WIDE_GATE_TYPES and size == 2 else f"{base} {size}"
+        if ok and node_type != self.text and self.scene():
+            self.scene().execute_command(self.scene().resize_node(self, node_type))
+
+    def edit_delay(self):
+        """Ask for the delay of this node in simulation ticks"""
+        delay = parse_ticks(self.value_text, node_delay(self.text))
+        delay, ok = QInputDialog.getInt(None, "Set Delay", "Delay in ticks:", delay, 0, 1000000)
+        if ok and self.scene():
+            self.scene().execute_command(SetInputValueCommand(self, self.value_text, str(delay)))
+
     def contextMenuEvent(self, event):
         menu = QMenu()
+        delay_action = record_action = size_action = None
+        base = sized_type(self.text)[0]
+        if base in WIDE_GATE_TYPES:
+            size_action = menu.addAction("Set Inputs...")
+        elif base in BUS_TYPES:
+            size_action = menu.addAction("Set Width...")
+        if self.text not in self.EDITABLE_TYPES:
+            delay_action = menu.addAction("Set Delay...")
+        if self.text == "Write Output":
+            record_action = menu.addAction("Stop Recording" if self.sink else "Record to File...")
         delete_action = menu.addAction("Delete Node")
         action = menu.exec_(event.screenPos())
         
-        if action == delete_action:
-            # Remove all connections
-            for socket in self.input_sockets:
-                if socket.connection:
-                    if isinstance(socket.connection, ConnectionLine):
-                        self.scene().removeItem(socket.connection)
-                    socket.connection = None
-            
-            # Remove the connection from the output socket
-            if hasattr(self, 'output_socket') and self.output_socket and self.output_socket.connection:
-                if isinstance(self.output_socket.connection, ConnectionLine):
-                    self.scene().removeItem(self.output_socket.connection)
-                self.output_socket.connection = None
-                
-            # Remove the node itself
+        if action is None:
+            return
+        if action == size_action:
+            self.edit_size()
+        elif action == delay_action:
+            self.edit_delay()
+        elif action == record_action:
+            if self.sink:
+                self.stop_recording()
+            else:
+                self.record_to_file()
+        elif action == delete_action:
+            # Remove the node together with its connections
             command = DeleteNodeCommand(self.scene(), self)
-            self.scene().parent().execute_command(command)
+            self.scene().execute_command(command)
        
 
-    def process_logic_gate(self, gate_node):
-        """Process a logic gate node and return its output value"""
-        
-        gate_type = gate_node.text
-        
-        # For NOT gate (1 input)
-        if gate_type == "NOT":
-            # Check if the NOT gate has an input connection
-            if gate_node.input_sockets[0].connection and gate_node.input_sockets[0].connection.start_socket:
-                input_source = gate_node.input_sockets[0].connection.start_socket.parentItem()
-                
-                # Get input value (recursively if needed)
-                input_value = self.get_node_value(input_source)
-                if input_value in ["0", "1"]:
-                    # NOT operation: invert the input
-                    return "1" if input_value == "0" else "0"
-            return None
-            
-        # For all other gates (2 inputs)
-        elif gate_type in ["AND", "OR", "NAND", "NOR", "XOR", "XNOR"]:
-            # Check if both inputs have connections
-            if (len(gate_node.input_sockets) >= 2 and 
-                gate_node.input_sockets[0].connection and gate_node.input_sockets[0].connection.start_socket and
-                gate_node.input_sockets[1].connection and gate_node.input_sockets[1].connection.start_socket):
-                
-                # Get the input sources
-                input_source1 = gate_node.input_sockets[0].connection.start_socket.parentItem()
-                input_source2 = gate_node.input_sockets[1].connection.start_socket.parentItem()
-                
-                # Get input values (recursively if needed)
-                input1 = self.get_node_value(input_source1)
-                input2 = self.get_node_value(input_source2)
-                
-                # Process based on gate type
-                if input1 in ["0", "1"] and input2 in ["0", "1"]:
-                    if gate_type == "AND":
-                        result = "1" if input1 == "1" and input2 == "1" else "0"
-                    elif gate_type == "OR":
-                        result = "1" if input1 == "1" or input2 == "1" else "0"
-                    elif gate_type == "NAND":
-                        result = "0" if input1 == "1" and input2 == "1" else "1"
-                    elif gate_type == "NOR":
-                        result = "0" if input1 == "1" or input2 == "1" else "1"
-                    elif gate_type == "XOR":
-                        result = "1" if input1 != input2 else "0"
-                    elif gate_type == "XNOR":
-                        result = "1" if input1 == input2 else "0"
-                    return result
-            return None
-        
-        return None
-
-    def get_node_value(self, node):
-        """Get the output value from a node, recursively processing if needed"""
-        if not node:
-            return None
-            
-        # For Input nodes, get value directly from the input field
-        if node.text == "Input" and node.input_field:
-            value = node.input_field.text().strip()
-            return value if value in ["0", "1"] else None
-            
-        # For logic gates, recursively process the gate
-        elif node.text in ["AND", "OR", "NOT", "NAND", "NOR", "XOR", "XNOR"]:
-            return self.process_logic_gate(node)
-            
-        # Default case
-        return None
+    def itemChange(self, change, value):
+        # Adding or removing a node changes the circuit, so the compiled
+        # netlist of the scene it leaves and the one it joins are stale
+        if change == QGraphicsItem.ItemSceneChange and self.scene():
+            self.scene().invalidate_netlist()
+            self.scene().unindex_sockets(self)
+            self.scene().journal_node(self)
+        elif change == QGraphicsItem.ItemSceneHasChanged and value:
+            value.invalidate_netlist()
+            value.index_sockets(self)
+            value.adopt(self)
+        elif change == QGraphicsItem.ItemPositionHasChanged and self.scene():
+            self.edited = True
+            self.scene().index_sockets(self)
+            self.scene().journal_node(self)
+            self.scene().wires.refresh(self.scene().connections.node_connections(self))
+        return super().itemChange(change, value)
 
 class NodeGraphicsScene(QGraphicsScene):
+    evaluation_finished = pyqtSignal(object, object, object)  # Netlist, evaluated snapshot, error
+    GRID_MAJOR_EVERY = 5  # Grid lines kept when zoomed out
+    GRID_MINOR_LOD = 0.5  # Below this zoom only every fifth line is drawn
+    GRID_HIDE_LOD = 0.1  # Below this zoom the grid is not drawn at all
+    GRID_CACHE_SIZE = 16  # Cached tiles (one per line spacing and zoom bucket)
+    SOCKET_CELL_SIZE = 50  # Cell size of the socket spatial index
+    SNAP_RADIUS = 15  # How close a dragged wire must come to snap onto a socket
+    FRAME_INTERVAL = 33  # Milliseconds between simulation frames (about 30 per second)
+    FRAME_BUDGET = 0.02  # Seconds a frame may simulate before dropping ticks
+    FRAME_SLICE = 64  # Ticks simulated between checks of the frame budget
+    SETTLE_LIMIT = 1000  # Ticks an Input change may take to settle while paused
+    DEFAULT_TICKS_PER_SECOND = 20
+    HOT_NODES = 10  # Most evaluated nodes outlined by the profile overlay
+    VIRTUAL_THRESHOLD = 20000  # Circuits with this many nodes are opened virtually
+    VIRTUAL_MARGIN = 400  # Gates this close to a view get items before they come into sight
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.grid_size = 20  # Size of the grid squares
         self.grid_color = QColor(200, 200, 200)  # Light gray grid lines
+        self._grid_brushes = {}  # (line spacing, tile pixels) -> QBrush, see grid_brush()
+        self._move_start = {}  # NodeItem -> position when the mouse was pressed
+        self.connections = ConnectionIndex()
+        self.wires = WireLayer()  # Draws every ConnectionLine
+        self.addItem(self.wires)
+        self._modules = ModuleLibrary()  # Used only when the scene has no editor
+        self.socket_index = SpatialHash(self.SOCKET_CELL_SIZE)  # Input socket -> scene position
+        self._netlist = None  # Compiled lazily, see netlist()
+        self._refresh_pending = False
+        self._simulator = None  # EventSimulator of the netlist, see simulator()
+        self._frame_timer = None
+        self._last_frame = 0.0
+        self._pending_ticks = 0.0
+        self.ticks_per_second = self.DEFAULT_TICKS_PER_SECOND
+        self.trace_labels = {}  # Traced netlist node -> waveform label
+        self._evaluations = JobRunner("evaluation")
+        self.evaluation_finished.connect(self.apply_evaluation, Qt.QueuedConnection)
+        self.profiler = None  # Profiler while profiling is on, see set_profiling()
+        self.profile_overlay = False
+        self._paint_start = None
+        self.model = None  # CircuitModel of a virtual scene, see open_circuit()
+        self.model_items = {}  # Model node -> its NodeItem, for the nodes that have one
+        self._virtualizing = False  # Items come and go without changing the circuit
+        self._virtual_pending = False
+        self._view_rects = None  # What the views showed at the last update_virtual()
+        self.journal = None  # EditJournal of this design, see start_journal()
+        self.next_node_id = 0  # Journal id of the next node added
+        self.model_ids = None  # Journal id of each model node, if not its number
+        self._journal_nodes = {}  # NodeItems added, changed or removed since the last record
+        self._journal_sockets = {}  # Input sockets rewired since the last record
+
+    def execute_command(self, command):
+        """Run an undoable command through the owning editor if there is one"""
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            editor.execute_command(command)
+        else:
+            command.execute()
+
+    def add_connection(self, line):
+        """Add a finished ConnectionLine to the wire layer and the adjacency index"""
+        if line.slot is None:
+            self.wires.add(line)
+        self.connections.add(line)
+        line.start_socket.parentItem().edited = line.end_socket.parentItem().edited = True
+        self.journal_socket(line.end_socket)
+        self.invalidate_netlist()
+
+    def remove_connection(self, line):
+        """Remove a ConnectionLine from the wire layer and the adjacency index"""
+        self.connections.remove(line)
+        if line.slot is not None:
+            self.wires.remove(line)
+        line.start_socket.parentItem().edited = line.end_socket.parentItem().edited = True
+        self.journal_socket(line.end_socket)
+        self.invalidate_netlist()
+
+    def remove_node(self, node):
+        """Remove a NodeItem and its connections; returns the removed lines"""
+        node.edited = True
+        lines = self.connections.node_connections(node)
+        for line in lines:
+            self.remove_connection(line)
+        if node.sink:
+            node.sink.flush()  # It records again if the removal is undone
+        self.removeItem(node)
+        return lines
+
+    def index_sockets(self, node):
+        """Record (or update) the scene positions of a node's input sockets"""
+        for socket in node.input_sockets:
+            pos = socket.scenePos()
+            self.socket_index.insert(socket, pos.x(), pos.y())
+
+    def unindex_sockets(self, node):
+        for socket in node.input_sockets:
+            self.socket_index.remove(socket)
+
+    def nearest_input_socket(self, pos, radius=None):
+        """Return the input Socket closest to a scene position within the snap radius"""
+        radius = self.SNAP_RADIUS if radius is None else radius
+        return self.socket_index.nearest(pos.x(), pos.y(), radius)
+
+    def to_circuit(self, nodes=None, with_ids=False):
+        """Describe the nodes and wires of this scene as a CircuitData.
+
+        Given some nodes, only those are described, with the wires between
+        them and the subcircuits they use.  with_ids also returns the journal
+        id of each node of the circuit, as (circuit, ids).
+        """
+        records = sorted(self.circuit_records(nodes), key=lambda record: (record[3], record[2]))
+        index = {record[0]: i for i, record in enumerate(records)}
+        circuit = CircuitData()
+        for _, node_type, x, y, value, _ in records:
+            circuit.add_node(node_type, x, y, value)
+        for dst, record in enumerate(records):
+            for socket, driver in enumerate(record[5]):
+                src = None if driver is None else index.get(driver[0])
+                if src is not None:
+                    circuit.add_wire(src, dst, socket, driver[1])
+        bodies = self.module_library().bodies()
+        if nodes is not None:
+            # Only the subcircuits used, including those used inside them
+            used = {}
+            pending = [t for t in circuit.types if t in bodies]
+            while pending:
+                name = pending.pop()
+                if name not in used:
+                    used[name] = bodies[name]
+                    pending.extend(t for t in bodies[name].types if t in bodies)
+            bodies = used
+        circuit.modules = bodies
+        if with_ids:
+            return circuit, [self.journal_id_of(record[0]) for record in records]
+        return circuit
+
+    def journal_id_of(self, key):
+        """The journal id of a circuit_records() key"""
+        if isinstance(key, NodeItem):
+            return key.journal_id
+        return key if self.model_ids is None else self.model_ids[key]
+
+    def adopt(self, node):
+        """Give a node joining the scene a journal id, and journal it"""
+        if node.journal_id is None:
+            node.journal_id = self.next_node_id
+            self.next_node_id += 1
+        self.journal_node(node)
+
+    def journal_node(self, node):
+        """Note that a node was added, changed or removed; see flush_journal"""
+        if self.journal is not None and not self._virtualizing:
+            self._journal_nodes[node] = None
+
+    def journal_socket(self, socket):
+        if self.journal is not None and not self._virtualizing:
+            self._journal_sockets[socket] = None
+
+    def start_journal(self, journal, next_id=None, modules=()):
+        """Record the edits of this scene from now on in an EditJournal.
+
+        The scene must hold what the journal starts from: its source file or
+        what journal.recover() returned.  modules are the subcircuits it
+        already has.
+        """
+        self.journal = journal
+        if next_id is not None:
+            self.next_node_id = max(self.next_node_id, next_id)
+        self._journal_nodes.clear()
+        self._journal_sockets.clear()
+        try:
+            journal.start(modules)
+        except OSError as error:
+            self.journal = None
+            self.show_status(f"Autosave is off: {error}", 5000)
+
+    def flush_journal(self):
+        """Append what changed since the last call to the journal, as one record"""
+        if self.journal is None:
+            return
+        nodes, removed, wires = [], [], []
+        for node in self._journal_nodes:
+            if node.scene() is self:
+                nodes.append((node.journal_id, node.text, node.x(), node.y(), node.value_text))
+            else:
+                removed.append(node.journal_id)
+        for socket in self._journal_sockets:
+            node = socket.parentItem()
+            if node.scene() is not self:
+                continue  # Its wires went with it
+            line = self.connections.driver(socket)
+            if line is None:
+                wires.append((node.journal_id, socket.index))
+            else:
+                source = line.start_socket
+                wires.append((node.journal_id, socket.index, source.parentItem().journal_id, source.index))
+        self._journal_nodes.clear()
+        self._journal_sockets.clear()
+        modules = {name: definition.body for name, definition in self.module_library().items()
+                   if name not in self.journal.modules}
+        if nodes or removed or wires or modules:
+            try:
+                self.journal.append(nodes, removed, wires, modules)
+            except OSError as error:
+                self.journal = None
+                self.show_status(f"Autosave stopped: {error}", 5000)
+
+    def close_journal(self):
+        """Stop journaling; a journal without edits has nothing worth recovering"""
+        if self.journal is None:
+            return
+        self.flush_journal()
+        if self.journal.seq == 0:
+            self.journal.discard()
+        else:
+            self.journal.close()
+        self.journal = None
+
+    def node_key(self, node):
+        """The key of a NodeItem in circuit_records() and the netlist"""
+        if node.model_index is not None and is_gate(node.text):
+            return node.model_index
+        return node
+
+    def circuit_records(self, nodes=None):
+        """Every node (or the given ones) as (key, type, x, y, value, drivers).
+
+        drivers holds a (driving key, output socket) pair or None for each
+        input socket.  Nodes are keyed by their NodeItem, except that in a
+        virtual scene the gates of the model are keyed by their model number,
+        whether they have an item or not, so the netlist does not change as
+        items come and go.
+        """
+        model, items = self.model, self.model_items
+        driver_of = self.connections.driver
+        records = []
+        for node in self.items() if nodes is None else nodes:
+            if not isinstance(node, NodeItem):
+                continue
+            # Wires from gates without an item exist only in the model.  They
+            # were never edited: that would have needed both ends as items
+            model_drivers = () if node.model_index is None else model.drivers(node.model_index)
+            drivers = []
+            for socket in node.input_sockets:
+                line = driver_of(socket)
+                driver = model_drivers[socket.index] if socket.index < len(model_drivers) else None
+                if line is not None:
+                    drivers.append((self.node_key(line.start_socket.parentItem()), line.start_socket.index))
+                elif driver is not None and driver[0] not in items:
+                    drivers.append(driver)
+                else:
+                    drivers.append(None)
+            records.append((self.node_key(node), node.text, node.x(), node.y(), node.value_text, drivers))
+        if model is None or nodes is not None:
+            return records
+        for n in range(len(model)):
+            if n in items:
+                continue
+            drivers = []
+            for driver in model.drivers(n):
+                source = None if driver is None else items.get(driver[0])
+                if source is None:
+                    drivers.append(driver)
+                elif source.scene() is self:
+                    drivers.append((self.node_key(source), driver[1]))
+                else:
+                    drivers.append(None)  # Deleted
+            records.append((n, model.type_of(n), model.xs[n], model.ys[n], model.value_of(n), drivers))
+        return records
+
+    def load_circuit(self, circuit, ids=None):
+        """Add the nodes and wires of a CircuitData in one batch; returns the nodes.
+
+        ids, if given, are the journal ids of the nodes (see start_journal).
+        """
+        circuit = self.define_circuit_modules(circuit)
+
+        with self.bulk_update():
+            nodes = []
+            for i, (node_type, x, y, value) in enumerate(zip(circuit.types, circuit.xs, circuit.ys, circuit.values)):
+                node = self.create_node(node_type, x, y)
+                if value:
+                    # Set before the node joins the scene, so no propagation runs yet
+                    node.value_text = value
+                if ids is not None:
+                    node.journal_id = ids[i]
+                self.addItem(node)
+                nodes.append(node)
+            for src, dst, socket, src_socket in circuit.wires():
+                sockets = nodes[dst].input_sockets
+                outputs = nodes[src].output_sockets
+                if socket < len(sockets) and src_socket < len(outputs):
+                    line = ConnectionLine(outputs[src_socket], sockets[socket])
+                    self.wires.add(line)
+                    self.connections.add(line)
+        return nodes
+
+    def define_circuit_modules(self, circuit):
+        """Define the subcircuits of a circuit about to be loaded.
+
+        Every tab shares the definitions, so a subcircuit whose name is taken
+        by a different body is defined under a new name (see
+        ModuleLibrary.merge); returns the circuit with its nodes renamed to match.
+        """
+        added, renames = self.module_library().merge(circuit.modules)
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            for name in added:
+                editor.node_list.add_module(name)
+        return renamed(circuit, renames)
+
+    def open_circuit(self, circuit, ids=None):
+        """Show a whole circuit file in this empty scene.
+
+        Circuits of VIRTUAL_THRESHOLD nodes or more stay in a CircuitModel:
+        Inputs, Outputs and other non-gate nodes get a NodeItem straight away,
+        gates only once a view comes near them (see update_virtual).  Smaller
+        circuits are loaded as usual.  Node i gets journal id ids[i], or i.
+        """
+        self.next_node_id = max(self.next_node_id, len(circuit) if ids is None else max(ids, default=-1) + 1)
+        if len(circuit) < self.VIRTUAL_THRESHOLD:
+            self.load_circuit(circuit, ids)
+            return
+        circuit = self.define_circuit_modules(circuit)
+        self.model = CircuitModel(circuit, self.module_library())
+        self.model_ids = ids
+        with self.bulk_update():
+            self._virtualizing = True
+            try:
+                for node in range(len(self.model)):
+                    if not is_gate(self.model.type_of(node)):
+                        self.materialize(node)
+            finally:
+                self._virtualizing = False
+        self.schedule_virtual_update()
+
+    def materialize(self, n):
+        """Give model node n a NodeItem, wired to the neighbours that have one"""
+        model, items = self.model, self.model_items
+        node = self.create_node(model.type_of(n), model.xs[n], model.ys[n])
+        value = model.value_of(n)
+        if value:
+            node.value_text = value
+        node.model_index = n
+        node.journal_id = n if self.model_ids is None else self.model_ids[n]
+        self.addItem(node)
+        items[n] = node
+        for socket, driver in zip(node.input_sockets, model.drivers(n)):
+            source = None if driver is None else items.get(driver[0])
+            if source is not None and source.scene() is self and driver[1] < len(source.output_sockets):
+                self.add_model_line(source.output_sockets[driver[1]], socket)
+        for sink in set(model.fanout(n)):
+            target = items.get(sink)
+            if target is None or target.scene() is not self:
+                continue
+            for socket, driver in zip(target.input_sockets, model.drivers(sink)):
+                if driver is not None and driver[0] == n and driver[1] < len(node.output_sockets):
+                    self.add_model_line(node.output_sockets[driver[1]], socket)
+        return node
+
+    def add_model_line(self, start_socket, end_socket):
+        if self.connections.driver(end_socket) is None:
+            line = ConnectionLine(start_socket, end_socket)
+            self.wires.add(line)
+            self.connections.add(line)
+
+    def park(self, n):
+        """Drop the NodeItem of model node n; its wires are drawn from the model again"""
+        node = self.model_items.pop(n)
+        for line in self.connections.node_connections(node):
+            self.connections.remove(line)
+            self.wires.remove(line)
+        self.removeItem(node)
+
+    def parkable(self, node):
+        """Whether a NodeItem can be dropped without losing anything.
+
+        Only gates unchanged since they came from the model qualify.  Adding
+        or removing a wire marks both its ends as edited, so the wires of a
+        parkable gate are still those of the model.
+        """
+        return not (node.edited or node.isSelected() or not is_gate(node.text)
+                    or node.scene() is not self or node.input_field is not None)
+
+    def materialize_driver(self, socket):
+        """Give the model gate driving an input socket an item, and so the wire a line.
+
+        Called before a wire is connected to the socket, so that the model
+        wire is replaced (and restored by undo) like any other.
+        """
+        node = socket.parentItem()
+        if node.model_index is None:
+            return
+        drivers = self.model.drivers(node.model_index)
+        driver = drivers[socket.index] if socket.index < len(drivers) else None
+        if driver is not None and driver[0] not in self.model_items:
+            self._virtualizing = True
+            try:
+                self.materialize(driver[0])
+            finally:
+                self._virtualizing = False
+
+    def materialize_neighbours(self, node):
+        """Give the model nodes wired to a node items, so that all its wires are lines"""
+        if node.model_index is None:
+            return
+        self._virtualizing = True
+        try:
+            for n in self.model.neighbours(node.model_index):
+                if n not in self.model_items:
+                    self.materialize(n)
+        finally:
+            self._virtualizing = False
+
+    def schedule_virtual_update(self):
+        if self.model is not None and not self._virtual_pending:
+            self._virtual_pending = True
+            QTimer.singleShot(0, self.update_virtual)
+
+    def update_virtual(self):
+        """Give items to the gates a view is near and drop those it left.
+
+        Every gate within VIRTUAL_MARGIN of a view gets a NodeItem, and so do
+        the nodes wired to it, so everything the user can click on has its
+        wires as items.  Zoomed out below NodeItem.DETAIL_LOD nothing changes;
+        the model is drawn in drawBackground().
+        """
+        self._virtual_pending = False
+        if self.model is None:
+            return
+        margin = self.VIRTUAL_MARGIN
+        rects = []
+        for view in self.views():
+            if QStyleOptionGraphicsItem.levelOfDetailFromTransform(view.transform()) >= NodeItem.DETAIL_LOD:
+                rect = view.mapToScene(view.viewport().rect()).boundingRect()
+                rects.append((rect.left() - margin - NodeItem.WIDTH, rect.top() - margin - NodeItem.HEIGHT,
+                              rect.right() + margin, rect.bottom() + margin))
+        if not rects or rects == self._view_rects:
+            return
+        self._view_rects = rects
+        model, items = self.model, self.model_items
+        keep = set()
+        for rect in rects:
+            for n in model.nodes_in(*rect):
+                keep.add(n)
+                keep.update(model.neighbours(n))
+        self._virtualizing = True
+        try:
+            for n in keep:
+                if n not in items:
+                    self.materialize(n)
+            for n, node in list(items.items()):
+                if n not in keep and self.parkable(node):
+                    self.park(n)
+        finally:
+            self._virtualizing = False
+
+    def draw_model(self, painter, rect, lod):
+        """Draw the gates without an item, and the wires of those, from the model"""
+        model, items = self.model, self.model_items
+        width, height = NodeItem.WIDTH, NodeItem.HEIGHT
+        xs, ys = model.xs, model.ys
+        left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+        lines = []
+
+        def position(n):
+            # Items may have been moved since the model was loaded
+            node = items.get(n)
+            return (xs[n], ys[n]) if node is None else (node.x(), node.y())
+
+        for src, dst, socket, src_socket in model.wires_in(left - width, top - height, right + width, bottom):
+            src_node, dst_node = items.get(src), items.get(dst)
+            if src_node is not None and dst_node is not None:
+                continue  # A ConnectionLine
+            node = src_node or dst_node
+            if node is not None and node.scene() is not self:
+                continue  # Deleted
+            (x1, y1), (x2, y2) = position(src), position(dst)
+            lines.append(QLineF(x1 + width + Socket.RADIUS, y1 + Socket.FIRST_OFFSET + src_socket * Socket.SPACING,
+                                x2 - Socket.RADIUS, y2 + Socket.FIRST_OFFSET + socket * Socket.SPACING))
+        parked = [n for n in model.nodes_in(left - width, top - height, right, bottom) if n not in items]
+        resources = RenderResources.shared()
+        painter.save()
+        painter.setPen(resources.wire_pen)
+        painter.drawLines(lines)
+        painter.setPen(resources.node_pen)
+        painter.setBrush(resources.node_brush)
+        painter.setFont(resources.label_font)
+        painter.drawRects([QRectF(xs[n], ys[n], width, height) for n in parked])
+        if lod >= NodeItem.DETAIL_LOD:
+            for n in parked:
+                painter.drawText(QPointF(xs[n] + 10, ys[n] + 15), model.type_of(n))
+        painter.restore()
+
+    def key_item(self, key):
+        """The NodeItem of a netlist key, or None for a gate that has no item"""
+        if isinstance(key, Socket):
+            return key.parentItem()
+        if isinstance(key, int):
+            return self.model_items.get(key)
+        return key
+
+    def key_value(self, key):
+        """The value text (a delay, period or Input value) of a netlist key"""
+        node = self.key_item(key)
+        if node is not None:
+            return node.value_text
+        return self.model.value_of(key) if isinstance(key, int) else ""
+
+    @contextmanager
+    def bulk_update(self):
+        """Add or remove many items at once.
+
+        Maintaining the BSP index and repainting per item dominates bulk
+        changes, so both are switched off and the index is rebuilt once at the
+        end.
+        """
+        views = self.views()
+        for view in views:
+            view.setUpdatesEnabled(False)
+        self.setItemIndexMethod(QGraphicsScene.NoIndex)
+        try:
+            yield
+        finally:
+            self.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
+            for view in views:
+                view.setUpdatesEnabled(True)
+            self.invalidate_netlist()
+
+    def module_library(self):
+        """The subcircuit definitions available to this scene"""
+        editor = self.parent()
+        return editor.modules if isinstance(editor, NodeEditor) else self._modules
+
+    def create_node(self, node_type, x, y):
+        """Create (but do not add) a NodeItem, resolving subcircuit types"""
+        return NodeItem(x, y, node_type, self.module_library().get(node_type))
+
+    def extract_subcircuit(self, gates):
+        """Copy a set of nodes into a subcircuit body.
+
+        Every distinct output socket outside the set that feeds into it
+        becomes an Input of the body, and every output socket in the set that
+        feeds something outside becomes an Output.  Returns (body, external
+        driver sockets, [(inner output socket, [external lines])]), with the
+        pins in the same order as the body's Inputs and Outputs.
+        """
+        selected = set(gates)
+        gates = sorted(gates, key=lambda node: (node.y(), node.x()))
+        left = min(node.x() for node in gates)
+        top = min(node.y() for node in gates)
+        right = max(node.x() + node.width for node in gates)
+
+        drivers = {}
+        for node in gates:
+            for socket in node.input_sockets:
+                line = self.connections.driver(socket)
+                if line is not None and line.start_socket.parentItem() not in selected:
+                    drivers.setdefault(line.start_socket, socket.scenePos().y())
+        drivers = sorted(drivers, key=lambda socket: (drivers[socket], socket.scenePos().x()))
+
+        outputs = []
+        for node in gates:
+            for socket in node.output_sockets:
+                external = [line for line in self.connections.fanout(socket)
+                            if line.end_socket.parentItem() not in selected]
+                if external:
+                    outputs.append((socket, external))
+
+        body = CircuitData()
+        input_index = {}
+        for socket in drivers:
+            input_index[socket] = body.add_node("Input", -150, socket.scenePos().y() - top, "")
+        gate_index = {}
+        for node in gates:
+            gate_index[node] = body.add_node(node.text, node.x() - left, node.y() - top, node.value_text)
+        for node in gates:
+            for socket in node.input_sockets:
+                line = self.connections.driver(socket)
+                if line is None:
+                    continue
+                start = line.start_socket
+                if start in input_index:
+                    body.add_wire(input_index[start], gate_index[node], socket.index)
+                else:
+                    body.add_wire(gate_index[start.parentItem()], gate_index[node], socket.index, start.index)
+        for socket, _ in outputs:
+            output = body.add_node("Output", right - left + 150, socket.scenePos().y() - top, "")
+            body.add_wire(gate_index[socket.parentItem()], output, 0, socket.index)
+        return body, drivers, outputs
+
+    def collapse_to_subcircuit(self, gates, name):
+        """Define subcircuit `name` from gates and return the command that
+        replaces them with an instance, or None if nothing would be left"""
+        body, drivers, outputs = self.extract_subcircuit(gates)
+        if not outputs:
+            return None
+        definition = self.module_library().define(name, body)
+        x = sum(node.x() for node in gates) / len(gates)
+        y = sum(node.y() for node in gates) / len(gates)
+        instance = NodeItem(x, y, name, definition)
+
+        commands = [DeleteNodeCommand(self, node) for node in gates]
+        commands.append(AddNodeCommand(self, name, x, y, node=instance))
+        for socket, driver in zip(instance.input_sockets, drivers):
+            commands.append(ConnectCommand(self, ConnectionLine(driver, socket)))
+        for socket, (_, lines) in zip(instance.output_sockets, outputs):
+            for line in lines:
+                commands.append(ConnectCommand(self, ConnectionLine(socket, line.end_socket)))
+        return CompoundCommand(f"Create subcircuit {name}", commands)
+
+    def resize_node(self, node, node_type):
+        """Return the command replacing node with a node_type node in its place.
+
+        Used to change the inputs of a gate or the width of a bus node; the
+        wires whose sockets still exist are moved over.
+        """
+        self.materialize_neighbours(node)
+        replacement = self.create_node(node_type, node.x(), node.y())
+        replacement.value_text = node.value_text
+
+        def moved(socket):
+            if socket.parentItem() is not node:
+                return socket
+            sockets = replacement.input_sockets if socket.is_input else replacement.output_sockets
+            return sockets[socket.index] if socket.index < len(sockets) else None
+
+        commands = [DeleteNodeCommand(self, node),
+                    AddNodeCommand(self, node_type, node.x(), node.y(), node=replacement)]
+        for line in self.connections.node_connections(node):
+            start, end = moved(line.start_socket), moved(line.end_socket)
+            if start is not None and end is not None:
+                commands.append(ConnectCommand(self, ConnectionLine(start, end)))
+        return CompoundCommand(f"Change {node.text} to {node_type}", commands)
+
+    def restore_node(self, node, lines=()):
+        """Put back a node removed by remove_node() along with its lines"""
+        self.addItem(node)
+        for line in lines:
+            self.add_connection(line)
+
+    def remove_nodes(self, nodes):
+        """remove_node() for many nodes in one batch; returns the removed lines"""
+        lines = []
+        with self.bulk_update():
+            for node in nodes:
+                lines.extend(self.remove_node(node))
+        return lines
+
+    def restore_nodes(self, nodes, lines):
+        """Put back nodes removed by remove_nodes() in one batch"""
+        with self.bulk_update():
+            for node in nodes:
+                self.addItem(node)
+            for line in lines:
+                self.add_connection(line)
+
+    def invalidate_netlist(self):
+        """Drop the compiled netlist; it is rebuilt on the next evaluation"""
+        if self._virtualizing:
+            return  # Items of a virtual scene come and go, but the circuit stays
+        self._netlist = None
+        self._simulator = None  # A running clock restarts on the new circuit
+        # A structural edit can change any output, so refresh them all once
+        # the current event is done instead of once per added/removed item
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            QTimer.singleShot(0, self.refresh_outputs)
+
+    def netlist(self):
+        """Return the compiled netlist of this scene, compiling it if needed"""
+        if self._netlist is None:
+            self._netlist = self.compile_netlist()
+            self.show_bus_widths(self._netlist)
+        return self._netlist
+
+    def show_bus_widths(self, netlist):
+        """Draw the wires of buses thicker; widths are only known once compiled"""
+        for key, width in zip(netlist.keys, netlist.widths):
+            if isinstance(key, Socket):
+                socket = key  # Output of a subcircuit or Split
+            else:
+                node = self.key_item(key)
+                if node is None or node.has_ports:
+                    continue
+                socket = node.output_socket
+            if socket.bus_width != width:
+                socket.bus_width = width
+                self.wires.refresh(self.connections.fanout(socket))
+
+    def compile_netlist(self):
+        """Flatten the nodes and their connections into a Netlist"""
+        records = self.circuit_records()
+        # Number nodes top-to-bottom, left-to-right so that Inputs and Outputs
+        # have a stable order (used for truth table columns)
+        records.sort(key=lambda record: (record[3], record[2]))
+        keys = [record[0] for record in records]
+        index = {key: i for i, key in enumerate(keys)}
+        types = [record[1] for record in records]
+        fanin = [None] * len(records)
+
+        # Each output of a subcircuit instance or Split gets its own Port node, keyed
+        # by the output socket, which is what downstream wires start from
+        for node in keys[:len(records)]:
+            if isinstance(node, NodeItem) and node.has_ports:
+                for socket in node.output_sockets:
+                    index[socket] = len(keys)
+                    keys.append(socket)
+                    types.append(port_type(socket.index))
+                    fanin.append([index[node]])
+
+        for i, record in enumerate(records):
+            drivers = []
+            for driver in record[5]:
+                if driver is None:
+                    drivers.append(None)
+                    continue
+                key, socket = driver
+                if isinstance(key, NodeItem) and key.has_ports and socket < len(key.output_sockets):
+                    key = key.output_sockets[socket]
+                drivers.append(index.get(key))
+            fanin[i] = drivers
+        return Netlist(keys, types, fanin, self.module_library())
+
+    def evaluate_netlist(self):
+        """Read every Input field and evaluate the whole circuit once"""
+        netlist = self.netlist()
+        inputs = {i: parse_bit(netlist.keys[i].value_text) for i in netlist.inputs}
+        return netlist.evaluate(inputs)
+
+    def refresh_outputs(self):
+        """Evaluate the whole circuit and update every Output/Write Output field"""
+        self._refresh_pending = False
+        self.request_evaluation()
+
+    def propagate_input(self, input_node):
+        """Push a changed Input value through the circuit"""
+        node = None if self._simulator is None else self._simulator.netlist.index.get(input_node)
+        if node is not None:
+            # Gate delays apply while a simulation is going on
+            self._simulator.set_input(node, parse_bit(input_node.value_text))
+            if not self.simulation_running():
+                self.settle_simulation()
+            return
+        self.request_evaluation()
+
+    def request_evaluation(self):
+        """Evaluate a snapshot of the netlist on the worker thread.
+
+        Only the fanout of the Inputs that changed is re-evaluated.  A job
+        still running for an earlier edit is cancelled, since this one covers
+        that edit too; the result arrives in apply_evaluation().
+        """
+        netlist = self.netlist()
+        inputs = {i: parse_bit(netlist.keys[i].value_text) for i in netlist.inputs}
+        if self.profiler is not None:
+            function, args = profiled_evaluate_job, (netlist.snapshot(), inputs, self.profiler)
+        else:
+            function, args = evaluate_job, (netlist.snapshot(), inputs)
+        self._evaluations.submit(function, args,
+                                 lambda job, result, error: self.evaluation_finished.emit(netlist, result, error))
+
+    def apply_evaluation(self, netlist, snapshot, error):
+        """Show the result of a background evaluation unless it is out of date"""
+        if netlist is not self._netlist or self._simulator is not None:
+            return  # The circuit was edited, or a simulation owns the values now
+        if error is not None:
+            self.show_status(f"Evaluation failed: {error}", 5000)
+            return
+        old, new = netlist.values, snapshot.values
+        nodes = netlist.outputs + netlist.state
+        if netlist.evaluated:
+            nodes = [node for node in nodes if old[node] != new[node]]
+        old[:] = new
+        netlist.evaluated = True
+        for node in nodes:
+            sink = netlist.keys[node].sink
+            if sink:
+                sink.append(new[node], width=netlist.widths[node])
+        self.show_results(netlist, nodes)
+
+    def show_status(self, message, timeout=2000):
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            editor.status_bar.showMessage(message, timeout)
+
+    def shutdown(self):
+        """Stop the clock, any background evaluation, any recording and the journal"""
+        self.stop_simulation()
+        self._evaluations.shutdown()
+        for node in self.recording_nodes():
+            node.stop_recording()
+        self.close_journal()
+
+    def show_results(self, netlist, nodes):
+        """Update the fields of the given Output/Write Output nodes in one batch"""
+        if not nodes:
+            return
+        views = self.views()
+        for view in views:
+            view.setUpdatesEnabled(False)
+        for node in nodes:
+            netlist.keys[node].show_result(netlist)
+        for view in views:
+            view.setUpdatesEnabled(True)
+
+    def simulator(self, create=True):
+        """Return the event simulator of this scene, starting one if needed"""
+        if self._simulator is None and create:
+            netlist = self.netlist()
+            if not netlist.evaluated:
+                self.evaluate_netlist()
+            delays, periods = read_timing(netlist, self.key_value)
+            self._simulator = EventSimulator(netlist, delays, periods)
+            self.trace_labels = self.waveform_labels(netlist)
+            self._simulator.trace(self.trace_labels)
+            for node in netlist.outputs:
+                if netlist.keys[node].sink:
+                    self._simulator.record(node, self.sink_recorder(netlist, node))
+        return self._simulator
+
+    def recording_changed(self, node):
+        """Attach or detach the sink of a Write Output to the running simulation"""
+        if self._simulator is not None:
+            index = self._simulator.netlist.index.get(node)
+            if index is not None:
+                self._simulator.record(index, self.sink_recorder(self._simulator.netlist, index))
+
+    def sink_recorder(self, netlist, node):
+        """The callback(value, time) appending values of a netlist node to the sink of its item"""
+        sink = netlist.keys[node].sink
+        if sink is None:
+            return None
+        width = netlist.widths[node]
+        return lambda value, time: sink.append(value, time, width)
+
+    def recording_nodes(self):
+        return [item for item in self.items() if isinstance(item, NodeItem) and item.sink]
+
+    def waveform_labels(self, netlist):
+        """Name the signals shown as waveforms: Clocks, Inputs, flip-flops and Outputs"""
+        labels = {}
+        counts = {}
+        for node in netlist.clocks + netlist.inputs + netlist.state + netlist.outputs:
+            node_type = netlist.types[node]
+            counts[node_type] = counts.get(node_type, 0) + 1
+            labels[node] = f"{node_type} {counts[node_type]}"
+        return labels
+
+    def timing_changed(self):
+        """A Clock period or delay was edited; restart the simulator, keeping the state"""
+        self._simulator = None
+
+    def start_simulation(self):
+        if self._frame_timer is None:
+            self._frame_timer = QTimer(self)
+            self._frame_timer.timeout.connect(self.simulation_frame)
+        self._last_frame = time.perf_counter()
+        self._pending_ticks = 0.0
+        self._frame_timer.start(self.FRAME_INTERVAL)
+
+    def stop_simulation(self):
+        if self._frame_timer is not None and self._frame_timer.isActive():
+            self._frame_timer.stop()
+            for node in self.recording_nodes():
+                node.sink.flush()
+
+    def simulation_running(self):
+        return self._frame_timer is not None and self._frame_timer.isActive()
+
+    def step_simulation(self):
+        """Advance by one period of the slowest Clock"""
+        simulator = self.simulator()
+        self.advance_simulation(max(simulator.periods.values(), default=DEFAULT_PERIOD), budget=None)
+
+    def reset_simulation(self):
+        """Stop the clock and start over with every flip-flop cleared"""
+        self.stop_simulation()
+        self.invalidate_netlist()
+        self.refresh_outputs()
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            editor.show_waveforms(self)
+
+    def simulation_frame(self):
+        """Simulate the ticks that are due since the last frame, then redraw once"""
+        now = time.perf_counter()
+        self._pending_ticks += (now - self._last_frame) * self.ticks_per_second
+        self._last_frame = now
+        ticks = int(self._pending_ticks)
+        self._pending_ticks -= ticks
+        if ticks:
+            self.advance_simulation(ticks)
+
+    def advance_simulation(self, ticks, budget=FRAME_BUDGET):
+        simulator = self.simulator()
+        end = simulator.time + ticks
+        deadline = None if budget is None else time.perf_counter() + budget
+        try:
+            # Work in slices, so a circuit too slow for the chosen speed
+            # drops ticks instead of freezing the editor
+            while simulator.time < end:
+                simulator.run_until(min(end, simulator.time + self.FRAME_SLICE) - 1)
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+        except OscillationError as error:
+            self.simulation_failed(str(error))
+        self.show_simulation(simulator)
+
+    def settle_simulation(self):
+        simulator = self._simulator
+        try:
+            if not simulator.settle(self.SETTLE_LIMIT):
+                self.simulation_failed(f"Circuit did not settle within {self.SETTLE_LIMIT} ticks")
+        except OscillationError as error:
+            self.simulation_failed(str(error))
+        self.show_simulation(simulator)
+
+    def simulation_failed(self, message):
+        self.stop_simulation()
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            editor.simulation_stopped(self, message)
+
+    def show_simulation(self, simulator):
+        """Show the values changed since the last frame and redraw the waveforms"""
+        netlist = simulator.netlist
+        types = netlist.types
+        self.show_results(netlist, [node for node in simulator.take_changes()
+                                    if types[node] in SINK_TYPES or types[node] in STATE_TYPES])
+        editor = self.parent()
+        if isinstance(editor, NodeEditor):
+            editor.show_waveforms(self)
 
     def dropEvent(self, event):
         text = event.mimeData().text()
         pos = event.scenePos()
         command = AddNodeCommand(self, text, pos.x(), pos.y())
-        self.parent().execute_command(command)
+        self.execute_command(command)
         event.acceptProposedAction()
 
+    def apply_theme(self):
+        """Take the background and grid from the shared RenderResources and repaint once"""
+        resources = RenderResources.shared()
+        self.setBackgroundBrush(resources.background_brush)
+        self.set_grid(grid_color=resources.grid_color)
+
+    def set_grid(self, grid_size=None, grid_color=None):
+        """Change the grid spacing or color and drop the cached grid tiles"""
+        if grid_size is not None:
+            self.grid_size = grid_size
+        if grid_color is not None:
+            self.grid_color = QColor(grid_color)
+        self._grid_brushes.clear()
+        self.update()
+
+    def grid_brush(self, lod):
+        """Return the cached tile brush for a zoom level, or None to skip the grid"""
+        if lod < self.GRID_HIDE_LOD:
+            return None
+        # Zoomed out, minor lines would blur together; keep only every fifth
+        step = self.grid_size if lod >= self.GRID_MINOR_LOD else self.grid_size * self.GRID_MAJOR_EVERY
+        size = self.grid_size * self.GRID_MAJOR_EVERY
+
+        # Tiles are rendered at (roughly) device resolution so lines stay crisp;
+        # zoom is bucketed in quarter octaves to keep the cache small
+        zoom = 2 ** (round(math.log2(lod) * 4) / 4)
+        tile_pixels = max(1, round(size * zoom))
+        key = (step, tile_pixels)
+        brush = self._grid_brushes.get(key)
+        if brush is None:
+            if len(self._grid_brushes) >= self.GRID_CACHE_SIZE:
+                self._grid_brushes.clear()
+            tile = QPixmap(tile_pixels, tile_pixels)
+            tile.fill(Qt.transparent)
+            tile_painter = QPainter(tile)
+            tile_painter.setPen(QPen(self.grid_color, max(1, round(zoom))))
+            for offset in range(0, size, step):
+                pixel = round(offset * tile_pixels / size)
+                tile_painter.drawLine(pixel, 0, pixel, tile_pixels)
+                tile_painter.drawLine(0, pixel, tile_pixels, pixel)
+            tile_painter.end()
+            brush = QBrush(tile)
+            brush.setTransform(QTransform.fromScale(size / tile_pixels, size / tile_pixels))
+            self._grid_brushes[key] = brush
+        return brush
+
+    def set_profiling(self, enabled, overlay=False):
+        """Create or drop the Profiler; the overlay needs whole-viewport repaints"""
+        if not enabled:
+            self.profiler = None
+        elif self.profiler is None:
+            self.profiler = Profiler()
+        self.profile_overlay = enabled and overlay
+        mode = QGraphicsView.FullViewportUpdate if self.profile_overlay else QGraphicsView.MinimalViewportUpdate
+        for view in self.views():
+            view.setViewportUpdateMode(mode)
+        self.update()
+
+    def count_profile_items(self):
+        nodes = sum(1 for item in self.items() if isinstance(item, NodeItem))
+        self.profiler.record_items(nodes=nodes, wires=len(self.connections), items=len(self.items()))
+
+    def node_label(self, key):
+        """Name a netlist key (a NodeItem, model gate or subcircuit output socket) for a trace"""
+        node = self.key_item(key)
+        if node is None:
+            return f"{self.model.type_of(key)} at ({self.model.xs[key]:.0f}, {self.model.ys[key]:.0f})"
+        return f"{node.text} at ({node.x():.0f}, {node.y():.0f})"
+
     def drawBackground(self, painter, rect):
+        if self.profiler is not None:
+            self._paint_start = time.perf_counter()
         super().drawBackground(painter, rect)
 
-        # Draw the grid
-        left = int(rect.left()) - (int(rect.left()) % self.grid_size)
-        top = int(rect.top()) - (int(rect.top()) % self.grid_size)
+        # Draw the grid by tiling a cached pixmap; the brush pattern is anchored
+        # at the scene origin, so lines land on multiples of grid_size
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        brush = self.grid_brush(lod)
+        if brush is not None:
+            painter.fillRect(rect, brush)
+        if self.model is not None:
+            self.draw_model(painter, rect, lod)
+            self.schedule_virtual_update()  # The view may have moved
 
-        lines = []
-        for x in range(left, int(rect.right()), self.grid_size):
-            lines.append(QLineF(x, rect.top(), x, rect.bottom()))
-        for y in range(top, int(rect.bottom()), self.grid_size):
-            lines.append(QLineF(rect.left(), y, rect.right(), y))
+    def drawForeground(self, painter, rect):
+        # Called after the items, so this times the whole repaint
+        if self.profiler is None or self._paint_start is None:
+            return
+        self.profiler.record_paint(self._paint_start, time.perf_counter() - self._paint_start,
+                                   {"width": rect.width(), "height": rect.height()})
+        self._paint_start = None
+        if self.profile_overlay:
+            self.draw_profile(painter)
 
-        painter.setPen(QPen(self.grid_color, 1))
-        painter.drawLines(lines)
+    def draw_profile(self, painter):
+        """Outline the most evaluated nodes and list the profile in the corner"""
+        hot = self.profiler.hot_nodes(self.HOT_NODES)
+        painter.save()
+        painter.setPen(QPen(QColor(255, 120, 0), 2))
+        painter.setBrush(Qt.NoBrush)
+        for key, count in hot:
+            node = self.key_item(key)
+            if node is not None and node.scene() is self:
+                box = node.sceneBoundingRect()
+                painter.drawRect(box)
+                painter.drawText(box.topLeft() + QPointF(0, -4), f"{count}x")
+
+        # The readout stays in the top left corner of the view, whatever the zoom
+        painter.resetTransform()
+        lines = self.profiler.summary().split(", ")
+        lines += [f"{count}x {self.node_label(key)}" for key, count in hot[:3]]
+        metrics = painter.fontMetrics()
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 16
+        height = metrics.height() * len(lines) + 12
+        painter.fillRect(QRectF(8, 8, width, height), QColor(0, 0, 0, 170))
+        painter.setPen(Qt.white)
+        for i, line in enumerate(lines):
+            painter.drawText(QPointF(16, 14 + metrics.ascent() + i * metrics.height()), line)
+        painter.restore()
     
     def dragEnterEvent(self, event):
         if event.mimeData().hasText():
@@ -569,18 +2399,35 @@ class NodeGraphicsScene(QGraphicsScene):
         if event.mimeData().hasText():
             event.acceptProposedAction()
     
-    def dropEvent(self, event):
-        text = event.mimeData().text()
-        pos = event.scenePos()
-        node = NodeItem(pos.x(), pos.y(), text)
-        self.addItem(node)
-        event.acceptProposedAction()
+    def mousePressEvent(self, event):
+        super().mousePressEvent(event)
+        # Remember where the selection started so a drag becomes one command
+        self._move_start = {item: item.pos() for item in self.selectedItems() if isinstance(item, NodeItem)}
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        moves = {
+            node: (start, node.pos())
+            for node, start in self._move_start.items()
+            if node.scene() is self and node.pos() != start
+        }
+        self._move_start = {}
+        if moves:
+            self.execute_command(MoveNodesCommand(self, moves))
 
 class NodeList(QListWidget):
+    BUILTIN_NODES = ["Input", "Output", "AND", "OR", "NOT", "NAND", "NOR", "XOR", "XNOR","Write Output",
+                     "Clock", "D Flip-Flop", "D Latch", "Merge 8", "Split 8"]
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.addItems(["Input", "Output", "AND", "OR", "NOT", "NAND", "NOR", "XOR", "XNOR","Write Output"])
+        self.addItems(self.BUILTIN_NODES)
         self.setDragEnabled(True)
+
+    def add_module(self, name):
+        """Offer a subcircuit in the palette (once)"""
+        if not self.findItems(name, Qt.MatchExactly):
+            self.addItem(name)
     
     def startDrag(self, supportedActions):
         item = self.currentItem()
@@ -592,9 +2439,128 @@ class NodeList(QListWidget):
         drag.setMimeData(mime_data)
         drag.exec_(Qt.MoveAction)
         
+class WaveformView(QWidget):
+    """Recent transitions of the traced signals, newest on the right"""
+    ROW_HEIGHT = 24
+    LABEL_WIDTH = 110
+    TICK_WIDTH = 4  # Pixels per simulation tick
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.simulator = None
+        self.labels = {}
+        self.setMinimumHeight(3 * self.ROW_HEIGHT)
+
+    def show_simulation(self, simulator, labels):
+        self.simulator = simulator
+        self.labels = labels
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        if self.simulator is None:
+            return
+        width = self.width()
+        start = self.simulator.time - (width - self.LABEL_WIDTH) // self.TICK_WIDTH
+        for row, (node, label) in enumerate(self.labels.items()):
+            top = row * self.ROW_HEIGHT
+            if top > self.height():
+                break
+            high, low = top + 5, top + self.ROW_HEIGHT - 5
+            painter.setPen(QPen(Qt.black))
+            painter.drawText(4, low, label)
+            painter.setPen(QPen(QColor(0, 140, 0)))
+            # Walk back from the newest transition to the left edge
+            right = width
+            later_y = None
+            for changed_at, value in reversed(self.simulator.traces.get(node, ())):
+                x = self.LABEL_WIDTH + max(0, changed_at - start) * self.TICK_WIDTH
+                y = (high + low) // 2 if value is None else high if value else low
+                painter.drawLine(x, y, right, y)
+                if later_y is not None:
+                    painter.drawLine(right, y, right, later_y)
+                right, later_y = x, y
+                if changed_at <= start:
+                    break
+
+class UndoStack:
+    """Bounded undo/redo history.
+
+    Keeps at most max_depth commands and roughly max_bytes of state (as
+    reported by Command.size()); the oldest commands are dropped first.
+    Consecutive commands that can be merged (see Command.merge) share a
+    single entry.
+    """
+
+    def __init__(self, max_depth=200, max_bytes=32 * 1024 * 1024):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.done = []
+        self.undone = []
+        self.bytes_used = 0
+
+    def __len__(self):
+        return len(self.done)
+
+    def push(self, command):
+        """Record a command that has already been executed"""
+        self._discard(self.undone)
+        self.undone = []
+        if self.done and self.done[-1].merge(command):
+            top = self.done[-1]
+            self.bytes_used += top.size() - top.accounted_size
+            top.accounted_size = top.size()
+        else:
+            command.accounted_size = command.size()
+            self.done.append(command)
+            self.bytes_used += command.accounted_size
+        self._trim()
+
+    def undo(self):
+        """Undo the newest command and return it, or None if there is nothing to undo"""
+        if not self.done:
+            return None
+        command = self.done.pop()
+        command.undo()
+        self.undone.append(command)
+        return command
+
+    def redo(self):
+        """Redo the last undone command and return it, or None"""
+        if not self.undone:
+            return None
+        command = self.undone.pop()
+        command.redo()
+        self.done.append(command)
+        return command
+
+    def clear(self):
+        self._discard(self.done)
+        self._discard(self.undone)
+        self.done = []
+        self.undone = []
+
+    def _trim(self):
+        while self.done and (len(self.done) > self.max_depth or
+                             (self.bytes_used > self.max_bytes and len(self.done) > 1)):
+            self._discard([self.done.pop(0)])
+
+    def _discard(self, commands):
+        for command in commands:
+            self.bytes_used -= command.accounted_size
+            command.discard()
+
 class Command:
+    MERGE_WINDOW = 1.5  # Seconds within which mergeable commands combine
+    BASE_BYTES = 256  # Rough cost of a command with no items attached
+    NODE_BYTES = 4096  # Rough cost of keeping a NodeItem and its sockets alive
+    CONNECTION_BYTES = 512
+
     def __init__(self, description):
         self.description = description
+        self.timestamp = time.monotonic()
+        self.accounted_size = 0
 
     def execute(self):
         pass
@@ -602,29 +2568,167 @@ class Command:
     def undo(self):
         pass
 
+    def redo(self):
+        self.execute()
+
+    def merge(self, other):
+        """Absorb a newer command into this one; return True if it was merged"""
+        return False
+
+    def size(self):
+        """Approximate number of bytes this command keeps alive"""
+        return self.BASE_BYTES
+
+    def discard(self):
+        """Drop references once the command can no longer be undone or redone"""
+
     def __str__(self):
         return self.description
+
+class CompoundCommand(Command):
+    """Several commands executed and undone as one step"""
+
+    def __init__(self, description, commands):
+        super().__init__(description)
+        self.commands = list(commands)
+
+    def execute(self):
+        for command in self.commands:
+            command.execute()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def size(self):
+        return self.BASE_BYTES + sum(command.size() for command in self.commands)
+
+    def discard(self):
+        for command in self.commands:
+            command.discard()
+        self.commands = []
+
+class MoveNodesCommand(Command):
+    def __init__(self, scene, moves):
+        super().__init__(f"Move {len(moves)} node{'s' if len(moves) != 1 else ''}")
+        self.scene = scene
+        self.moves = dict(moves)  # NodeItem -> (old position, new position)
+
+    def execute(self):
+        for node, (_, new_pos) in self.moves.items():
+            node.setPos(new_pos)
+
+    def undo(self):
+        for node, (old_pos, _) in self.moves.items():
+            node.setPos(old_pos)
+
+    def merge(self, other):
+        # Repeated drags of the same selection in quick succession are one move
+        if (not isinstance(other, MoveNodesCommand) or other.moves.keys() != self.moves.keys()
+                or other.timestamp - self.timestamp > self.MERGE_WINDOW):
+            return False
+        for node, (_, new_pos) in other.moves.items():
+            self.moves[node] = (self.moves[node][0], new_pos)
+        self.timestamp = other.timestamp
+        return True
+
+    def size(self):
+        return self.BASE_BYTES + 64 * len(self.moves)
+
+    def discard(self):
+        self.moves = {}
+
+class SetInputValueCommand(Command):
+    def __init__(self, node, old_text, new_text):
+        super().__init__(f"Edit {node.text} value")
+        self.node = node
+        self.old_text = old_text
+        self.new_text = new_text
+
+    def execute(self):
+        self.node.set_value_text(self.new_text)
+
+    def undo(self):
+        self.node.set_value_text(self.old_text)
+
+    def merge(self, other):
+        # Typing into a field is one edit, not one per keystroke
+        if (not isinstance(other, SetInputValueCommand) or other.node is not self.node
+                or other.timestamp - self.timestamp > self.MERGE_WINDOW):
+            return False
+        self.new_text = other.new_text
+        self.timestamp = other.timestamp
+        return True
+
+    def discard(self):
+        self.node = None
     
 class AddNodeCommand(Command):
-    def __init__(self, scene, node_type, pos_x, pos_y):
+    def __init__(self, scene, node_type, pos_x, pos_y, node=None):
         super().__init__(f"Add {node_type} node")
         self.scene = scene
         self.node_type = node_type
         self.pos_x = pos_x
         self.pos_y = pos_y
-        self.node = None
+        self.node = node
+
+        self.connections = []
 
     def execute(self):
-        self.node = NodeItem(self.pos_x, self.pos_y, self.node_type)
-        self.scene.addItem(self.node)
+        # Redo puts back the same node so later commands still refer to it
+        if self.node is None:
+            self.node = self.scene.create_node(self.node_type, self.pos_x, self.pos_y)
+        self.scene.restore_node(self.node, self.connections)
 
     def undo(self):
         if self.node:
-            self.scene.removeItem(self.node)
+            self.connections = self.scene.remove_node(self.node)
 
     def redo(self):
         self.execute()
 
+    def size(self):
+        return self.BASE_BYTES + self.NODE_BYTES + self.CONNECTION_BYTES * len(self.connections)
+
+    def discard(self):
+        self.node = None
+        self.connections = []
+
+class PasteCommand(Command):
+    """Adds a copied subgraph in one batch; undo removes it again in one batch"""
+
+    def __init__(self, scene, circuit):
+        super().__init__(f"Paste {len(circuit)} node{'s' if len(circuit) != 1 else ''}")
+        self.scene = scene
+        self.circuit = circuit
+        self.nodes = None  # Created on the first execute, then reused by redo
+        self.connections = []
+
+    def execute(self):
+        if self.nodes is None:
+            self.nodes = self.scene.load_circuit(self.circuit)
+            self.circuit = None
+        else:
+            self.scene.restore_nodes(self.nodes, self.connections)
+
+    def undo(self):
+        self.connections = self.scene.remove_nodes(self.nodes)
+
+    def redo(self):
+        self.execute()
+
+    def size(self):
+        return (self.BASE_BYTES + self.NODE_BYTES * len(self.nodes or ())
+                + self.CONNECTION_BYTES * len(self.connections))
+
+    def discard(self):
+        self.nodes = []
+        self.connections = []
+
 class DeleteNodeCommand(Command):
     def __init__(self, scene, node):
         super().__init__(f"Delete {node.text} node")
@@ -633,45 +2737,55 @@ class DeleteNodeCommand(Command):
         self.connections = []
 
     def execute(self):
-        # Store connections for undo
-        for socket in self.node.input_sockets:
-            if socket.connection:
-                self.connections.append({
-                    'connection': socket.connection,
-                    'start_socket': socket.connection.start_socket,
-                    'end_socket': socket.connection.end_socket
-                })
-                self.scene.removeItem(socket.connection)
-                socket.connection = None
-
-        if self.node.output_socket and self.node.output_socket.connection:
-            self.connections.append({
-                'connection': self.node.output_socket.connection,
-                'start_socket': self.node.output_socket.connection.start_socket,
-                'end_socket': self.node.output_socket.connection.end_socket
-            })
-            self.scene.removeItem(self.node.output_socket.connection)
-            self.node.output_socket.connection = None
-
-        # Remove the node
-        self.scene.removeItem(self.node)
+        # Keep the removed lines so undo can reconnect them
+        self.connections = self.scene.remove_node(self.node)
 
     def undo(self):
-        # Restore the node
-        self.scene.addItem(self.node)
-
-        # Restore connections
-        for conn in self.connections:
-            conn['connection'].start_socket = conn['start_socket']
-            conn['connection'].end_socket = conn['end_socket']
-            self.scene.addItem(conn['connection'])
+        self.scene.restore_node(self.node, self.connections)
 
     def redo(self):
         # Re-execute the deletion
         self.execute()
 
+    def size(self):
+        return self.BASE_BYTES + self.NODE_BYTES + self.CONNECTION_BYTES * len(self.connections)
+
+    def discard(self):
+        self.node = None
+        self.connections = []
+
+class ConnectCommand(Command):
+    def __init__(self, scene, line):
+        super().__init__("Connect sockets")
+        self.scene = scene
+        self.line = line
+        self.replaced = None
+
+    def execute(self):
+        # An input socket has a single driver, so connecting replaces it
+        self.scene.materialize_driver(self.line.end_socket)
+        self.replaced = self.scene.connections.driver(self.line.end_socket)
+        if self.replaced is not None:
+            self.scene.remove_connection(self.replaced)
+        self.scene.add_connection(self.line)
+
+    def undo(self):
+        self.scene.remove_connection(self.line)
+        if self.replaced is not None:
+            self.scene.add_connection(self.replaced)
+
+    def redo(self):
+        self.execute()
+
+    def size(self):
+        return self.BASE_BYTES + self.CONNECTION_BYTES * (2 if self.replaced else 1)
+
+    def discard(self):
+        self.line = self.replaced = None
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = NodeEditor()
+    window = NodeEditor(autosave_dir=AUTOSAVE_DIR)
+    window.recover_autosaved()
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""Streaming files for Write Output nodes.
+
+A sink keeps its file open and collects records in memory, writing them in
+one call whenever DEFAULT_BUFFER_SIZE bytes have built up (and on flush() or
+close()), so recording a million cycles costs a few hundred writes rather than
+a million open/write/close calls.  Files are opened for appending, so several
+runs can be recorded into one file.  Three formats are supported:
+
+* text   -- one value per line ("0", "1" or "-" when undefined, and buses
+            in hexadecimal padded to their width, such as "0x2A" or "0x01");
+* csv    -- "time,value" rows, where time is the simulation tick when known
+            and otherwise the number of the record;
+* binary -- one bit per value, packed eight to a byte with the first value
+            in the lowest bit; undefined values are stored as 0 and the last
+            byte of a recording is padded with zeros.  Only the lowest bit
+            of a bus is kept.
+"""
+
+import os
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+FORMAT_EXTENSIONS = {"text": ".txt", "csv": ".csv", "binary": ".bin"}
+FILE_FILTER = "Text Files (*.txt);;CSV Files (*.csv);;Packed Binary (*.bin)"
+
+
+def format_for(file_name, default="text"):
+    """Pick the sink format from a file name's extension"""
+    extension = os.path.splitext(file_name)[1].lower()
+    for name, known in FORMAT_EXTENSIONS.items():
+        if extension == known:
+            return name
+    return default
+
+
+class OutputSink:
+    """Buffered, append-only recording of one signal"""
+
+    def __init__(self, file_name, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.count = 0  # Values recorded so far
+        self._file = open(file_name, "ab")
+        self._pending = []
+        self._pending_size = 0
+
+    def append(self, value, time=None, width=1):
+        """Record one value (0, 1, a bus word or None) of a width-bit signal at a simulation time"""
+        time = self.count if time is None else time
+        if value is None or width <= 1:
+            self.append_bits("-" if value is None else str(value), time)
+        else:
+            self._write(self._encode_word(value, time, width))
+            self.count += 1
+
+    def _encode_word(self, value, time, width):
+        raise NotImplementedError
+
+    def append_bits(self, bits, first_time=None):
+        """Record a string of "0"/"1"/"-" values at consecutive times"""
+        if not bits:
+            return
+        first_time = self.count if first_time is None else first_time
+        self._write(self._encode(bits, first_time))
+        self.count += len(bits)
+
+    def _encode(self, bits, first_time):
+        raise NotImplementedError
+
+    def _write(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+            if self._pending_size >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        """Write everything buffered so far to the file"""
+        if self._pending:
+            self._file.write(b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TextSink(OutputSink):
+    def _encode(self, bits, first_time):
+        return ("\n".join(bits) + "\n").encode("ascii")
+
+    def _encode_word(self, value, time, width):
+        return f"0x{value:0{(width + 3) // 4}X}\n".encode("ascii")
+
+
+class CsvSink(OutputSink):
+    def __init__(self, file_name, buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(file_name, buffer_size)
+        if self._file.tell() == 0:
+            self._write(b"time,value\n")
+
+    def _encode(self, bits, first_time):
+        return "".join(f"{time},{bit}\n" for time, bit in enumerate(bits, first_time)).encode("ascii")
+
+    def _encode_word(self, value, time, width):
+        return f"{time},0x{value:0{(width + 3) // 4}X}\n".encode("ascii")
+
+
+class BinarySink(OutputSink):
+    def __init__(self, file_name, buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(file_name, buffer_size)
+        self._bits = 0  # Values not yet making up a whole byte, first in bit 0
+        self._bit_count = 0
+
+    def _encode(self, bits, first_time):
+        # Reversed, the first value becomes the lowest bit of the number
+        word = int(bits.replace("-", "0")[::-1], 2)
+        self._bits |= word << self._bit_count
+        self._bit_count += len(bits)
+        whole = self._bit_count // 8
+        data = (self._bits & ((1 << (8 * whole)) - 1)).to_bytes(whole, "little")
+        self._bits >>= 8 * whole
+        self._bit_count -= 8 * whole
+        return data
+
+    def _encode_word(self, value, time, width):
+        return self._encode(str(value & 1), time)
+
+    def close(self):
+        if not self._file.closed and self._bit_count:
+            self._write(self._bits.to_bytes(1, "little"))
+            self._bits = self._bit_count = 0
+        super().close()
+
+
+_SINKS = {"text": TextSink, "csv": CsvSink, "binary": BinarySink}
+
+
+def open_sink(file_name, sink_format=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Open a sink; the format defaults to the one matching the file extension"""
+    sink_format = sink_format or format_for(file_name)
+    if sink_format not in _SINKS:
+        raise ValueError(f"Unknown output format {sink_format}")
+    return _SINKS[sink_format](file_name, buffer_size)
@@ -0,0 +1,125 @@
+"""Counters and timings for finding slow spots in a circuit.
+
+A Profiler collects how often each node was evaluated, how long every
+evaluation and repaint took and how many items the scene holds.  The editor
+only creates one while profiling is switched on; with it off nothing is
+recorded and the evaluators run unchanged, because which nodes an evaluation
+visited is worked out afterwards from what it returned (see
+evaluated_nodes).
+
+Events can be exported with write_trace() in the Trace Event format, which
+chrome://tracing and https://ui.perfetto.dev open directly.
+"""
+
+import json
+import threading
+import time
+from collections import Counter, deque
+
+TRACE_LIMIT = 10000  # Events kept for export; older ones are dropped
+
+
+def evaluated_nodes(netlist, changed, full=False):
+    """The nodes an evaluation computed, given the nodes propagate() changed.
+
+    propagate() visits each gate driven by a changed node exactly once (in
+    topological order, a gate cannot be scheduled again after it has been
+    computed), so the gates it evaluated are the fanout of what changed.  A
+    full evaluation computes every gate.
+    """
+    ops = netlist.ops
+    if full:
+        return [node for node in netlist.order if ops[node] is not None]
+    rank = netlist.rank
+    fanout = netlist.fanout
+    seen = set()
+    for node in changed:
+        for sink in fanout[node]:
+            if ops[sink] is not None and rank[sink] is not None:
+                seen.add(sink)
+    return list(seen)
+
+
+class Profiler:
+    """Thread-safe; evaluations are recorded from the worker thread"""
+
+    def __init__(self, trace_limit=TRACE_LIMIT):
+        self._lock = threading.Lock()
+        self.events = deque(maxlen=trace_limit)  # (name, start, seconds, details)
+        self._clear()
+
+    def _clear(self):
+        self.origin = time.perf_counter()  # Trace timestamps count from here
+        self.evaluations = Counter()  # Netlist key -> times evaluated
+        self.events.clear()
+        self.propagations = 0
+        self.propagation_time = 0.0
+        self.last_propagation = None  # (seconds, nodes evaluated)
+        self.paints = 0
+        self.paint_time = 0.0
+        self.last_paint = None
+        self.items = {}  # Item kind -> count, see record_items
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def record_evaluation(self, netlist, changed, full, start, seconds):
+        """Count the nodes of one evaluate()/propagate() call that began at start"""
+        nodes = evaluated_nodes(netlist, changed, full)
+        keys = netlist.keys
+        with self._lock:
+            self.evaluations.update(keys[node] for node in nodes)
+            self.propagations += 1
+            self.propagation_time += seconds
+            self.last_propagation = (seconds, len(nodes))
+            self.events.append(("evaluate" if full else "propagate", start, seconds,
+                                {"evaluated": len(nodes), "changed": len(changed)}))
+
+    def record_paint(self, start, seconds, details=None):
+        with self._lock:
+            self.paints += 1
+            self.paint_time += seconds
+            self.last_paint = seconds
+            self.events.append(("paint", start, seconds, details or {}))
+
+    def record_items(self, **counts):
+        with self._lock:
+            self.items = counts
+
+    def hot_nodes(self, count=10):
+        """The `count` most evaluated keys, as (key, evaluations) pairs"""
+        with self._lock:
+            return self.evaluations.most_common(count)
+
+    def summary(self):
+        """One line for the status bar"""
+        with self._lock:
+            parts = [f"{self.propagations} evaluations"]
+            if self.last_propagation:
+                seconds, nodes = self.last_propagation
+                parts.append(f"last {seconds * 1000:.1f} ms / {nodes} nodes")
+            if self.paints:
+                parts.append(f"paint {self.last_paint * 1000:.1f} ms "
+                             f"(avg {self.paint_time / self.paints * 1000:.1f})")
+            parts.extend(f"{count} {kind}" for kind, count in self.items.items())
+        return "Profile: " + ", ".join(parts)
+
+    def write_trace(self, stream, label=str):
+        """Write the recorded events and node counts as Trace Event JSON.
+
+        label turns a netlist key into the name shown for that node.
+        """
+        with self._lock:
+            events = list(self.events)
+            counts = self.evaluations.most_common()
+            origin = self.origin
+        trace = [{"name": name, "ph": "X", "pid": 1, "tid": 1 if name == "paint" else 2,
+                  "ts": (start - origin) * 1e6, "dur": seconds * 1e6, "args": details}
+                 for name, start, seconds, details in events]
+        trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "GUI"}})
+        trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": {"name": "evaluation"}})
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms",
+                   "otherData": {"evaluations": [{"node": label(key), "count": count}
+                                                 for key, count in counts]}},
+                  stream)
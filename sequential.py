@@ -0,0 +1,475 @@
+"""Sequential logic and timed simulation of a Netlist.
+
+Flip-flops, latches and Clock nodes give a circuit state, so its outputs
+depend on time as well as on the Inputs.  Two simulators are provided:
+
+* EventSimulator -- event-driven, with a delay in ticks for every node.  Value
+  changes are queued on a TimingWheel and at each tick only the nodes driven
+  by a changed signal are evaluated, so quiet parts of the circuit cost
+  nothing.  Feedback loops (such as cross-coupled NOR gates) switch as they
+  would in hardware, and loops that oscillate without any delay are detected.
+* CycleSimulator -- zero-delay, one step per clock cycle.  For synchronous
+  circuits (every flip-flop clocked straight from a Clock node) the logic is
+  compiled into a single Python function, which is the fastest way to run
+  many cycles headlessly.
+
+run_cycles() picks the fastest simulator that can handle a netlist.
+"""
+
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
+
+from netlist import CLOCK_TYPES, SINK_TYPES
+
+DEFAULT_DELAY = 1  # Ticks from a change at a gate's inputs to its output
+DEFAULT_PERIOD = 10  # Ticks per Clock cycle
+MIN_PERIOD = 2
+WHEEL_SIZE = 256  # Ticks covered by the wheel; later events wait in a heap
+DELTA_LIMIT = 10000  # Zero-delay re-evaluations allowed within one tick
+TRACE_LIMIT = 4096  # Transitions kept per traced node
+
+
+class OscillationError(RuntimeError):
+    """Raised when a zero-delay feedback loop keeps switching within one tick"""
+
+
+def node_delay(node_type):
+    """Default delay of a node type; Outputs and Ports only pass a value on"""
+    if node_type in SINK_TYPES or node_type.startswith("Port "):
+        return 0
+    return DEFAULT_DELAY
+
+
+def parse_ticks(text, default, minimum=0):
+    """Read a delay or period typed into a node; default if empty or invalid"""
+    try:
+        ticks = int(text.strip())
+    except ValueError:
+        return default
+    return ticks if ticks >= minimum else default
+
+
+def read_timing(netlist, value_of):
+    """Collect (delays, periods) from the value text saved with each node.
+
+    value_of(key) returns the text of the node compiled from key.  A Clock's
+    text is its period and a gate's text, if any, overrides its delay.
+    """
+    delays = {}
+    periods = {}
+    for node, (key, node_type) in enumerate(zip(netlist.keys, netlist.types)):
+        if node_type in CLOCK_TYPES:
+            periods[node] = parse_ticks(value_of(key), DEFAULT_PERIOD, MIN_PERIOD)
+        elif netlist.ops[node] is not None or node in netlist.state:
+            text = value_of(key)
+            if text:
+                delays[node] = parse_ticks(text, node_delay(node_type))
+    return delays, periods
+
+
+def feedback_loops(netlist):
+    """Group the nodes on combinational loops into loops (strongly connected sets)"""
+    cyclic = set(netlist.cyclic)
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    loops = []
+    counter = count()
+    # Iterative Tarjan, restricted to the nodes Kahn's algorithm could not place
+    for root in netlist.cyclic:
+        if root in index:
+            continue
+        work = [(root, iter(netlist.fanout[root]))]
+        index[root] = low[root] = next(counter)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, sinks = work[-1]
+            for sink in sinks:
+                if sink not in cyclic:
+                    continue
+                if sink not in index:
+                    index[sink] = low[sink] = next(counter)
+                    stack.append(sink)
+                    on_stack.add(sink)
+                    work.append((sink, iter(netlist.fanout[sink])))
+                    break
+                if sink in on_stack:
+                    low[node] = min(low[node], index[sink])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    loop = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        loop.append(member)
+                        if member == node:
+                            break
+                    # A single node is only a loop if it drives itself
+                    if len(loop) > 1 or node in netlist.fanout[node]:
+                        loops.append(sorted(loop))
+    return loops
+
+
+class TimingWheel:
+    """Event queue bucketed by tick.
+
+    Events less than `size` ticks ahead go into a ring of slots, so scheduling
+    and popping cost O(1) no matter how many events are queued; events further
+    ahead wait in a heap until the wheel comes round to them.
+    """
+
+    def __init__(self, size=WHEEL_SIZE):
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+        self.now = 0  # Earliest tick that may still have events
+        self.count = 0  # Events in the slots
+        self.overflow = []  # Heap of (time, sequence, node, value)
+        self._sequence = count()
+
+    def __len__(self):
+        return self.count + len(self.overflow)
+
+    def schedule(self, time, node, value):
+        """Queue node to take value at time (which must not be in the past)"""
+        if time < self.now + self.size:
+            self.slots[time % self.size].append((node, value))
+            self.count += 1
+        else:
+            heappush(self.overflow, (time, next(self._sequence), node, value))
+
+    def _refill(self):
+        overflow = self.overflow
+        limit = self.now + self.size
+        while overflow and overflow[0][0] < limit:
+            time, _, node, value = heappop(overflow)
+            self.slots[time % self.size].append((node, value))
+            self.count += 1
+
+    def pop(self, until):
+        """Return (time, events) for the earliest tick up to `until` with events.
+
+        Returns None, with the wheel moved to until + 1, once there are none.
+        Events scheduled for the tick just popped are returned by the next call.
+        """
+        while self.now <= until:
+            if not self.count:
+                if not self.overflow or self.overflow[0][0] > until:
+                    break
+                self.now = self.overflow[0][0]  # Skip the empty stretch
+                self._refill()
+            slot = self.now % self.size
+            events = self.slots[slot]
+            if events:
+                self.slots[slot] = []
+                self.count -= len(events)
+                return self.now, events
+            self.now += 1
+            self._refill()
+        self.now = max(self.now, until + 1)
+        self._refill()
+        return None
+
+
+class EventSimulator:
+    """Event-driven simulation with per-node delays.
+
+    The simulator shares netlist.values, so whoever displays the netlist sees
+    the simulated values.  delays maps node indices to ticks (node_delay() by
+    default) and periods maps Clock nodes to their period in ticks.  Each Clock
+    starts low and rises half way through every period.
+    """
+
+    def __init__(self, netlist, delays=None, periods=None, wheel_size=WHEEL_SIZE):
+        self.netlist = netlist
+        self.delays = [node_delay(t) for t in netlist.types]
+        for node, delay in (delays or {}).items():
+            self.delays[node] = delay
+        periods = periods or {}
+        self.periods = {clock: max(MIN_PERIOD, periods.get(clock, DEFAULT_PERIOD)) for clock in netlist.clocks}
+        self.wheel = TimingWheel(wheel_size)
+        self.pending = 0  # Queued events that are not clock edges
+        self.changed = {}  # Nodes changed since take_changes(), in order
+        self.traces = {}  # Node -> deque of (time, value), see trace()
+        self.recorders = {}  # Node -> callback(value, time), see record()
+        self.loops = feedback_loops(netlist)
+        self._flip_flops = {node for node in netlist.state if netlist.types[node] == "D Flip-Flop"}
+        self._latches = {node for node in netlist.state if netlist.types[node] == "D Latch"}
+
+        if not netlist.evaluated:
+            netlist.evaluate()
+        values = self.values = netlist.values
+        self.projected = list(values)  # What each node will be once its queued events apply
+        self.last_clock = {node: self._clock_of(node) for node in self._flip_flops}
+
+        # Loops start at 0 rather than undefined so that latches built from
+        # gates can settle; evaluate them once to get them going
+        for node in netlist.cyclic:
+            if netlist.ops[node] is not None:
+                values[node] = self.projected[node] = 0
+        for node in netlist.cyclic:
+            if netlist.ops[node] is not None:
+                self._update(node, 0)
+        for clock, period in self.periods.items():
+            self.wheel.schedule(period // 2, clock, 1)
+
+    @property
+    def time(self):
+        """The next tick to be simulated"""
+        return self.wheel.now
+
+    def _clock_of(self, node):
+        clock = self.netlist.fanin[node][1]
+        return None if clock is None else self.values[clock]
+
+    def _next_value(self, node):
+        """The value node should change to, given the current values"""
+        netlist = self.netlist
+        values = self.values
+        if node in self._flip_flops:
+            clock = self._clock_of(node)
+            previous = self.last_clock[node]
+            self.last_clock[node] = clock
+            if previous == 0 and clock == 1:
+                data = netlist.fanin[node][0]
+                return None if data is None else values[data]
+            return self.projected[node]
+        if node in self._latches:
+            data, enable = netlist.fanin[node]
+            if enable is not None and values[enable] == 1:
+                return None if data is None else values[data]
+            return self.projected[node]
+        return netlist._evaluate_node(node, values)
+
+    def _update(self, node, time):
+        """Re-evaluate node and queue its new value after its delay"""
+        value = self._next_value(node)
+        if value != self.projected[node]:
+            self.projected[node] = value
+            self.pending += 1
+            self.wheel.schedule(time + self.delays[node], node, value)
+
+    def set_input(self, node, value):
+        """Change an Input at the current time"""
+        if value != self.projected[node]:
+            self.projected[node] = value
+            self.pending += 1
+            self.wheel.schedule(self.wheel.now, node, value)
+
+    def trace(self, nodes, limit=TRACE_LIMIT):
+        """Record the transitions of nodes (keeping the latest `limit` of each)"""
+        for node in nodes:
+            if node not in self.traces:
+                self.traces[node] = deque([(self.wheel.now, self.values[node])], maxlen=limit)
+
+    def record(self, node, callback):
+        """Call callback(value, time) on every transition of node (None stops)"""
+        if callback is None:
+            self.recorders.pop(node, None)
+        else:
+            callback(self.values[node], self.wheel.now)
+            self.recorders[node] = callback
+
+    def take_changes(self):
+        """Return the nodes whose value changed since the last call"""
+        changed = list(self.changed)
+        self.changed.clear()
+        return changed
+
+    def run_until(self, until):
+        """Simulate every tick up to and including `until`"""
+        wheel = self.wheel
+        values = self.values
+        fanout = self.netlist.fanout
+        periods = self.periods
+        traces = self.traces
+        recorders = self.recorders
+        changed = self.changed
+        last_time = None
+        deltas = 0
+        while True:
+            step = wheel.pop(until)
+            if step is None:
+                return
+            time, events = step
+            if time == last_time:
+                deltas += 1
+                if deltas > DELTA_LIMIT:
+                    raise OscillationError(f"Circuit is still switching after {DELTA_LIMIT} "
+                                           f"zero-delay steps at tick {time}")
+            else:
+                last_time = time
+                deltas = 0
+
+            touched = {}
+            for node, value in events:
+                if node in periods:
+                    # A Clock edge schedules the next one
+                    period = periods[node]
+                    self.projected[node] = value
+                    wheel.schedule(time + (period - period // 2 if value else period // 2), node, 1 - value)
+                else:
+                    self.pending -= 1
+                if values[node] == value:
+                    continue
+                values[node] = value
+                changed[node] = None
+                if node in traces:
+                    traces[node].append((time, value))
+                if node in recorders:
+                    recorders[node](value, time)
+                for sink in fanout[node]:
+                    touched[sink] = None
+            for node in touched:
+                self._update(node, time)
+
+    def run_for(self, ticks):
+        """Simulate the next `ticks` ticks"""
+        self.run_until(self.wheel.now + ticks - 1)
+
+    def settle(self, limit=100000):
+        """Simulate until no gate has a change queued; False if still switching after limit ticks.
+
+        Clocks keep running meanwhile, so with clocked logic this only returns
+        early between edges.
+        """
+        end = self.wheel.now + limit
+        while self.pending:
+            if self.wheel.now > end:
+                return False
+            self.run_until(self.wheel.now)
+        return True
+
+
+# Python expressions for the single-bit gates of a compiled cycle function;
+# operands are 0 or 1, so NOT is a XOR with 1
+_EXPRESSIONS = {
+    "AND": "{0} & {1}",
+    "OR": "{0} | {1}",
+    "XOR": "{0} ^ {1}",
+    "NAND": "({0} & {1}) ^ 1",
+    "NOR": "({0} | {1}) ^ 1",
+    "XNOR": "{0} ^ {1} ^ 1",
+    "NOT": "{0} ^ 1",
+    "Output": "{0}",
+    "Write Output": "{0}",
+    "Constant 0": "0",
+    "Constant 1": "1",
+}
+
+
+def _compile(netlist):
+    """Generate (capture, settle) functions working on a list of values.
+
+    capture() copies every flip-flop's D value to its output at once, as a
+    clock edge does; settle() evaluates the logic in topological order.
+    """
+    lines = ["def capture(v):"]
+    # A flip-flop without a clock never changes
+    flops = [node for node in netlist.state if None not in netlist.fanin[node]]
+    if flops:
+        lines.append("    {}, = {},".format(", ".join(f"v[{q}]" for q in flops),
+                                            ", ".join(f"v[{netlist.fanin[q][0]}]" for q in flops)))
+    lines.append("    pass")
+    lines.append("def settle(v):")
+    for node in netlist.order:
+        if netlist.ops[node] is None:
+            continue
+        drivers = netlist.fanin[node]
+        operands = [f"v[{d}]" for d in drivers]
+        if None in drivers:
+            expression = "None"
+        elif netlist.types[node] in _EXPRESSIONS and netlist.widths[node] == 1:
+            expression = _EXPRESSIONS[netlist.types[node]].format(*operands)
+        else:
+            expression = "ops[{}]([{}], {})".format(node, ", ".join(operands), netlist.masks[node])
+        lines.append(f"    v[{node}] = {expression}")
+    lines.append("    pass")
+    namespace = {"ops": netlist.ops}
+    exec("\n".join(lines), namespace)
+    return namespace["capture"], namespace["settle"]
+
+
+class CycleSimulator:
+    """Zero-delay simulation of a synchronous netlist, one step per clock cycle.
+
+    Like EventSimulator it works on netlist.values.  Only netlists accepted by
+    supports() can be run: every flip-flop is clocked straight from a Clock,
+    all Clocks share one period and nothing else reads a Clock.
+    """
+
+    def __init__(self, netlist):
+        if not self.supports(netlist):
+            raise ValueError("Circuit is not synchronous; use EventSimulator")
+        self.netlist = netlist
+        if not netlist.evaluated:
+            netlist.evaluate()
+        self.values = netlist.values
+        self.cycles = 0
+        self._capture, self._settle = _compile(netlist)
+
+    @staticmethod
+    def supports(netlist, periods=None):
+        if netlist.cyclic or any(netlist.types[node] != "D Flip-Flop" for node in netlist.state):
+            return False
+        if len(set((periods or {}).values())) > 1:
+            return False
+        clocks = set(netlist.clocks)
+        for node, drivers in enumerate(netlist.fanin):
+            for socket, driver in enumerate(drivers):
+                clocked = node in netlist.state and socket == 1
+                if clocked != (driver in clocks) and not (clocked and driver is None):
+                    return False
+        return True
+
+    def settle(self):
+        try:
+            self._settle(self.values)
+        except TypeError:
+            # An undefined value reached a gate; take the slow path that
+            # knows how to propagate it
+            self.netlist.evaluate()
+
+    def cycle(self, input_values=None):
+        """Apply input_values (Input node -> 0/1), then clock every flip-flop once"""
+        if input_values:
+            for node, value in input_values.items():
+                self.values[node] = value
+            self.settle()
+        self._capture(self.values)
+        self.settle()
+        self.cycles += 1
+
+
+def run_cycles(netlist, cycles, vectors=None, delays=None, periods=None):
+    """Yield the Output values after each of `cycles` clock cycles.
+
+    vectors, if given, yields {Input node: value} dicts applied at the start of
+    successive cycles; the last one stays in force once they run out.  Gate
+    delays only matter to the event-driven simulator, which is used when the
+    circuit is not synchronous.
+    """
+    vectors = iter(vectors or ())
+    outputs = netlist.outputs
+    values = netlist.values
+    if CycleSimulator.supports(netlist, periods):
+        simulator = CycleSimulator(netlist)
+        for _ in range(cycles):
+            simulator.cycle(next(vectors, None))
+            yield [values[node] for node in outputs]
+        return
+
+    simulator = EventSimulator(netlist, delays, periods)
+    period = max(simulator.periods.values(), default=DEFAULT_PERIOD)
+    for cycle in range(cycles):
+        for node, value in (next(vectors, None) or {}).items():
+            simulator.set_input(node, value)
+        # Sample just before the next cycle starts
+        simulator.run_until((cycle + 1) * period - 1)
+        yield [values[node] for node in outputs]
@@ -0,0 +1,109 @@
+"""Background evaluation for the editor.
+
+Evaluating a large circuit can take long enough to freeze the window, so the
+editor hands the work to a JobRunner instead.  A job works on a snapshot of
+the netlist (see Netlist.snapshot), never on the netlist the editor shows,
+and its result is passed to a callback on the worker thread; the editor
+forwards it to the GUI thread through a queued signal.  Submitting a job
+cancels the one before it, so while the user keeps editing only the newest
+state is evaluated to the end.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_sim import write_truth_table
+from bdd import check_equivalence
+from logic_opt import optimize
+from netlist import EvaluationCancelled
+from netlist_io import load_netlist
+
+
+class Job:
+    def __init__(self, function, args, done):
+        self.function = function
+        self.args = args
+        self.done = done  # Called as done(job, result, error) unless cancelled
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            result = self.function(*self.args, cancel=self.cancelled)
+        except EvaluationCancelled:
+            return
+        except Exception as error:
+            self.done(self, None, error)
+            return
+        if not self.cancelled.is_set():
+            self.done(self, result, None)
+
+
+class JobRunner:
+    """Runs jobs one at a time on a background thread; a new job cancels the last"""
+
+    def __init__(self, name="simulation"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._current = None
+
+    def submit(self, function, args, done):
+        """Queue function(*args, cancel=event) and return its Job"""
+        self.cancel()
+        job = self._current = Job(function, args, done)
+        self._executor.submit(job.run)
+        return job
+
+    def cancel(self):
+        """Cancel the newest job, if it has not finished yet"""
+        if self._current is not None:
+            self._current.cancel()
+            self._current = None
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def evaluate_job(snapshot, input_values, cancel=None):
+    """Bring a netlist snapshot up to date with input_values and return it.
+
+    Only the fanout of Inputs whose value differs from the snapshot is
+    re-evaluated, so a job also covers the edits of any job it cancelled.
+    """
+    if snapshot.evaluated:
+        snapshot.propagate(input_values, cancel)
+    else:
+        snapshot.evaluate(input_values, cancel)
+    return snapshot
+
+
+def profiled_evaluate_job(snapshot, input_values, profiler, cancel=None):
+    """evaluate_job that also records what it evaluated, and how long it took, in a Profiler"""
+    full = not snapshot.evaluated
+    start = time.perf_counter()
+    changed = snapshot.propagate(input_values, cancel)
+    profiler.record_evaluation(snapshot, changed, full, start, time.perf_counter() - start)
+    return snapshot
+
+
+def truth_table_job(snapshot, file_name, cancel=None):
+    """Optimize a netlist snapshot and write its truth table; returns (rows, report)"""
+    optimized, report = optimize(snapshot)
+    with open(file_name, "w") as file:
+        rows = write_truth_table(optimized, file, cancel=cancel)
+    return rows, report
+
+
+def equivalence_job(first, second, cancel=None):
+    """Optimize two netlist snapshots and compare them; see bdd.check_equivalence"""
+    return check_equivalence(optimize(first)[0], optimize(second)[0], cancel)
+
+
+def import_job(file_name, cancel=None):
+    """Read a BLIF or structural Verilog file into a CircuitData; see netlist_io.py"""
+    return load_netlist(file_name)
@@ -0,0 +1,193 @@
+"""Command-line circuit simulator.
+
+Runs a circuit saved by the node editor without starting the GUI; PyQt5 is
+never imported, so it starts quickly and works on machines without a display.
+
+    python simulate.py circuit.lcb vectors.txt
+    cat vectors.txt | python simulate.py circuit.jsonl
+    python simulate.py circuit.lcb --stored
+    python simulate.py counter.lcb --cycles 1000000
+    python simulate.py counter.lcb --cycles 1000000 --record runs/out --record-format binary
+
+Each input vector is a line of 0/1 characters, one per Input node, ordered
+top-to-bottom then left-to-right as in the editor (spaces and commas are
+ignored).  One line of output values is written per vector, in the same order
+for the Output and Write Output nodes.  The netlist is optimized first (see
+logic_opt.py) and vectors are simulated in bit-parallel batches, so results
+stream out while the input is still being read.  Outputs that carry a bus
+are printed in hexadecimal, separated by spaces; they work with --stored and
+--cycles, but not with vectors, since a bus does not fit a bit-parallel batch.
+
+With --cycles the circuit is clocked instead (see sequential.py): one line of
+Output values is written after every clock cycle.  The stored Input values are
+used, or, when a vectors file is given, vector k is applied in cycle k.
+
+Netlists written by synthesis tools, BLIF (.blif) or flat structural Verilog
+(.v), are simulated as they are; see netlist_io.py.
+
+With --record PREFIX the values of the Write Output nodes are also appended to
+PREFIX1.txt, PREFIX2.txt, ... (or .csv/.bin, see output_sink.py).
+"""
+
+import argparse
+import sys
+from itertools import islice
+
+from batch_sim import simulate_columns
+from circuit_io import CircuitFormatError, load_circuit
+from logic_opt import optimize
+from netlist import Netlist, format_value, parse_bit
+from netlist_io import BLIF_EXTENSION, VERILOG_EXTENSION, load_netlist
+from output_sink import FORMAT_EXTENSIONS, open_sink
+from sequential import read_timing, run_cycles
+
+DEFAULT_BATCH = 4096
+
+
+def read_vectors(stream):
+    """Yield the input vectors of a stream, skipping blank lines and # comments"""
+    for line in stream:
+        line = line.split("#", 1)[0].replace(",", "").replace(" ", "").strip()
+        if line:
+            yield line
+
+
+def run_vectors(netlist, vectors, output, batch=DEFAULT_BATCH, separator="", sinks=None):
+    """Simulate vectors in batches and write one result line per vector; returns the count.
+
+    sinks maps positions in netlist.outputs to OutputSinks that receive the
+    values of that output as well.
+    """
+    vectors = iter(vectors)
+    count = 0
+    while True:
+        chunk = list(islice(vectors, batch))
+        if not chunk:
+            return count
+        columns = simulate_columns(netlist, chunk)
+        for position, sink in (sinks or {}).items():
+            sink.append_bits(columns[position])
+        results = ["".join(row) for row in zip(*columns)] if columns else [""] * len(chunk)
+        if separator:
+            results = [separator.join(result) for result in results]
+        output.write("\n".join(results))
+        output.write("\n")
+        count += len(chunk)
+
+
+def run_stored(netlist, circuit, output, separator="", sinks=None):
+    """Evaluate once with the Input values saved in the circuit file"""
+    inputs = {node: parse_bit(circuit.values[node]) for node in netlist.inputs}
+    values = netlist.evaluate(inputs)
+    results = [format_value(values[node], netlist.widths[node]) or "-" for node in netlist.outputs]
+    for position, sink in (sinks or {}).items():
+        node = netlist.outputs[position]
+        sink.append(values[node], width=netlist.widths[node])
+    output.write((separator or bus_separator(netlist)).join(results) + "\n")
+
+
+def bus_separator(netlist):
+    """Bus values take several characters, so they need separating even without --csv"""
+    return " " if any(netlist.widths[node] > 1 for node in netlist.outputs) else ""
+
+
+def run_clocked(netlist, circuit, cycles, vectors, output, separator="", sinks=None):
+    """Run `cycles` clock cycles and write the Output values after each one"""
+    delays, periods = read_timing(netlist, lambda key: circuit.values[key] if isinstance(key, int) else "")
+    netlist.evaluate({node: parse_bit(circuit.values[node]) for node in netlist.inputs})
+
+    def input_values(vector):
+        if len(vector) != len(netlist.inputs):
+            raise ValueError(f"Expected {len(netlist.inputs)} input bits per vector, got {len(vector)}")
+        return {node: parse_bit(bit) for node, bit in zip(netlist.inputs, vector)}
+
+    vectors = map(input_values, vectors) if vectors is not None else None
+    results = run_cycles(netlist, cycles, vectors, delays, periods)
+    widths = [netlist.widths[node] for node in netlist.outputs]
+    while True:
+        chunk = list(islice(results, DEFAULT_BATCH))
+        if not chunk:
+            return
+        rows = [[format_value(value, width) or "-" for value, width in zip(values, widths)] for values in chunk]
+        for position, sink in (sinks or {}).items():
+            if widths[position] > 1:
+                for values in chunk:
+                    sink.append(values[position], width=widths[position])
+            else:
+                sink.append_bits("".join(row[position] for row in rows))
+        lines = [(separator or bus_separator(netlist)).join(row) for row in rows]
+        output.write("\n".join(lines))
+        output.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a saved logic circuit without the GUI.")
+    parser.add_argument("circuit", help="circuit file saved by the editor (.lcb or .jsonl), or a .blif or .v netlist")
+    parser.add_argument("vectors", nargs="?", help="file of input vectors (default: standard input)")
+    parser.add_argument("--stored", action="store_true",
+                        help="evaluate once with the Input values stored in the circuit")
+    parser.add_argument("--csv", action="store_true", help="separate output values with commas")
+    parser.add_argument("--cycles", type=int,
+                        help="clock the circuit for this many cycles (sequential circuits)")
+    parser.add_argument("--record", metavar="PREFIX",
+                        help="append the values of Write Output node n to PREFIX<n> as well")
+    parser.add_argument("--record-format", choices=sorted(FORMAT_EXTENSIONS), default="text",
+                        help="file format for --record (default text)")
+    parser.add_argument("--report", action="store_true",
+                        help="print what the optimizer removed to standard error")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH,
+                        help=f"vectors simulated per bit-parallel pass (default {DEFAULT_BATCH})")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.circuit.lower().endswith((BLIF_EXTENSION, VERILOG_EXTENSION)):
+            circuit = load_netlist(args.circuit)
+        else:
+            circuit = load_circuit(args.circuit)
+    except (OSError, CircuitFormatError) as error:
+        print(f"Could not open {args.circuit}: {error}", file=sys.stderr)
+        return 1
+    try:
+        netlist, report = optimize(Netlist.from_circuit(circuit))
+    except ValueError as error:  # A subcircuit that contains itself or holds state
+        print(f"Could not compile {args.circuit}: {error}", file=sys.stderr)
+        return 1
+    if args.report:
+        print(f"Optimized: {report}", file=sys.stderr)
+    separator = "," if args.csv else ""
+
+    sinks = {}
+    try:
+        if args.record:
+            extension = FORMAT_EXTENSIONS[args.record_format]
+            writes = [position for position, node in enumerate(netlist.outputs)
+                      if netlist.types[node] == "Write Output"]
+            if not writes:
+                print("Nothing to record: the circuit has no Write Output nodes", file=sys.stderr)
+            for number, position in enumerate(writes, start=1):
+                sinks[position] = open_sink(f"{args.record}{number}{extension}", args.record_format)
+
+        if args.stored:
+            run_stored(netlist, circuit, sys.stdout, separator, sinks)
+        elif args.cycles is not None:
+            if args.vectors:
+                with open(args.vectors) as stream:
+                    run_clocked(netlist, circuit, args.cycles, read_vectors(stream), sys.stdout, separator, sinks)
+            else:
+                run_clocked(netlist, circuit, args.cycles, None, sys.stdout, separator, sinks)
+        elif args.vectors:
+            with open(args.vectors) as stream:
+                run_vectors(netlist, read_vectors(stream), sys.stdout, max(1, args.batch), separator, sinks)
+        else:
+            run_vectors(netlist, read_vectors(sys.stdin), sys.stdout, max(1, args.batch), separator, sinks)
+    except (OSError, ValueError) as error:
+        print(f"Simulation failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        for sink in sinks.values():
+            sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
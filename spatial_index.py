@@ -0,0 +1,88 @@
+"""Uniform grid hash for point lookups in scene coordinates.
+
+Used by the editor to find sockets near the mouse without asking the
+QGraphicsScene for every item under the cursor.  Points are bucketed into
+square cells of `cell_size`; a radius query only visits the cells the circle
+overlaps, so its cost depends on local density rather than scene size.
+"""
+
+import math
+
+
+class SpatialHash:
+    def __init__(self, cell_size=50):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell y) -> {key: None}
+        self.positions = {}  # key -> (x, y)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, key, x, y):
+        """Add a point, or move it if the key is already indexed"""
+        if key in self.positions:
+            self.move(key, x, y)
+            return
+        self.positions[key] = (x, y)
+        self.cells.setdefault(self._cell(x, y), {})[key] = None
+
+    def move(self, key, x, y):
+        """Update the position of an indexed point"""
+        old_x, old_y = self.positions[key]
+        self.positions[key] = (x, y)
+        old_cell = self._cell(old_x, old_y)
+        new_cell = self._cell(x, y)
+        if old_cell != new_cell:
+            self._remove_from_cell(old_cell, key)
+            self.cells.setdefault(new_cell, {})[key] = None
+
+    def remove(self, key):
+        """Forget a point; unknown keys are ignored"""
+        position = self.positions.pop(key, None)
+        if position is not None:
+            self._remove_from_cell(self._cell(*position), key)
+
+    def _remove_from_cell(self, cell, key):
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def query_rect(self, left, top, right, bottom):
+        """Return the keys whose points lie inside the rectangle"""
+        min_x, min_y = self._cell(left, top)
+        max_x, max_y = self._cell(right, bottom)
+        found = []
+        for cx in range(min_x, max_x + 1):
+            for cy in range(min_y, max_y + 1):
+                for key in self.cells.get((cx, cy), ()):
+                    x, y = self.positions[key]
+                    if left <= x <= right and top <= y <= bottom:
+                        found.append(key)
+        return found
+
+    def nearest(self, x, y, radius, accept=None):
+        """Return the key closest to (x, y) within radius, or None.
+
+        accept, if given, is called with each candidate key and can reject it.
+        """
+        best = None
+        best_distance = radius * radius
+        min_x, min_y = self._cell(x - radius, y - radius)
+        max_x, max_y = self._cell(x + radius, y + radius)
+        for cx in range(min_x, max_x + 1):
+            for cy in range(min_y, max_y + 1):
+                for key in self.cells.get((cx, cy), ()):
+                    px, py = self.positions[key]
+                    distance = (px - x) ** 2 + (py - y) ** 2
+                    if distance <= best_distance and (accept is None or accept(key)):
+                        best = key
+                        best_distance = distance
+        return best